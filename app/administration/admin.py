@@ -1,9 +1,11 @@
 from django.contrib import admin
+from django.db.models import F, Max
 from .models import (
     Direction, Group, Teacher, Student, Months, Lesson,
     HomeworkSubmission, Attendance, Expense, TeacherPayment,
     Invoice, Payment, FinancialReport, Classroom, Schedule, Lead,
-    PaymentNotification, DiscountRegulation, HomeworkFile
+    PaymentNotification, DiscountRegulation, HomeworkFile, Job,
+    TemplateMonth, TemplateLesson
 )
 
 
@@ -13,6 +15,34 @@ class DirectionAdmin(admin.ModelAdmin):
     search_fields = ("name",)
 
 
+class TemplateLessonInline(admin.TabularInline):
+    model = TemplateLesson
+    extra = 0
+
+
+@admin.register(TemplateMonth)
+class TemplateMonthAdmin(admin.ModelAdmin):
+    list_display = ("direction", "month_number", "title")
+    list_filter = ("direction",)
+    inlines = [TemplateLessonInline]
+
+
+class CurrentMonthFilter(admin.SimpleListFilter):
+    title = "Текущий месяц"
+    parameter_name = "current_month"
+
+    def lookups(self, request, model_admin):
+        longest = Group.objects.aggregate(longest=Max('duration_months'))['longest'] or 0
+        return [('last', "Последний месяц курса")] + [(str(n), str(n)) for n in range(1, longest + 1)]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'last':
+            return queryset.filter(progress_month=F('duration_months'))
+        if self.value():
+            return queryset.filter(progress_month=int(self.value()))
+        return queryset
+
+
 @admin.register(Group)
 class GroupAdmin(admin.ModelAdmin):
     list_display = (
@@ -27,10 +57,21 @@ class GroupAdmin(admin.ModelAdmin):
         "current_course",
         "current_month",
     )
-    list_filter = ("format", "direction", "creation_type", "age_group")
+    list_filter = ("format", "direction", "creation_type", "age_group", CurrentMonthFilter)
     search_fields = ("group_name", "direction__name", "teacher__first_name", "teacher__last_name")
     filter_horizontal = ("students",)
     readonly_fields = ("creation_date", "current_course", "current_month")
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_progress()
+
+    @admin.display(description="Текущий курс", ordering="progress_course")
+    def current_course(self, obj):
+        return obj.current_course
+
+    @admin.display(description="Текущий месяц", ordering="progress_month")
+    def current_month(self, obj):
+        return obj.current_month
     fieldsets = (
         ("Основная информация", {
             "fields": ("group_name", "direction", "age_group", "format", "duration_months", "planned_start", "creation_date", "creation_type")
@@ -182,4 +223,11 @@ class PaymentNotificationAdmin(admin.ModelAdmin):
 class DiscountRegulationAdmin(admin.ModelAdmin):
     list_display = ("discount_amount", "homework_points", "min_attendance")
     search_fields = ("discount_amount", "homework_points", "min_attendance")
-    list_filter = ("discount_amount", "homework_points", "min_attendance")
\ No newline at end of file
+    list_filter = ("discount_amount", "homework_points", "min_attendance")
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "worker", "created_by", "created_at", "finished_at")
+    list_filter = ("status", "kind")
+    readonly_fields = ("started_at", "finished_at", "worker", "error")
@@ -0,0 +1,229 @@
+import csv
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from app.administration.models import Invoice
+from app.administration.services import allocate_payments
+from app.users.models import CustomUser
+
+
+# Импорт банковской выписки: строки читаются по одной (CSV — из потока,
+# XLSX — openpyxl в режиме read_only), сопоставляются с учениками по
+# словарям, построенным один раз, и разносятся пачками по IMPORT_BATCH_SIZE
+# через allocate_payments. В памяти — словари учеников и открытых счетов
+# и одна пачка, сколько бы строк ни было в выписке. Вся выписка — одна
+# транзакция: на время импорта остальные записи в SQLite ждут
+IMPORT_BATCH_SIZE = 500
+# Сколько несопоставленных строк перечислять в отчёте; счётчик — полный
+REPORT_LIMIT = 1000
+
+# Заголовок колонки (в нижнем регистре) -> поле строки
+COLUMNS = {
+    'date': 'date', 'дата': 'date', 'дата операции': 'date',
+    'amount': 'amount', 'сумма': 'amount', 'кредит': 'amount', 'поступление': 'amount',
+    'phone': 'phone', 'телефон': 'phone',
+    'username': 'username', 'логин': 'username',
+    'invoice': 'invoice', 'invoice_id': 'invoice', 'счёт': 'invoice', 'счет': 'invoice',
+    'comment': 'comment', 'комментарий': 'comment', 'назначение платежа': 'comment', 'назначение': 'comment',
+}
+IDENTIFIERS = ('invoice', 'username', 'phone')
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d.%m.%Y %H:%M', '%d.%m.%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S')
+
+
+def read_rows(file, filename):
+    """
+    Строки выписки как кортежи значений; первая — заголовок. Битый файл,
+    не тот формат или кодировка — ValueError с номером строки, в том числе
+    посреди чтения
+    """
+    if filename.lower().endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+            from openpyxl.utils.exceptions import InvalidFileException
+        except ImportError:
+            raise ValueError("Для импорта XLSX нужен пакет openpyxl")
+        rows = _xlsx_rows(file, load_workbook)
+        errors = (InvalidFileException, zipfile.BadZipFile, KeyError, OSError)
+        message = "Файл не читается как XLSX"
+    else:
+        rows = _csv_rows(file)
+        errors = (csv.Error, UnicodeDecodeError)
+        message = "CSV-выписка не читается (нужна кодировка UTF-8)"
+    number = 0
+    try:
+        for number, row in enumerate(rows, start=1):
+            yield row
+    except errors:
+        raise ValueError(f"{message}: строка {number + 1}")
+
+
+def _xlsx_rows(file, load_workbook):
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _csv_rows(file):
+    sample = file.read(4096).decode('utf-8-sig', errors='ignore')
+    file.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    # Строки декодируются по одной: ошибка кодировки приходится на свою строку
+    yield from csv.reader((line.decode('utf-8-sig') for line in file), dialect)
+
+
+def phone_key(phone):
+    """Последние 9 цифр: +996 555 123456, 0555123456 и 555123456 — один номер"""
+    digits = re.sub(r'\D', '', str(phone or ''))
+    return digits[-9:] if len(digits) >= 9 else None
+
+
+def build_lookups():
+    """
+    Словари сопоставления: телефон, логин, id открытого счёта -> id ученика.
+    Оплаченные счета не грузятся — словарь растёт с числом открытых счетов,
+    а не с историей; строка с id оплаченного счёта сопоставляется по
+    логину или телефону
+    """
+    phones, usernames = {}, {}
+    for user_id, username, phone in CustomUser.objects.filter(role='Student').values_list('id', 'username', 'phone'):
+        usernames[username.lower()] = user_id
+        key = phone_key(phone)
+        if key:
+            # Один номер у нескольких учеников — по телефону не сопоставляем
+            phones[key] = user_id if phones.get(key, user_id) == user_id else None
+    invoices = dict(Invoice.objects.exclude(status='paid').values_list('id', 'student_id'))
+    return {'invoice': invoices, 'username': usernames, 'phone': phones}
+
+
+def parse_amount(value):
+    """
+    Сумма строки с точностью до копеек; None, если её нет, это не конечное
+    число (nan, inf) или оно не помещается в точность Decimal
+    """
+    if isinstance(value, (int, float, Decimal)):
+        text = str(value)
+    else:
+        text = re.sub(r'[\s ]', '', str(value or '')).replace(',', '.')
+    try:
+        amount = Decimal(text)
+        return amount.quantize(Decimal('0.01')) if amount.is_finite() else None
+    except InvalidOperation:
+        return None
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value if timezone.is_aware(value) else timezone.make_aware(value)
+    if isinstance(value, date):
+        return timezone.make_aware(datetime(value.year, value.month, value.day))
+    text = str(value or '').strip()
+    if not text:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return timezone.make_aware(datetime.strptime(text, fmt))
+        except ValueError:
+            continue
+    raise ValueError(text)
+
+
+def match_student(row, lookups):
+    """(id ученика, id счёта) по первому сработавшему идентификатору: счёт, логин, телефон"""
+    invoice = str(row.get('invoice') or '').strip()
+    if invoice.isdigit() and int(invoice) in lookups['invoice']:
+        return lookups['invoice'][int(invoice)], int(invoice)
+    username = str(row.get('username') or '').strip().lower()
+    if username in lookups['username']:
+        return lookups['username'][username], None
+    student_id = lookups['phone'].get(phone_key(row.get('phone')))
+    return student_id, None
+
+
+def import_statement(file, filename):
+    """
+    Импортирует выписку и возвращает отчёт сверки: сколько строк прочитано,
+    сопоставлено и разнесено, и несопоставленные строки с причиной.
+
+    Выписка импортируется целиком или никак: пачки пишутся в одной
+    транзакции, и ValueError на любой строке (битый файл посреди чтения)
+    откатывает уже разнесённые — повторная загрузка не задвоит оплаты
+    """
+    with transaction.atomic():
+        return _import_rows(file, filename)
+
+
+def _import_rows(file, filename):
+    rows = read_rows(file, filename)
+    header = next(rows, None)
+    columns = [COLUMNS.get(str(title or '').strip().lower()) for title in header or ()]
+    if 'amount' not in columns or not set(IDENTIFIERS) & set(columns):
+        raise ValueError(
+            "В выписке нужны колонка суммы (amount/сумма) и хотя бы одна из: "
+            "invoice/счёт, username/логин, phone/телефон"
+        )
+
+    lookups = build_lookups()
+    report = {'rows': 0, 'matched': 0, 'payments': 0, 'amount': Decimal('0'), 'unmatched_count': 0, 'unmatched': []}
+
+    def unmatched(line, reason, row):
+        report['unmatched_count'] += 1
+        if len(report['unmatched']) < REPORT_LIMIT:
+            report['unmatched'].append({
+                'row': line, 'reason': reason,
+                **{field: str(row.get(field) or '') for field in ('date', 'amount', *IDENTIFIERS)},
+            })
+
+    def flush(batch):
+        for (line, row, amount, _), payments in zip(batch, allocate_payments([item for *_, item in batch])):
+            if payments:
+                report['matched'] += 1
+                report['payments'] += len(payments)
+                report['amount'] += amount
+            else:
+                unmatched(line, "У ученика нет открытых счетов", row)
+        batch.clear()
+
+    batch = []
+    for line, values in enumerate(rows, start=2):
+        if not any(value not in (None, '') for value in values):
+            continue
+        report['rows'] += 1
+        row = {field: value for field, value in zip(columns, values) if field}
+
+        amount = parse_amount(row.get('amount'))
+        if amount is None or amount <= 0:
+            unmatched(line, "Нет суммы поступления", row)
+            continue
+        try:
+            paid_at = parse_date(row.get('date'))
+        except ValueError:
+            unmatched(line, "Не распознана дата", row)
+            continue
+        student_id, invoice_id = match_student(row, lookups)
+        if student_id is None:
+            unmatched(line, "Ученик не найден", row)
+            continue
+
+        batch.append((line, row, amount, {
+            'student_id': student_id, 'invoice_id': invoice_id, 'date': paid_at,
+            'amounts': {'transfer_amount': amount}, 'comment': str(row.get('comment') or '').strip(),
+        }))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush(batch)
+    if batch:
+        flush(batch)
+
+    # Строки без открытых счетов выясняются при сбросе пачки — возвращаем порядок файла
+    report['unmatched'].sort(key=lambda row: row['row'])
+    report['amount'] = f"{report['amount']:.2f}"
+    return report
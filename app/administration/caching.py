@@ -0,0 +1,89 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Cast, Concat
+from django.utils import timezone
+
+from app.administration.models import DataVersion, Group
+
+
+def group_key(group_id):
+    return f"group:{group_id}"
+
+
+def table_key(model):
+    return f"table:{model._meta.label_lower}"
+
+
+def get_versions(keys):
+    """Текущие версии ключей одним запросом. Ключ без строки — версия 0"""
+    versions = dict.fromkeys(keys, 0)
+    versions.update(DataVersion.objects.filter(key__in=versions).values_list('key', 'version'))
+    return versions
+
+
+def student_group_versions(user):
+    """
+    Версии всех групп ученика одним запросом: ключи строятся подзапросом.
+    Группа без строки версии в ответ не попадает — вступление в группу
+    всегда увеличивает её версию, так что строка к этому моменту есть
+    """
+    keys = Group.objects.filter(students=user).annotate(
+        version_key=Concat(Value('group:'), Cast('id', CharField()))
+    ).values('version_key')
+    return dict(DataVersion.objects.filter(key__in=keys).values_list('key', 'version'))
+
+
+def bump_versions(keys):
+    """Увеличивает версии ключей — кэш, построенный на старых версиях, больше не читается"""
+    keys = set(keys)
+    if not keys:
+        return
+    DataVersion.objects.bulk_create([DataVersion(key=key) for key in keys], ignore_conflicts=True)
+    DataVersion.objects.filter(key__in=keys).update(version=F('version') + 1)
+
+
+def bump_group_versions(group_ids):
+    bump_versions(group_key(group_id) for group_id in group_ids if group_id)
+
+
+def bump_table_versions(models):
+    bump_versions(table_key(model) for model in models)
+
+
+def cached_response_data(endpoint, versions, request, build, per_user=False):
+    """
+    Возвращает данные ответа из кэша или строит их через build() и кэширует.
+
+    Ключ — (endpoint, версии, роль пользователя, параметры запроса, дата),
+    плюс id пользователя, если ответ у каждого свой. Дата нужна потому, что
+    текущий месяц группы меняется без записи в БД. Версии запрашиваются
+    вызывающим кодом одним запросом; больше при попадании в кэш БД не
+    трогается.
+    """
+    parts = [
+        getattr(request.user, 'role', '') or '',
+        request.GET.urlencode(),
+        timezone.localdate().isoformat(),
+    ]
+    if per_user:
+        parts.append(str(request.user.pk))
+    return cached_data(f'response:{endpoint}', versions, parts, build)
+
+
+def cached_data(prefix, versions, parts, build):
+    """
+    Кэш произвольных данных под ключом (prefix, версии, parts). Ключ
+    хэшируется, так что подходит любой бэкенд кэша, включая файловый
+    и локальную память
+    """
+    key_parts = [','.join(f"{key}={version}" for key, version in sorted(versions.items())), *parts]
+    cache_key = f'{prefix}:' + hashlib.md5('|'.join(key_parts).encode()).hexdigest()
+
+    data = cache.get(cache_key)
+    if data is None:
+        data = build()
+        cache.set(cache_key, data, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 3600))
+    return data
@@ -0,0 +1,81 @@
+from django.db.models import Count, Q
+
+from app.administration.caching import cached_data, get_versions, table_key
+from app.administration.models import Direction, Group, Student, Teacher
+from app.users.models import CustomUser
+
+
+# Фасеты зависят только от этих таблиц; их версии увеличивают сигналы
+# (см. signals.TABLE_VERSIONED_MODELS), так что индекс в кэше не устаревает
+FACET_MODELS = (Direction, Group, CustomUser, Student, Teacher)
+
+
+def _named_teachers():
+    return CustomUser.objects.filter(role='Teacher').exclude(
+        Q(last_name__isnull=True) | Q(last_name='') |
+        Q(first_name__isnull=True) | Q(first_name='')
+    )
+
+
+def _student_facets():
+    return {
+        'directions': list(
+            Direction.objects.values('name')
+            .annotate(count=Count('groups__student', distinct=True)).order_by('name')
+        ),
+        'groups': [
+            {'name': name, 'count': count}
+            for name, count in Group.objects.values('group_name')
+            .annotate(count=Count('student', distinct=True))
+            .order_by('group_name').values_list('group_name', 'count')
+        ],
+        'teachers': [
+            {'name': f"{last} {first}", 'count': count}
+            for last, first, count in _named_teachers().values('last_name', 'first_name')
+            .annotate(count=Count('group__student', distinct=True))
+            .order_by('last_name', 'first_name').values_list('last_name', 'first_name', 'count')
+        ],
+    }
+
+
+def _teacher_facets():
+    return {
+        'directions': list(
+            Direction.objects.values('name')
+            .annotate(count=Count('teachers', distinct=True)).order_by('name')
+        ),
+    }
+
+
+def _group_facets():
+    return {
+        'directions': list(
+            Direction.objects.values('name')
+            .annotate(count=Count('groups', distinct=True)).order_by('name')
+        ),
+    }
+
+
+# для какой таблицы -> построитель фасетов
+FACET_BUILDERS = {
+    'students': _student_facets,
+    'teachers': _teacher_facets,
+    'groups': _group_facets,
+}
+
+
+def get_facets(target):
+    """
+    Значения фильтров таблицы с количеством строк на значение. Берутся из
+    кэша: при попадании в кэш — один запрос версий таблиц
+    """
+    versions = get_versions([table_key(model) for model in FACET_MODELS])
+    return cached_data(f'facets:{target}', versions, [], FACET_BUILDERS[target])
+
+
+def facet_names(facets):
+    """Старый формат блока filters: только названия значений"""
+    return {
+        facet: [value['name'] for value in values]
+        for facet, values in facets.items()
+    }
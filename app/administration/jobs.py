@@ -0,0 +1,167 @@
+import logging
+import traceback
+
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from app.administration.models import Job, Group
+
+
+logger = logging.getLogger(__name__)
+
+# kind -> функция-обработчик. Обработчик получает Job, возвращает
+# JSON-совместимый результат и при необходимости сохраняет job.result_file
+JOB_HANDLERS = {}
+
+# Как часто run_worker отмечает свои выполняемые задачи и через сколько
+# задача без отметки считается брошенной. После MAX_ATTEMPTS захватов
+# задача, на которой обработчик каждый раз падает, помечается ошибкой
+HEARTBEAT_INTERVAL = timedelta(seconds=30)
+STALE_AFTER = timedelta(minutes=5)
+MAX_ATTEMPTS = 3
+
+
+def job_handler(kind):
+    """Регистрирует обработчик фоновой задачи указанного типа"""
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue_job(kind, params=None, user=None):
+    """Ставит задачу в очередь. Выполнит её команда run_worker"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Неизвестный тип задачи: {kind}")
+    created_by = user if user is not None and user.is_authenticated else None
+    return Job.objects.create(kind=kind, params=params or {}, created_by=created_by)
+
+
+def claim_job(worker_name):
+    """
+    Забирает из очереди самую старую задачу и помечает её как выполняемую.
+
+    На СУБД с SELECT ... FOR UPDATE SKIP LOCKED строка блокируется. SQLite
+    таких блокировок не умеет, поэтому захват подтверждается условным UPDATE:
+    он выполняется под единственной блокировкой записи SQLite, и задачу
+    получает только тот обработчик, чей UPDATE изменил строку.
+    """
+    pending = Job.objects.filter(status='pending').order_by('created_at', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job_ids = list(pending.select_for_update(skip_locked=True).values_list('id', flat=True)[:1])
+            return _mark_running(job_ids, worker_name)
+
+    # SQLite: без явной транзакции, чтобы не повышать блокировку чтения до записи
+    job_ids = list(pending.values_list('id', flat=True)[:10])
+    return _mark_running(job_ids, worker_name)
+
+
+def _mark_running(job_ids, worker_name):
+    for job_id in job_ids:
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=job_id, status='pending').update(
+            status='running',
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F('attempts') + 1,
+            worker=worker_name
+        )
+        if claimed:
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def heartbeat(job_ids):
+    """Отмечает, что обработчик жив и задачи job_ids ещё выполняются"""
+    if job_ids:
+        Job.objects.filter(pk__in=job_ids, status='running').update(heartbeat_at=timezone.now())
+
+
+def requeue_stale_jobs(stale_after=STALE_AFTER):
+    """
+    Возвращает в очередь задачи, обработчик которых перестал отмечаться
+    (процесс убит, сервер перезагружен). Исчерпавшие попытки — в ошибку.
+    Возвращает (возвращено, помечено ошибкой)
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(
+        Q(heartbeat_at__lt=now - stale_after) | Q(heartbeat_at__isnull=True, started_at__lt=now - stale_after),
+        status='running',
+    )
+    failed = stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status='failed', error="Обработчик перестал отвечать", finished_at=now
+    )
+    requeued = stale.update(status='pending', worker='', started_at=None, heartbeat_at=None)
+    return requeued, failed
+
+
+def run_job(job_id):
+    """Выполняет задачу и сохраняет результат. Вызывается в процессе пула"""
+    job = Job.objects.get(pk=job_id)
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError(f"Неизвестный тип задачи: {job.kind}")
+        job.result = handler(job)
+        job.status = 'done'
+    except Exception:
+        logger.exception("Job %s (%s) failed", job.pk, job.kind)
+        job.status = 'failed'
+        job.error = traceback.format_exc()
+    job.finished_at = timezone.now()
+    job.save(update_fields=['result', 'result_file', 'status', 'error', 'finished_at'])
+    return job.status
+
+
+# ---------------- Обработчики ----------------
+
+@job_handler('group_curriculum')
+def generate_group_curriculum(job):
+    from app.administration.services import generate_curriculum
+
+    group = Group.objects.get(pk=job.params['group_id'])
+    months = generate_curriculum(group)
+    return {'group_id': group.id, 'months': len(months)}
+
+
+@job_handler('teacher_payments')
+def teacher_payments(job):
+    from app.administration.services import calculate_teacher_payments
+
+    return calculate_teacher_payments(job.params['month'], job.params['year'])
+
+
+@job_handler('generate_invoices')
+def generate_month_invoices(job):
+    from app.administration.serializers import InvoiceGenerateSerializer
+    from app.administration.services import generate_invoices
+
+    serializer = InvoiceGenerateSerializer(data=job.params)
+    serializer.is_valid(raise_exception=True)
+    return generate_invoices(**serializer.to_service_kwargs())
+
+
+@job_handler('send_reports')
+def send_reports(job):
+    from app.utils import send_financial_reports_to_manager
+
+    send_financial_reports_to_manager()
+    return {"message": "Отчёты успешно отправлены!"}
+
+
+@job_handler('pdf_report')
+def pdf_report(job):
+    from app.administration.views import PDF_REPORT_VIEWS
+
+    view = PDF_REPORT_VIEWS[job.params['report']]()
+    params = job.params.get('params', {})
+    content = view.build_pdf(params)
+    filename = view.get_filename(params)
+    job.result_file.save(f"{job.pk}_{filename}", ContentFile(content), save=False)
+    return {'filename': filename, 'size': len(content)}
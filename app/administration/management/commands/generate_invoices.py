@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.administration.serializers import InvoiceGenerateSerializer
+from app.administration.services import generate_invoices
+
+
+class Command(BaseCommand):
+    help = (
+        "Выставляет счета за месяц курса всем активным ученикам активных групп. "
+        "Уже выставленные счета пропускаются"
+    )
+
+    def add_arguments(self, parser):
+        month = parser.add_mutually_exclusive_group(required=True)
+        month.add_argument('--month', type=int, dest='month_number', help="Номер месяца курса")
+        month.add_argument('--date', help="Дата (ГГГГ-ММ-ДД): у каждой группы — её текущий месяц")
+        parser.add_argument('--amount', required=True, help="Сумма счёта")
+        parser.add_argument('--due-date', required=True, help="Срок оплаты (ГГГГ-ММ-ДД)")
+        parser.add_argument('--discount', default='0', help="Скидка")
+        parser.add_argument('--group', type=int, action='append', dest='group_ids', help="id группы; можно несколько раз")
+        parser.add_argument('--comment', default='')
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать, ничего не создавая")
+
+    def handle(self, *args, **options):
+        data = {
+            key: options[key]
+            for key in ('month_number', 'date', 'amount', 'due_date', 'discount', 'group_ids', 'comment', 'dry_run')
+            if options[key] is not None
+        }
+        serializer = InvoiceGenerateSerializer(data=data)
+        if not serializer.is_valid():
+            raise CommandError(json.dumps(serializer.errors, ensure_ascii=False))
+
+        result = generate_invoices(**serializer.to_service_kwargs())
+        prefix = "Будет создано" if result['dry_run'] else "Создано"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} счетов: {result['created']} (месяцев: {result['months']}, "
+            f"уже выставлено: {result['already_billed']}, пропущено учеников: {result['skipped_students']})"
+        ))
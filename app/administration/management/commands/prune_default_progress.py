@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from app.administration.caching import bump_group_versions
+from app.administration.models import Attendance, HomeworkSubmission
+from app.administration.services import (
+    DEFAULT_ATTENDANCE_STATUS, DEFAULT_HOMEWORK_STATUS, sparse_progress
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Переводит прогресс в разреженный режим: удаляет строки посещаемости "
+        "и ДЗ, которые хранят только значения по умолчанию"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Сколько строк удалять за один запрос"
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Только посчитать строки, ничего не удаляя"
+        )
+
+    def handle(self, *args, **options):
+        if not sparse_progress():
+            self.stdout.write(self.style.WARNING(
+                "SPARSE_PROGRESS выключен: строки по умолчанию будут создаваться снова"
+            ))
+
+        attendances = Attendance.objects.filter(status=DEFAULT_ATTENDANCE_STATUS)
+        # ДЗ считается нетронутым, только если в нём нет ни оценки,
+        # ни комментария, ни ссылок, ни файлов
+        submissions = HomeworkSubmission.objects.filter(
+            Q(project_links=[]) | Q(project_links__isnull=True),
+            status=DEFAULT_HOMEWORK_STATUS,
+            score__isnull=True,
+            teacher_comment='',
+            homework_files__isnull=True,
+        )
+
+        for label, queryset in (("Посещаемость", attendances), ("Домашние задания", submissions)):
+            if options['dry_run']:
+                self.stdout.write(f"{label}: будет удалено {queryset.count()}")
+                continue
+            deleted = self.delete_in_batches(queryset, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"{label}: удалено {deleted}"))
+
+    def delete_in_batches(self, queryset, batch_size):
+        # Короткие транзакции не держат блокировку записи SQLite подолгу.
+        # Пачка удаляется одним DELETE без Collector (зависимых строк у
+        # отобранных записей нет — условие queryset повторяется в DELETE),
+        # версии групп пачки увеличиваются одним вызовом
+        deleted = 0
+        while True:
+            rows = list(queryset.order_by().values_list('id', 'lesson__month__group_id')[:batch_size])
+            if not rows:
+                return deleted
+            with transaction.atomic():
+                deleted += queryset.filter(id__in=[pk for pk, _ in rows])._raw_delete(queryset.db)
+                bump_group_versions({group_id for _, group_id in rows})
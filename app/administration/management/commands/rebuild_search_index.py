@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from app.administration.search import BATCH_SIZE, index_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Перестраивает полнотекстовый индекс поиска (ученики, преподаватели, "
+        "группы, заявки). Нужен после массовых правок в обход сигналов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help="Сколько документов записывать за один запрос"
+        )
+
+    def handle(self, *args, **options):
+        if not index_available():
+            self.stdout.write(self.style.WARNING("Индекс поиска есть только в SQLite (FTS5)"))
+            return
+        counts = rebuild_index(batch_size=options['batch_size'])
+        for label, count in counts.items():
+            self.stdout.write(f"{label}: {count}")
+        self.stdout.write(self.style.SUCCESS("Индекс перестроен"))
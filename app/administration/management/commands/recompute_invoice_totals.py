@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from app.administration.caching import bump_table_versions
+from app.administration.models import Invoice
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверяет оплаченную сумму и статус счетов с платежами и исправляет "
+        "разошедшиеся (после правок платежей в обход модели)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--invoice', type=int, action='append', dest='invoice_ids',
+            help="id счёта; можно указать несколько раз. По умолчанию — все счета"
+        )
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.all()
+        if options['invoice_ids']:
+            invoices = invoices.filter(pk__in=options['invoice_ids'])
+
+        fixed = invoices.recompute_totals()
+        if fixed:
+            # update() сигналов не шлёт — кэш таблиц сбрасываем сами
+            bump_table_versions([Invoice])
+        self.stdout.write(self.style.SUCCESS(f"Исправлено счетов: {fixed}"))
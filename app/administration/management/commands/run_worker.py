@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+
+# Модуль импортируется и в процессах пула до django.setup(),
+# поэтому модели подключаются только внутри функций
+
+def _init_process():
+    # Процессы пула запускаются через spawn и поднимают Django заново,
+    # не разделяя соединения с БД родительского процесса
+    django.setup()
+
+
+def _run_job(job_id):
+    from app.administration.jobs import run_job
+
+    return run_job(job_id)
+
+
+class Command(BaseCommand):
+    help = "Выполняет фоновые задачи из таблицы Job в пуле процессов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=2,
+            help="Количество процессов-исполнителей"
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help="Пауза между опросами очереди, секунды"
+        )
+        parser.add_argument(
+            '--stale-after', type=float, default=None,
+            help="Через сколько секунд без сигнала обработчика задача возвращается в очередь "
+                 "(по умолчанию jobs.STALE_AFTER)"
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Выполнить задачи, которые уже в очереди, и завершиться"
+        )
+
+    def handle(self, *args, **options):
+        from app.administration.jobs import (
+            HEARTBEAT_INTERVAL, STALE_AFTER, claim_job, heartbeat, requeue_stale_jobs
+        )
+        from app.administration.models import Job
+
+        processes = max(options['processes'], 1)
+        poll_interval = options['poll_interval']
+        worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        stale_after = timedelta(seconds=options['stale_after']) if options['stale_after'] else STALE_AFTER
+        next_heartbeat = 0
+
+        self.stdout.write(f"Обработчик {worker_name} запущен, процессов: {processes}")
+
+        running = {}
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_process) as pool:
+            try:
+                while True:
+                    # Отмечаем свои задачи и забираем брошенные упавшими обработчиками
+                    if time.monotonic() >= next_heartbeat:
+                        heartbeat(list(running.values()))
+                        requeued, failed = requeue_stale_jobs(stale_after)
+                        if requeued or failed:
+                            self.stdout.write(
+                                f"Брошенные задачи: возвращено в очередь {requeued}, ошибкой {failed}"
+                            )
+                        next_heartbeat = time.monotonic() + HEARTBEAT_INTERVAL.total_seconds()
+
+                    while len(running) < processes:
+                        job = claim_job(worker_name)
+                        if job is None:
+                            break
+                        self.stdout.write(f"Задача #{job.pk} ({job.kind}) взята в работу")
+                        running[pool.submit(_run_job, job.pk)] = job.pk
+
+                    if not running:
+                        if options['once']:
+                            break
+                        # Не держим соединение с SQLite открытым между опросами
+                        connections.close_all()
+                        time.sleep(poll_interval)
+                        continue
+
+                    done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job_id = running.pop(future)
+                        try:
+                            job_status = future.result()
+                        except Exception as e:
+                            # Процесс пула упал, не успев записать результат
+                            Job.objects.filter(pk=job_id, status='running').update(
+                                status='failed', error=str(e), finished_at=timezone.now()
+                            )
+                            job_status = f"ошибка пула: {e}"
+                        self.stdout.write(f"Задача #{job_id}: {job_status}")
+            except KeyboardInterrupt:
+                self.stdout.write("Остановка обработчика")
@@ -0,0 +1,50 @@
+# Generated by Django 4.2 on 2026-10-18 05:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administration', '0018_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TemplateMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month_number', models.PositiveIntegerField(verbose_name='Номер месяца')),
+                ('title', models.CharField(max_length=255, verbose_name='Название месяца')),
+                ('description', models.TextField(blank=True, verbose_name='Описание месяца')),
+                ('direction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='template_months', to='administration.direction')),
+            ],
+            options={
+                'verbose_name': 'Месяц шаблона',
+                'verbose_name_plural': 'Месяцы шаблонов',
+                'ordering': ['month_number'],
+                'unique_together': {('direction', 'month_number')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TemplateLesson',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.PositiveIntegerField(verbose_name='Порядковый номер')),
+                ('title', models.CharField(max_length=255, verbose_name='Название урока')),
+                ('description', models.TextField(blank=True, verbose_name='Описание урока')),
+                ('lesson_links', models.URLField(blank=True, verbose_name='Ссылки урока')),
+                ('homework_links', models.URLField(blank=True, verbose_name='Ссылки ДЗ')),
+                ('homework_description', models.TextField(blank=True, verbose_name='Описание задания')),
+                ('homework_requirements', models.TextField(blank=True, verbose_name='Требования к заданию')),
+                ('month', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lessons', to='administration.templatemonth')),
+            ],
+            options={
+                'verbose_name': 'Урок шаблона',
+                'verbose_name_plural': 'Уроки шаблонов',
+                'ordering': ['order'],
+                'unique_together': {('month', 'order')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 05:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administration', '0019_curriculum_templates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='group',
+            index=models.Index(fields=['creation_date', 'duration_months'], name='group_progress_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+from app.administration.search import CREATE_TABLE_SQL, SEARCH_TABLE, rebuild_index
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 есть только в SQLite; на других СУБД индекс не создаётся
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_TABLE_SQL)
+    rebuild_index(
+        user_model=apps.get_model('users', 'CustomUser'),
+        group_model=apps.get_model('administration', 'Group'),
+        lead_model=apps.get_model('administration', 'Lead'),
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administration', '0021_data_version'),
+        ('users', '0006_alter_customuser_is_staff'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-18 06:15
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_paid_total(apps, schema_editor):
+    Invoice = apps.get_model('administration', 'Invoice')
+    Payment = apps.get_model('administration', 'Payment')
+    paid = Payment.objects.filter(invoice=OuterRef('pk')).values('invoice').annotate(
+        total=Sum(F('cash_amount') + F('transfer_amount') + F('online_amount'))
+    ).values('total')
+    Invoice.objects.update(paid_total=Coalesce(
+        Subquery(paid, output_field=DecimalField(max_digits=12, decimal_places=2)), Value(0),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administration', '0022_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='paid_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='Оплачено'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'due_date'], name='invoice_status_due_idx'),
+        ),
+        migrations.RunPython(fill_paid_total, migrations.RunPython.noop),
+    ]
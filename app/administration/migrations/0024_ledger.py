@@ -0,0 +1,65 @@
+# Generated by Django 4.2 on 2026-10-18 06:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from collections import defaultdict
+
+
+def fill_ledger(apps, schema_editor):
+    """Журнал по истории: начисления и скидки на дату счёта, оплаты на дату платежа"""
+    Invoice = apps.get_model('administration', 'Invoice')
+    Payment = apps.get_model('administration', 'Payment')
+    LedgerEntry = apps.get_model('administration', 'LedgerEntry')
+
+    events = defaultdict(list)
+    for invoice in Invoice.objects.order_by('id').iterator():
+        events[invoice.student_id].append((invoice.date_created, 'charge', invoice.amount, invoice.id, None))
+        if invoice.discount:
+            events[invoice.student_id].append((invoice.date_created, 'discount', -invoice.discount, invoice.id, None))
+    for payment in Payment.objects.select_related('invoice').order_by('id').iterator():
+        total = payment.cash_amount + payment.transfer_amount + payment.online_amount
+        if total:
+            events[payment.invoice.student_id].append((payment.date, 'payment', -total, None, payment.id))
+
+    entries = []
+    for student_id, student_events in events.items():
+        balance = 0
+        for created_at, kind, amount, invoice_id, payment_id in sorted(student_events, key=lambda event: event[0]):
+            balance += amount
+            entries.append(LedgerEntry(
+                student_id=student_id, kind=kind, amount=amount, balance=balance,
+                invoice_id=invoice_id, payment_id=payment_id, created_at=created_at
+            ))
+    LedgerEntry.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('administration', '0023_invoice_paid_total'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('charge', 'Начисление'), ('discount', 'Скидка'), ('payment', 'Оплата'), ('adjustment', 'Корректировка')], max_length=20, verbose_name='Тип')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Сумма')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Долг после записи')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата')),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='administration.invoice', verbose_name='Счёт')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='administration.payment', verbose_name='Платёж')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL, verbose_name='Ученик')),
+            ],
+            options={
+                'verbose_name': 'Запись журнала расчётов',
+                'verbose_name_plural': 'Журнал расчётов',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.RunPython(fill_ledger, migrations.RunPython.noop),
+    ]
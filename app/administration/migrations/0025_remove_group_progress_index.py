@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 06:36
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administration', '0024_ledger'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='group',
+            name='group_progress_idx',
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from app.administration.search import rebuild_index
+
+
+def reindex_phone_tails(apps, schema_editor):
+    # Документы с телефонами пересобираются с хвостами номеров
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    rebuild_index(
+        user_model=apps.get_model('users', 'CustomUser'),
+        group_model=apps.get_model('administration', 'Group'),
+        lead_model=apps.get_model('administration', 'Lead'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administration', '0026_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(reindex_phone_tails, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,15 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction
 from django.forms import ValidationError
 from app.users.models import CustomUser
 from django.utils import timezone
 from django.db.models import Sum
 from django.db.models import Sum, F, ExpressionWrapper, DecimalField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, Max, OuterRef, Subquery, Value, When
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear
 
 
 class Direction(models.Model):
@@ -16,6 +22,77 @@ class Direction(models.Model):
     def __str__(self):
         return self.name
 
+def _months_passed(prefix, today):
+    return (
+        (models.Value(today.year) - ExtractYear(f'{prefix}creation_date')) * 12
+        + (models.Value(today.month) - ExtractMonth(f'{prefix}creation_date'))
+    )
+
+
+def current_course_expression(prefix='', today=None):
+    """
+    SQL-аналог Group.current_course. prefix — путь до группы
+    (например 'month__group__'), чтобы считать курс из связанных моделей.
+    """
+    today = today or timezone.now().date()
+    return ExpressionWrapper(
+        _months_passed(prefix, today) / F(f'{prefix}duration_months') + 1,
+        output_field=models.IntegerField()
+    )
+
+
+def current_month_expression(prefix='', today=None):
+    """SQL-аналог Group.current_month (остаток считается без MOD для переносимости)"""
+    today = today or timezone.now().date()
+    months_passed = _months_passed(prefix, today)
+    duration = F(f'{prefix}duration_months')
+    return ExpressionWrapper(
+        months_passed - months_passed / duration * duration + 1,
+        output_field=models.IntegerField()
+    )
+
+
+class GroupQuerySet(models.QuerySet):
+    def with_progress(self, today=None):
+        """
+        Добавляет progress_course и progress_month, вычисленные в БД.
+        Фильтр по ним индексом не ускоряется — это просмотр всех групп
+        """
+        return self.annotate(
+            progress_course=current_course_expression(today=today),
+            progress_month=current_month_expression(today=today),
+        )
+
+    def in_month(self, month_number, today=None):
+        """Группы, которые сейчас проходят month_number-й месяц курса"""
+        return self.with_progress(today).filter(progress_month=month_number)
+
+    def finishing(self, today=None):
+        """Группы в последнем месяце курса"""
+        return self.with_progress(today).filter(progress_month=F('duration_months'))
+
+    def with_table_progress(self):
+        """
+        Колонки таблицы групп подзапросами, без запросов на строку:
+        table_month — последний месяц с датированными уроками (иначе первый
+        месяц, а без месяцев — 1), last_lesson_order — номер последнего урока
+        по дате
+        """
+        months = Months.objects.filter(group=OuterRef('pk'))
+        last_lesson = Lesson.objects.filter(month__group=OuterRef('pk')).order_by('-date', '-order')
+        return self.annotate(
+            table_month=Coalesce(
+                Subquery(
+                    months.filter(lessons__date__isnull=False)
+                    .order_by('-month_number').values('month_number')[:1]
+                ),
+                Subquery(months.order_by('month_number').values('month_number')[:1]),
+                Value(1)
+            ),
+            last_lesson_order=Coalesce(Subquery(last_lesson.values('order')[:1]), Value(0)),
+        )
+
+
 class Group(models.Model):
     CREATION_TYPES = [
         ('auto', 'Автоматически'),
@@ -71,9 +148,13 @@ class Group(models.Model):
         blank=True, null=True
     )
 
+    objects = GroupQuerySet.as_manager()
+
     @property
     def current_course(self):
         """Возвращает номер текущего курса группы"""
+        if getattr(self, 'progress_course', None) is not None:
+            return self.progress_course
         if not self.creation_date:
             return 1
             
@@ -85,6 +166,8 @@ class Group(models.Model):
     @property
     def current_month(self):
         """Возвращает номер текущего месяца в курсе"""
+        if getattr(self, 'progress_month', None) is not None:
+            return self.progress_month
         if not self.creation_date:
             return 1
             
@@ -106,36 +189,10 @@ class Group(models.Model):
         super().save(*args, **kwargs)
 
 
-        if is_new and self.creation_type == 'auto':
-            for month_num in range(1, self.duration_months + 1):
-                month, _ = Months.objects.get_or_create(
-                    group=self,
-                    month_number=month_num,
-                    defaults={
-                        "title": f"Месяц {month_num}",
-                        "description": f"Описание месяца {month_num}"
-                    }
-                )
-                for lesson_num in range(1, self.lessons_per_month + 1):
-                    lesson, _ = Lesson.objects.get_or_create(
-                        month=month,
-                        order=lesson_num,
-                        defaults={
-                            "title": f"Урок {lesson_num}",
-                            "description": f"Описание урока {lesson_num}"
-                        }
-                    )
-                    for student in self.students.all():
-                        Attendance.objects.get_or_create(
-                            lesson=lesson,
-                            student=student,
-                            defaults={"status": "0"}
-                        )
-                        HomeworkSubmission.objects.get_or_create(
-                            lesson=lesson,
-                            student=student,
-                            defaults={"status": "black"}
-                        )
+        # defer_curriculum выставляется, когда генерация уходит в фоновую задачу
+        if is_new and self.creation_type == 'auto' and not getattr(self, 'defer_curriculum', False):
+            from app.administration.services import generate_curriculum
+            generate_curriculum(self)
 
 
 class Teacher(models.Model):
@@ -280,10 +337,82 @@ class Lesson(models.Model):
 
     def __str__(self):
         return f"{self.month} - Урок {self.order}"
+
+
+
+class TemplateMonth(models.Model):
+    """Месяц учебного плана направления — шаблон для месяцев групп"""
+    direction = models.ForeignKey(Direction, on_delete=models.CASCADE, related_name='template_months')
+    month_number = models.PositiveIntegerField(verbose_name="Номер месяца")
+    title = models.CharField(max_length=255, verbose_name="Название месяца")
+    description = models.TextField(blank=True, verbose_name="Описание месяца")
+
+    class Meta:
+        verbose_name = "Месяц шаблона"
+        verbose_name_plural = "Месяцы шаблонов"
+        ordering = ['month_number']
+        unique_together = ('direction', 'month_number')
+
+    def __str__(self):
+        return f"{self.direction} - Месяц {self.month_number}"
+
+
+class TemplateLesson(models.Model):
+    """Урок учебного плана направления — шаблон для уроков групп"""
+    month = models.ForeignKey(TemplateMonth, on_delete=models.CASCADE, related_name='lessons')
+    order = models.PositiveIntegerField(verbose_name="Порядковый номер")
+    title = models.CharField(max_length=255, verbose_name="Название урока")
+    description = models.TextField(blank=True, verbose_name="Описание урока")
+    lesson_links = models.URLField(blank=True, verbose_name="Ссылки урока")
+    homework_links = models.URLField(blank=True, verbose_name="Ссылки ДЗ")
+    homework_description = models.TextField(blank=True, verbose_name='Описание задания')
+    homework_requirements = models.TextField(blank=True, verbose_name='Требования к заданию')
+
+    class Meta:
+        verbose_name = "Урок шаблона"
+        verbose_name_plural = "Уроки шаблонов"
+        ordering = ['order']
+        unique_together = ('month', 'order')
+
+    def __str__(self):
+        return f"{self.month} - Урок {self.order}"
     
 
 
-class HomeworkSubmission(models.Model):
+class ProgressQuerySet(models.QuerySet):
+    """
+    Посещаемость и ДЗ. Приёмников post_delete у этих моделей нет: любой
+    приёмник отключает быстрое удаление Django, и каскад от урока, группы
+    или массовая чистка грузили бы каждую строку. Версии групп
+    увеличиваются здесь — один раз на удаление
+    """
+
+    def group_ids(self):
+        return set(self.order_by().values_list('lesson__month__group_id', flat=True).distinct())
+
+    def delete(self):
+        group_ids = self.group_ids()
+        result = super().delete()
+        _bump_group_versions(group_ids)
+        return result
+
+
+class ProgressDeleteMixin:
+    """Удаление одной строки прогресса тоже увеличивает версию её группы"""
+
+    def delete(self, *args, **kwargs):
+        group_ids = type(self).objects.filter(pk=self.pk).group_ids()
+        result = super().delete(*args, **kwargs)
+        _bump_group_versions(group_ids)
+        return result
+
+
+def _bump_group_versions(group_ids):
+    from app.administration.caching import bump_group_versions
+    bump_group_versions(group_ids)
+
+
+class HomeworkSubmission(ProgressDeleteMixin, models.Model):
     STATUS_CHOICES = [
         ('green', 'Правильно'),
         ('orange', 'Отправлено'),
@@ -323,7 +452,9 @@ class HomeworkSubmission(models.Model):
     score = models.PositiveIntegerField(null=True, blank=True, verbose_name="Оценка")
     teacher_comment = models.TextField(blank=True, verbose_name="Комментарий преподавателя")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
-    
+
+    objects = ProgressQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Домашнее задание"
         verbose_name_plural = "Домашние задания"
@@ -345,7 +476,7 @@ class HomeworkFile(models.Model):
 
 
 
-class Attendance(models.Model):
+class Attendance(ProgressDeleteMixin, models.Model):
     lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='attendances')
     student = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='attendances')
     STATUS_CHOICES = [
@@ -355,6 +486,8 @@ class Attendance(models.Model):
     ]
     status = models.CharField(max_length=10, choices=STATUS_CHOICES)
 
+    objects = ProgressQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Посещаемость"
         verbose_name_plural = "Посещаемости"
@@ -417,6 +550,61 @@ class TeacherPayment(models.Model):
 
 
 
+class InvoiceQuerySet(models.QuerySet):
+    def add_paid(self, delta):
+        """
+        Прибавляет delta к paid_total и пересчитывает статус одним UPDATE.
+        Выражения читают значения строки в момент записи, так что
+        параллельные платежи по одному счёту не теряются
+        """
+        return self.update(paid_total=F('paid_total') + delta, status=_status_for(F('paid_total') + delta))
+
+    def add_paid_many(self, deltas):
+        """add_paid для нескольких счетов с разными суммами ({id: delta}) одним UPDATE"""
+        delta = Case(
+            *[When(pk=pk, then=Value(amount)) for pk, amount in deltas.items()],
+            default=Value(Decimal('0')),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        )
+        return self.filter(pk__in=deltas).add_paid(delta)
+
+    def recompute_totals(self):
+        """
+        Пересчитывает paid_total и статус по платежам для счетов, где они
+        разошлись (правки в обход Payment.save/delete). Возвращает их число
+        """
+        actual = Coalesce(
+            Subquery(
+                Payment.objects.filter(invoice=OuterRef('pk')).values('invoice').annotate(
+                    total=Sum(F('cash_amount') + F('transfer_amount') + F('online_amount'))
+                ).values('total'),
+                output_field=DecimalField(max_digits=12, decimal_places=2)
+            ),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        )
+        stale = self.annotate(actual_paid=actual, actual_status=_status_for(actual)).exclude(
+            paid_total=F('actual_paid'), status=F('actual_status')
+        )
+        return self.filter(pk__in=list(stale.values_list('pk', flat=True))).update(
+            paid_total=actual, status=_status_for(actual)
+        )
+
+    def debtors(self):
+        """Счета с остатком к оплате"""
+        return self.filter(paid_total__lt=F('amount') - F('discount'))
+
+
+def _status_for(paid):
+    """Статус счёта по выражению оплаченной суммы — те же правила, что в update_status"""
+    return Case(
+        When(GreaterThanOrEqual(paid, F('amount') - F('discount')), then=Value('paid')),
+        When(GreaterThan(paid, 0), then=Value('partial')),
+        default=Value('pending'),
+        output_field=models.CharField(),
+    )
+
+
 class Invoice(models.Model):
     PAYMENT_TYPES = [
         ('cash', 'Наличные'),
@@ -442,6 +630,12 @@ class Invoice(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES,
                             default='pending', verbose_name="Статус")
     comment = models.TextField(blank=True, verbose_name="Комментарий")
+    # Сумма оплат. Ведётся Payment.save и удалением платежей через F(),
+    # сверка с платежами — команда recompute_invoice_totals
+    paid_total = models.DecimalField(max_digits=12, decimal_places=2, default=0,
+                                     editable=False, verbose_name="Оплачено")
+
+    objects = InvoiceQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.student.get_full_name()} ({self.months})"
@@ -450,6 +644,9 @@ class Invoice(models.Model):
         verbose_name = "Счёт"
         verbose_name_plural = "Счета"
         ordering = ['-date_created']
+        indexes = [
+            models.Index(fields=['status', 'due_date'], name='invoice_status_due_idx'),
+        ]
 
     @property
     def final_amount(self):
@@ -457,11 +654,7 @@ class Invoice(models.Model):
 
     @property
     def paid_amount(self):
-        total_expr = ExpressionWrapper(
-            F('cash_amount') + F('transfer_amount') + F('online_amount'),
-            output_field=DecimalField()
-        )
-        return self.payments.aggregate(total=Sum(total_expr))['total'] or 0
+        return self.paid_total
 
     @property
     def balance(self):
@@ -484,7 +677,36 @@ class Invoice(models.Model):
 
     def save(self, *args, **kwargs):
         self.full_clean()
-        super().save(*args, **kwargs)
+        # Начисление пишется в журнал ученика, только если менялись сумма,
+        # скидка или ученик (update_status сохраняет один статус)
+        update_fields = kwargs.get('update_fields')
+        track = update_fields is None or bool({'amount', 'discount', 'student', 'student_id'} & set(update_fields))
+        with transaction.atomic():
+            previous = None
+            if track and self.pk:
+                previous = Invoice.objects.filter(pk=self.pk).values_list('student_id', 'amount', 'discount').first()
+            super().save(*args, **kwargs)
+            if track:
+                LedgerEntry.objects.append(self.ledger_changes(previous))
+
+    def ledger_changes(self, previous=None):
+        """Записи журнала для нового счёта или изменения (student_id, amount, discount) -> текущие"""
+        if previous is None:
+            return [
+                LedgerEntry(student_id=self.student_id, invoice=self, kind='charge', amount=self.amount),
+                LedgerEntry(student_id=self.student_id, invoice=self, kind='discount', amount=-self.discount),
+            ]
+        student_id, amount, discount = previous
+        if student_id != self.student_id:
+            # Счёт вместе с оплатами переходит к другому ученику
+            return [
+                LedgerEntry(student_id=student_id, invoice=self, kind='adjustment',
+                            amount=-(amount - discount - self.paid_total)),
+                LedgerEntry(student_id=self.student_id, invoice=self, kind='adjustment',
+                            amount=self.final_amount - self.paid_total),
+            ]
+        return [LedgerEntry(student_id=self.student_id, invoice=self, kind='adjustment',
+                            amount=self.final_amount - (amount - discount))]
 
 class Payment(models.Model):
     invoice = models.ForeignKey(
@@ -521,9 +743,103 @@ class Payment(models.Model):
         return (self.cash_amount or 0) + (self.transfer_amount or 0) + (self.online_amount or 0)
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.invoice.update_status()
+        # paid_total счёта меняется в той же транзакции, что и платёж.
+        # Удаление платежа учитывается в signals.payment_deleted
+        with transaction.atomic():
+            # Прежние счёт и сумма — из БД: платёж могли перенести на другой счёт
+            previous = None
+            if self.pk:
+                previous = Payment.objects.filter(pk=self.pk).values_list(
+                    'invoice_id', F('cash_amount') + F('transfer_amount') + F('online_amount'),
+                    'invoice__student_id'
+                ).first()
+            super().save(*args, **kwargs)
+            student_id = self.invoice.student_id
+            if previous and previous[0] != self.invoice_id:
+                Invoice.objects.filter(pk=previous[0]).add_paid(-previous[1])
+                Invoice.objects.filter(pk=self.invoice_id).add_paid(self.total_amount)
+                entries = [
+                    LedgerEntry(student_id=previous[2], payment=self, kind='adjustment', amount=previous[1]),
+                    LedgerEntry(student_id=student_id, payment=self, kind='adjustment', amount=-self.total_amount),
+                ]
+            else:
+                delta = self.total_amount - (previous[1] if previous else 0)
+                if delta:
+                    Invoice.objects.filter(pk=self.invoice_id).add_paid(delta)
+                kind = 'adjustment' if previous else 'payment'
+                entries = [LedgerEntry(student_id=student_id, payment=self, kind=kind, amount=-delta)]
+            LedgerEntry.objects.append(entries)
+        self.invoice.refresh_from_db(fields=['paid_total', 'status'])
+
+
+
+class LedgerQuerySet(models.QuerySet):
+    def last_entries(self, student_ids):
+        """Последняя запись каждого ученика — один запрос"""
+        last_ids = self.filter(student_id__in=student_ids).values('student_id').annotate(
+            last_id=Max('id')
+        ).values('last_id')
+        return self.filter(id__in=last_ids)
+
+    def balances(self, student_ids):
+        """{id ученика: долг}. Ученик без записей ничего не должен"""
+        balances = dict.fromkeys(student_ids, Decimal('0'))
+        balances.update(self.last_entries(student_ids).order_by().values_list('student_id', 'balance'))
+        return balances
+
+    def append(self, entries):
+        """
+        Дописывает записи в журнал с нарастающим балансом. Блокировка записи
+        берётся холостым UPDATE до чтения последних балансов (в SQLite нет
+        SELECT ... FOR UPDATE), так что параллельные записи одного ученика
+        не читают один и тот же баланс
+        """
+        entries = [entry for entry in entries if entry.amount]
+        if not entries:
+            return []
+        student_ids = {entry.student_id for entry in entries}
+        with transaction.atomic():
+            self.filter(student_id__in=student_ids).update(id=F('id'))
+            balances = self.balances(student_ids)
+            for entry in entries:
+                balances[entry.student_id] += entry.amount
+                entry.balance = balances[entry.student_id]
+            return self.bulk_create(entries, batch_size=500)
+
+
+class LedgerEntry(models.Model):
+    """
+    Журнал расчётов ученика: начисления, скидки, оплаты и корректировки.
+    amount > 0 увеличивает долг; balance — долг после записи, так что
+    текущий долг — баланс последней записи. Записи только добавляются
+    """
+    KIND_CHOICES = [
+        ('charge', 'Начисление'),
+        ('discount', 'Скидка'),
+        ('payment', 'Оплата'),
+        ('adjustment', 'Корректировка'),
+    ]
 
+    student = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='ledger_entries',
+                                verbose_name="Ученик")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Тип")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Сумма")
+    balance = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Долг после записи")
+    invoice = models.ForeignKey(Invoice, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='ledger_entries', verbose_name="Счёт")
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='ledger_entries', verbose_name="Платёж")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Дата")
+
+    objects = LedgerQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Запись журнала расчётов"
+        verbose_name_plural = "Журнал расчётов"
+        ordering = ['-id']
+
+    def __str__(self):
+        return f"{self.student_id}: {self.get_kind_display()} {self.amount} -> {self.balance}"
 
 
 class FinancialReport(models.Model):
@@ -651,3 +967,70 @@ class DiscountRegulation(models.Model):
 
 
 
+
+
+
+class Job(models.Model):
+    """Фоновая задача, выполняемая командой run_worker"""
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+    ]
+
+    kind = models.CharField(max_length=50, verbose_name="Тип задачи")
+    params = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name="Статус"
+    )
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder, verbose_name="Результат")
+    result_file = models.FileField(upload_to='jobs/', blank=True, null=True, verbose_name="Файл результата")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    worker = models.CharField(max_length=100, blank=True, verbose_name="Обработчик")
+    created_by = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True, blank=True,
+        related_name='jobs',
+        verbose_name="Автор"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начата")
+    # Обработчик обновляет отметку, пока задача выполняется; задачу с давней
+    # отметкой (обработчик упал) requeue_stale_jobs возвращает в очередь
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="Последний сигнал обработчика")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершена")
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.get_status_display()})"
+
+
+class DataVersion(models.Model):
+    """
+    Счётчик версии данных (например, всего, что показывается по группе).
+    Увеличивается при каждой записи и входит в ключ кэша ответов, поэтому
+    устаревшие ответы никогда не отдаются — их ключи просто перестают
+    запрашиваться
+    """
+    key = models.CharField(max_length=100, unique=True, verbose_name="Ключ")
+    version = models.PositiveBigIntegerField(default=0, verbose_name="Версия")
+
+    class Meta:
+        verbose_name = "Версия данных"
+        verbose_name_plural = "Версии данных"
+
+    def __str__(self):
+        return f"{self.key}: {self.version}"
@@ -0,0 +1,161 @@
+import json
+from base64 import b64decode, b64encode
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Курсорная (keyset) пагинация для всех списков: страница выбирается
+    условием по ключу сортировки, а не OFFSET, поэтому дальние страницы
+    стоят столько же, сколько первая.
+
+    Ключ сортировки берётся из cursor_ordering представления, иначе из
+    Meta.ordering модели (если там только поля модели), иначе — id; в конец
+    при необходимости добавляется id, так что порядок списка без
+    cursor_ordering остаётся прежним. Курсор хранит значения
+    всех полей ключа крайней строки страницы, а соседняя страница — строки
+    строго после (или до) этого набора значений. Поэтому сколько угодно
+    строк с одинаковым первым полем (order урока, дата импортированных
+    платежей) проходятся без OFFSET. NULL считается наименьшим значением
+    при любой СУБД.
+
+    Размер страницы — REST_FRAMEWORK['PAGE_SIZE'], клиент меняет его через
+    ?page_size= (до max_page_size).
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', None) or self._model_ordering(queryset.model) or self.ordering
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        ordering = tuple(ordering)
+        if ordering[-1].lstrip('-') not in ('id', 'pk'):
+            ordering += ('-id' if ordering[-1].startswith('-') else 'id',)
+        return ordering
+
+    @staticmethod
+    def _model_ordering(model):
+        # Связанные поля и выражения курсор не сравнивает — тогда id
+        ordering = tuple(model._meta.ordering or ())
+        if all(isinstance(field, str) and '__' not in field and field != '?' for field in ordering):
+            return ordering
+        return None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.nullable = [self._is_nullable(queryset.model, field) for field in self.ordering]
+        reverse, position = self.decode_cursor(request) or (False, None)
+
+        queryset = queryset.order_by(*self._order_by(reverse))
+        if position is not None:
+            queryset = queryset.filter(self._after(position, reverse))
+
+        results = list(queryset[:self.page_size + 1])
+        page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            page.reverse()
+
+        self.page = page
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else position is not None
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        # Пустая страница при движении назад — следующая страница первая
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor((False, self._position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor((True, self._position(self.page[0])))
+
+    def get_links(self):
+        """Ссылки на соседние страницы — для ответов со своей обёрткой (filters и т.п.)"""
+        return {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            reverse, position = json.loads(b64decode(encoded.encode('ascii')))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return bool(reverse), position
+
+    def encode_cursor(self, cursor):
+        encoded = b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def _position(self, instance):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            values.append(None if value is None else str(value))
+        return values
+
+    @staticmethod
+    def _is_nullable(model, field):
+        name = field.lstrip('-')
+        if name == 'pk':
+            return False
+        try:
+            return model._meta.get_field(name).null
+        except FieldDoesNotExist:
+            return True
+
+    def _order_by(self, reverse):
+        order_by = []
+        for field, nullable in zip(self.ordering, self.nullable):
+            descending = field.startswith('-') != reverse
+            name = field.lstrip('-')
+            if not nullable:
+                order_by.append(f"-{name}" if descending else name)
+            elif descending:
+                order_by.append(F(name).desc(nulls_last=True))
+            else:
+                order_by.append(F(name).asc(nulls_first=True))
+        return order_by
+
+    def _after(self, position, reverse):
+        """Строки строго после position: (a > x) | (a = x & b > y) | ..."""
+        condition, equal = Q(), Q()
+        for field, nullable, value in zip(self.ordering, self.nullable, position):
+            name = field.lstrip('-')
+            greater = field.startswith('-') == reverse
+            condition |= equal & self._compare(name, nullable, value, greater)
+            equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+        return condition
+
+    @staticmethod
+    def _compare(name, nullable, value, greater):
+        # NULL — наименьшее значение
+        if value is None:
+            return Q(**{f'{name}__isnull': False}) if greater else Q(pk__in=[])
+        if greater:
+            return Q(**{f'{name}__gt': value})
+        less = Q(**{f'{name}__lt': value})
+        return less | Q(**{f'{name}__isnull': True}) if nullable else less
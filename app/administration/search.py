@@ -0,0 +1,241 @@
+import re
+
+from functools import reduce
+from operator import and_, or_
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from app.administration.models import Group, Lead
+from app.users.models import CustomUser
+
+
+# Полнотекстовый индекс SQLite FTS5 (таблица создаётся миграцией 0022).
+# unicode61 приводит регистр для всех алфавитов, включая кириллицу;
+# ё -> е и цифры телефона без разделителей нормализуем сами. Морфологии
+# нет: слово запроса совпадает только как префикс слова документа.
+# prefix='2 3' строит индексы префиксов, чтобы подсказки при наборе не
+# перебирали словарь целиком.
+#
+# На других СУБД таблицы нет: запись в индекс пропускается, а поиск идёт
+# через icontains по тем же полям (FALLBACK_FIELDS), без ранжирования.
+#
+# rowid = id объекта * 8 + код типа: обновление и удаление документа —
+# поиск по rowid, а не просмотр всей таблицы
+SEARCH_TABLE = 'administration_search'
+
+# label — заголовок для выдачи как есть, title и body — нормализованный текст
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "kind UNINDEXED, object_id UNINDEXED, label UNINDEXED, title, body, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+USER_KINDS = {'Student': 'student', 'Teacher': 'teacher'}
+KIND_CODES = {'student': 1, 'teacher': 1, 'group': 2, 'lead': 3}
+KINDS = ('student', 'teacher', 'group', 'lead')
+
+BATCH_SIZE = 1000
+PHONE_TAIL_MIN = 4
+
+# Поля для поиска без индекса: тип -> (модель, поля, доп. условие)
+FALLBACK_FIELDS = {
+    'student': (CustomUser, ('first_name', 'last_name', 'username', 'phone', 'telegram'), {'role': 'Student'}),
+    'teacher': (CustomUser, ('first_name', 'last_name', 'username', 'phone', 'telegram'), {'role': 'Teacher'}),
+    'group': (Group, ('group_name', 'direction__name'), {}),
+    'lead': (Lead, ('name', 'phone', 'email', 'course'), {}),
+}
+
+
+def index_available():
+    return connection.vendor == 'sqlite'
+
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+
+def match_expression(query):
+    """
+    Запрос пользователя -> выражение MATCH: каждое слово — префикс,
+    слова объединяются через AND. None, если слов нет
+    """
+    words = re.findall(r'\w+', normalize(query))
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _rowid(kind, object_id):
+    return object_id * 8 + KIND_CODES[kind]
+
+
+def _digits(phone):
+    return re.sub(r'\D', '', phone or '')
+
+
+def _phone_tokens(phone):
+    """
+    Цифры телефона и все их хвосты от PHONE_TAIL_MIN цифр: FTS ищет только
+    префиксы слов, а хвост делает префиксом любую часть номера —
+    «123456» находит +996555123456, как прежний icontains
+    """
+    digits = _digits(phone)
+    return ' '.join(digits[start:] for start in range(max(len(digits) - PHONE_TAIL_MIN + 1, 1)))
+
+
+def user_document(user):
+    kind = USER_KINDS.get(user.role)
+    if kind is None:
+        return None
+    return (
+        kind, user.id,
+        f"{user.last_name} {user.first_name}".strip() or user.username,
+        ' '.join([user.username, user.telegram or '', user.phone or '', _phone_tokens(user.phone)]),
+    )
+
+
+def group_document(group):
+    direction = group.direction.name if group.direction_id else ''
+    return ('group', group.id, group.group_name, direction)
+
+
+def lead_document(lead):
+    return (
+        'lead', lead.id, lead.name,
+        ' '.join([lead.phone, _phone_tokens(lead.phone), lead.email or '', lead.course]),
+    )
+
+
+def _write(documents, cursor):
+    cursor.executemany(
+        f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, kind, object_id, label, title, body) "
+        "VALUES (%s, %s, %s, %s, %s, %s)",
+        [
+            (_rowid(kind, object_id), kind, object_id, title, normalize(title), normalize(body))
+            for kind, object_id, title, body in documents
+        ]
+    )
+
+
+def index_documents(documents):
+    if not index_available():
+        return
+    documents = [document for document in documents if document]
+    if documents:
+        with connection.cursor() as cursor:
+            _write(documents, cursor)
+
+
+def remove_documents(kind, ids):
+    ids = [_rowid(kind, object_id) for object_id in ids]
+    if ids and index_available():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(ids))})", ids
+            )
+
+
+def index_user(user):
+    # Роль могла смениться: документ с прежним типом лежит под тем же rowid
+    if user.role in USER_KINDS:
+        index_documents([user_document(user)])
+    else:
+        remove_documents('student', [user.id])
+
+
+def rebuild_index(batch_size=BATCH_SIZE, user_model=CustomUser, group_model=Group, lead_model=Lead):
+    """
+    Перестраивает индекс целиком. Возвращает число документов по типам.
+    Модели передаются из миграции, которая заполняет индекс впервые.
+    Без SQLite индекса нет — возвращает пустой словарь
+    """
+    if not index_available():
+        return {}
+    sources = [
+        ('users', user_model.objects.filter(role__in=USER_KINDS).order_by('id'), user_document),
+        ('groups', group_model.objects.select_related('direction').order_by('id'), group_document),
+        ('leads', lead_model.objects.order_by('id'), lead_document),
+    ]
+    counts = {}
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        for label, queryset, build in sources:
+            batch, counts[label] = [], 0
+            for obj in queryset.iterator(chunk_size=batch_size):
+                batch.append(build(obj))
+                if len(batch) >= batch_size:
+                    _write(batch, cursor)
+                    counts[label] += len(batch)
+                    batch = []
+            if batch:
+                _write(batch, cursor)
+                counts[label] += len(batch)
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+    return counts
+
+
+def search_documents(query, kinds=KINDS, limit=20):
+    """Документы, подходящие под запрос, — по релевантности (bm25 по всем совпадениям)"""
+    expression = match_expression(query)
+    if expression is None or not kinds:
+        return []
+    if not index_available():
+        return _fallback_documents(query, kinds, limit)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT kind, object_id, label FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND kind IN ({', '.join(['%s'] * len(kinds))}) "
+            f"ORDER BY rank LIMIT %s",
+            [expression, *kinds, limit]
+        )
+        rows = cursor.fetchall()
+    return [{'type': kind, 'id': object_id, 'title': title} for kind, object_id, title in rows]
+
+
+def matching_ids(kind, query):
+    """
+    Подзапрос id объектов типа kind, подходящих под запрос, — для
+    filter(id__in=...). None, если в запросе нет слов
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return None
+    if not index_available():
+        return _fallback_queryset(kind, query).values('id')
+    return RawSQL(
+        f"SELECT object_id FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND kind = %s",
+        (expression, kind)
+    )
+
+
+def filter_by_search(queryset, kind, query, field='id'):
+    """Оставляет в queryset объекты, найденные в индексе; запрос без слов не фильтрует"""
+    ids = matching_ids(kind, query)
+    if ids is None:
+        return queryset
+    return queryset.filter(**{f'{field}__in': ids})
+
+
+def _fallback_queryset(kind, query):
+    # Каждое слово — в любом из полей
+    model, fields, extra = FALLBACK_FIELDS[kind]
+    words = re.findall(r'\w+', query or '')
+    condition = reduce(and_, (
+        reduce(or_, (Q(**{f'{field}__icontains': word}) for field in fields)) for word in words
+    ))
+    return model.objects.filter(condition, **extra)
+
+
+def _fallback_documents(query, kinds, limit):
+    documents = []
+    for kind in kinds:
+        objects = _fallback_queryset(kind, query).order_by('-id')
+        if kind == 'group':
+            objects = objects.select_related('direction')
+        build = {'group': group_document, 'lead': lead_document}.get(kind, user_document)
+        for obj in objects[:limit]:
+            _, object_id, title, _ = build(obj)
+            documents.append({'type': kind, 'id': object_id, 'title': title})
+    return documents[:limit]
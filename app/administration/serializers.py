@@ -1,7 +1,9 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from django.urls import reverse
 import datetime
 from django.utils import timezone
-from django.db.models import Sum, F, ExpressionWrapper, DecimalField
+from django.db.models import Count, Sum, F, ExpressionWrapper, DecimalField, Prefetch
 from django.contrib.auth import get_user_model
 from django.core.files.storage import default_storage
 import uuid 
@@ -11,11 +13,14 @@ from django.core.files.base import ContentFile
 
 from app.administration.models import (
     Direction, Group, Teacher, Student, Lesson, Attendance, Payment, 
-    Months, TeacherPayment, Expense, Invoice,
+    Months, TeacherPayment, Expense, Invoice, LedgerEntry,
     FinancialReport, Schedule, Classroom, Lead, HomeworkSubmission, 
-    PaymentNotification, DiscountRegulation, HomeworkFile
+    PaymentNotification, DiscountRegulation, HomeworkFile, Job, TemplateMonth, TemplateLesson
     )
 from app.users.models import CustomUser
+from app.administration.services import (
+    allocate_payment, apply_membership_changes, DEFAULT_HOMEWORK_STATUS, GroupDashboard, PAYMENT_CHANNELS
+    )
 import base64
 import uuid
 from django.core.files.base import ContentFile
@@ -86,6 +91,64 @@ class FlexibleFileField(serializers.FileField):
         raise serializers.ValidationError("Ожидается файл или base64 строка")
 
 
+def sparse_fieldset(request):
+    """Множества имён из ?fields= и ?omit= (через запятую)"""
+    def names(param):
+        return {name.strip() for name in request.query_params.get(param, '').split(',') if name.strip()}
+    return names('fields'), names('omit')
+
+
+class SparseFieldsMixin:
+    """
+    Частичный ответ: ?fields=id,name оставляет только перечисленные поля,
+    ?omit=months убирает перечисленные. Поля отбрасываются в get_fields(),
+    так что методы и вложенные сериализаторы лишних полей не вычисляются.
+    Действует на чтение и только для корневого сериализатора (или элемента
+    корневого списка).
+
+    sparse_select_related / sparse_prefetch_related — что нужно загрузить
+    для поля; setup_sparse_loading() добавляет в queryset только то, что
+    нужно оставшимся полям
+    """
+    sparse_select_related = {}
+    sparse_prefetch_related = {}
+
+    @staticmethod
+    def sparse_request(request):
+        return request is not None and request.method in SAFE_METHODS
+
+    @classmethod
+    def keeps_field(cls, request, name):
+        if not cls.sparse_request(request):
+            return True
+        fields, omit = sparse_fieldset(request)
+        return (not fields or name in fields) and name not in omit
+
+    @classmethod
+    def setup_sparse_loading(cls, queryset, request):
+        select = [
+            lookup for name, lookups in cls.sparse_select_related.items()
+            if cls.keeps_field(request, name) for lookup in lookups
+        ]
+        prefetch = [
+            lookup for name, lookups in cls.sparse_prefetch_related.items()
+            if cls.keeps_field(request, name) for lookup in lookups
+        ]
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = getattr(self, 'parent', None)
+        if isinstance(parent, serializers.ListSerializer):
+            parent = getattr(parent, 'parent', None)
+        request = self.context.get('request')
+        if parent is not None or not self.sparse_request(request):
+            return fields
+        return {name: field for name, field in fields.items() if self.keeps_field(request, name)}
 
 
 class CustomUserSerializer(serializers.ModelSerializer):
@@ -119,7 +182,7 @@ class LessonSerializer(serializers.ModelSerializer):
 
 
 
-class HomeworkSubmissionSerializer(serializers.ModelSerializer):
+class HomeworkSubmissionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     project_links = serializers.ListField(
         child=serializers.URLField(),
         max_length=5,
@@ -153,6 +216,12 @@ class HomeworkSubmissionSerializer(serializers.ModelSerializer):
             'group_name',
         ]
 
+    sparse_select_related = {
+        'student_name': ['student'],
+        'teacher_name': ['lesson__month__group__teacher'],
+        'group_name': ['lesson__month__group'],
+    }
+
     def get_teacher_name(self, obj):
         try:
             teacher = obj.lesson.month.group.teacher
@@ -183,14 +252,48 @@ class MonthsSerializer(serializers.ModelSerializer):
     def get_lessons(self, obj):
         request = self.context.get('request')
         return LessonSerializer(
-            obj.lessons.all().order_by('order'),
+            obj.lessons.all(),  # Meta.ordering = ['order']; не ломает prefetch
             many=True,
             context={'request': request}  # 👈 прокидываем
         ).data
 
 
+class TemplateLessonSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TemplateLesson
+        fields = [
+            'id', 'order', 'title', 'description', 'lesson_links', 'homework_links',
+            'homework_description', 'homework_requirements'
+        ]
+
+
+class TemplateMonthSerializer(serializers.ModelSerializer):
+    lessons = TemplateLessonSerializer(many=True, required=False)
+
+    class Meta:
+        model = TemplateMonth
+        fields = ['id', 'month_number', 'title', 'description', 'lessons']
+
+    def validate_lessons(self, value):
+        orders = [lesson['order'] for lesson in value]
+        if len(orders) != len(set(orders)):
+            raise serializers.ValidationError("Номера уроков в месяце не должны повторяться")
+        return value
+
+
+class DirectionTemplateSerializer(serializers.Serializer):
+    """Учебный план направления целиком: месяцы с вложенными уроками"""
+    months = TemplateMonthSerializer(many=True)
+
+    def validate_months(self, value):
+        numbers = [month['month_number'] for month in value]
+        if len(numbers) != len(set(numbers)):
+            raise serializers.ValidationError("Номера месяцев не должны повторяться")
+        return value
+
+
 
-class GroupSerializer(serializers.ModelSerializer):
+class GroupSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     direction = DirectionSerializer()
     teacher = CustomUserSerializer(read_only=True)
     students = CustomUserSerializer(many=True, read_only=True)
@@ -201,6 +304,15 @@ class GroupSerializer(serializers.ModelSerializer):
         model = Group
         fields = '__all__'
 
+    sparse_select_related = {
+        'direction': ['direction'],
+        'teacher': ['teacher'],
+    }
+    sparse_prefetch_related = {
+        'students': ['students'],
+        'months': ['months__lessons'],
+    }
+
 class CSVStringOrListField(serializers.ListField):
     child = serializers.CharField(allow_blank=False)
 
@@ -235,17 +347,31 @@ class GroupCreateSerializer(serializers.ModelSerializer):
             'students': {'required': False}
         }
 
+    def create(self, validated_data):
+        students = validated_data.pop('students', [])
+        group = Group(**validated_data)
+        # В асинхронном режиме учебный план строит фоновая задача
+        group.defer_curriculum = self.context.get('defer_curriculum', False)
+        group.save()
+        group.students.set(students)
+        return group
+
 class AddRemoveStudentsSerializer(serializers.Serializer):
     student_ids = serializers.ListField(
         child=serializers.IntegerField(), allow_empty=False
     )
 
-    def validate_student_ids(self, value):
-        from users.models import CustomUser
-        students = CustomUser.objects.filter(id__in=value, role='Student')
-        if not students.exists():
-            raise serializers.ValidationError("Ни одного валидного студента не найдено")
-        return value
+    def validate(self, attrs):
+        # Одним запросом отделяем учеников от несуществующих id и чужих ролей
+        requested = set(attrs['student_ids'])
+        valid_ids = set(
+            CustomUser.objects.filter(id__in=requested, role='Student').values_list('id', flat=True)
+        )
+        if not valid_ids:
+            raise serializers.ValidationError({'student_ids': "Ни одного валидного студента не найдено"})
+        attrs['student_ids'] = sorted(valid_ids)
+        attrs['invalid_ids'] = sorted(requested - valid_ids)
+        return attrs
 
 class TeacherSerializer(serializers.ModelSerializer):
     directions = DirectionSerializer(many=True, read_only=True)
@@ -330,13 +456,8 @@ class TeacherCreateSerializer(serializers.ModelSerializer):
         # Установить направления
         teacher.directions.set(directions)
 
-        # Установить группы
-        teacher.groups.set(groups)
-
-        # Обновить каждую группу, чтобы добавить преподавателя как teacher
-        for group in groups:
-            group.teacher = user
-            group.save()
+        # Назначить преподавателя группам (профиль и Group.teacher)
+        apply_membership_changes(teacher_links=[(group.id, user.id) for group in groups])
 
         return teacher
 
@@ -435,18 +556,17 @@ class StudentCreateSerializer(serializers.ModelSerializer):
         user = CustomUser.objects.create_user(**user_data)
         student = Student.objects.create(user=user)
 
-        student.groups.set(groups)
         student.directions.set(directions)
 
-        for group in groups:
-            group.students.add(user)
+        # Записать в группы с обеих сторон связи и создать прогресс по урокам
+        apply_membership_changes(student_links=[(group.id, user.id) for group in groups])
 
         return student
 
 
 
 class AttendanceSerializer(serializers.ModelSerializer):
-    student_id = serializers.IntegerField(source='student.id', read_only=True)
+    student_id = serializers.IntegerField(read_only=True)
     student = serializers.PrimaryKeyRelatedField(queryset=CustomUser.objects.all(), write_only=True)
     month_number = serializers.SerializerMethodField()
     group_id = serializers.SerializerMethodField()
@@ -470,6 +590,7 @@ class PaymentSerializer(serializers.ModelSerializer):
     month_name = serializers.CharField(source='invoice.months.title', read_only=True)
     total_amount = serializers.DecimalField(max_digits=10000, decimal_places=2, read_only=True)
     invoice_status = serializers.CharField(source='invoice.status', read_only=True)
+    allocations = serializers.SerializerMethodField()
 
     class Meta:
         model = Payment
@@ -481,24 +602,47 @@ class PaymentSerializer(serializers.ModelSerializer):
             'student_name',
             'month_name',
             'invoice_status',
+            'allocations',
         ]
 
+    def validate(self, attrs):
+        amounts = [attrs.get(channel) or 0 for channel in PAYMENT_CHANNELS]
+        if min(amounts) < 0:
+            raise serializers.ValidationError("Суммы оплаты не могут быть отрицательными")
+        if self.instance is None and sum(amounts) <= 0:
+            raise serializers.ValidationError("Сумма оплаты должна быть больше нуля")
+        return attrs
+
     def create(self, validated_data):
         student = validated_data.pop('student_id')
 
-        # Находим последний неоплаченный счёт
-        invoice = Invoice.objects.filter(
-            student=student
-        ).exclude(status='paid').order_by('due_date').first()
-
-        if not invoice:
+        # Оплата разносится по открытым счетам в порядке срока (allocate_payment)
+        try:
+            payments = allocate_payment(student, **validated_data)
+        except ValueError as e:
+            raise serializers.ValidationError({"detail": str(e)})
+        if not payments:
             raise serializers.ValidationError(
                 {"detail": f"У студента {student.get_full_name()} нет неоплаченных счетов"}
             )
 
-        payment = Payment.objects.create(invoice=invoice, **validated_data)
+        # Ответ — первый платёж; разбивка по всем счетам — в allocations
+        payment = payments[0]
+        payment.allocations = payments
         return payment
 
+    def get_allocations(self, obj):
+        payments = getattr(obj, 'allocations', None) or [obj]
+        return [
+            {
+                'payment_id': payment.id,
+                'invoice_id': payment.invoice_id,
+                'amount': str(payment.total_amount),
+                'invoice_status': payment.invoice.status,
+            }
+            for payment in payments
+        ]
+
 
 
 class GroupInvoiceSerializer(serializers.ModelSerializer):
@@ -523,32 +667,30 @@ class StudentDetailSerializer(serializers.ModelSerializer):
             'attendances', 'homework_scores', 'payments'
         ]
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Вкладка дашборда отдаёт только свои поля — и выполняет только свои запросы
+        only = self.context.get('student_fields')
+        if only:
+            for name in set(self.fields) - set(only):
+                self.fields.pop(name)
+
+    # Данные всех учеников собирает GroupDashboard (см. services):
+    # сериализатор только раскладывает готовые списки, не делая запросов
+
     def get_attendances(self, obj):
-        group = self.context.get('group')
-        if not group:
+        dashboard = self.context.get('dashboard')
+        if not dashboard:
             return []
-        
-        month_ids = group.months.values_list('id', flat=True)
-        
-        attendances = Attendance.objects.filter(
-            student=obj,
-            lesson__month_id__in=month_ids
-        ).select_related('lesson__month')
-        
-        return AttendanceSerializer(attendances, many=True).data
+
+        # Отсутствующие строки — статус по умолчанию (разреженный режим)
+        return AttendanceSerializer(dashboard.attendances(obj), many=True).data
 
     def get_homework_scores(self, obj):
-        group = self.context.get('group')
-        if not group:
+        dashboard = self.context.get('dashboard')
+        if not dashboard:
             return []
-        
-        month_ids = group.months.values_list('id', flat=True)
-        
-        submissions = HomeworkSubmission.objects.filter(
-            student=obj,
-            lesson__month_id__in=month_ids
-        ).select_related('lesson__month')
-        
+
         return [
             {
                 "lesson_id": sub.lesson.id,
@@ -557,22 +699,15 @@ class StudentDetailSerializer(serializers.ModelSerializer):
                 "score": sub.score,
                 "status": sub.status
             }
-            for sub in submissions
+            for sub in dashboard.submissions(obj)
         ]
 
     def get_payments(self, obj):
-        group = self.context.get('group')
-        if not group:
+        dashboard = self.context.get('dashboard')
+        if not dashboard:
             return []
 
-        month_ids = group.months.values_list('id', flat=True)
-
-        invoices = Invoice.objects.filter(
-            student=obj,
-            months_id__in=month_ids
-        ).prefetch_related('payments')
-
-        return GroupInvoiceSerializer(invoices, many=True).data
+        return GroupInvoiceSerializer(dashboard.invoices(obj), many=True).data
 
 
 
@@ -588,11 +723,11 @@ class GroupDashboardSerializer(serializers.ModelSerializer):
         fields = ['id', 'group_name', 'direction', 'teacher', 'students', 'homework_files']
 
     def get_students(self, obj):
-        students = obj.students.all()
+        dashboard = self.context.get('dashboard') or GroupDashboard(obj)
         serializer = StudentDetailSerializer(
-            students,
+            dashboard.students,
             many=True,
-            context={'group': obj}
+            context={'dashboard': dashboard, 'student_fields': self.context.get('student_fields')}
         )
         return serializer.data
 
@@ -612,53 +747,19 @@ class GroupDashboardSerializer(serializers.ModelSerializer):
 class GroupTableSerializer(serializers.ModelSerializer):
     direction = serializers.CharField(source='direction.name')
     group = serializers.CharField(source='group_name')
-    month = serializers.SerializerMethodField()
-    lesson = serializers.SerializerMethodField()
+    # Считаются в БД: Group.objects.with_table_progress()
+    month = serializers.IntegerField(source='table_month', read_only=True)
+    lesson = serializers.IntegerField(source='last_lesson_order', read_only=True)
 
     class Meta:
         model = Group
         fields = ['id', 'direction', 'group', 'month', 'lesson']
 
-    def get_month(self, obj):
-        """Определить текущий курс группы"""
-        # Если курсов нет — возвращаем 1
-        if not obj.months.exists():
-            return 1
-
-        # Логика определения курса — берём максимальный номер курса,
-        # по которому уже есть уроки с датой
-        last_month_with_lesson = (
-            Months.objects.filter(group=obj, lessons__date__isnull=False)
-            .order_by('-month_number')
-            .first()
-        )
-
-        if last_month_with_lesson:
-            return last_month_with_lesson.month_number
-
-        # Если уроков с датой нет, берём первый курс
-        return obj.months.order_by('month_number').first().month_number
-
-    def get_lesson(self, obj):
-        """Получить номер последнего пройденного урока"""
-        try:
-            month_ids = obj.months.values_list('id', flat=True)
-
-            last_lesson = Lesson.objects.filter(
-                month_id__in=month_ids
-            ).order_by('-date', '-order').first()
-
-            return last_lesson.order if last_lesson else 0
-        except Exception as e:
-            print(f"Error getting last lesson: {e}")
-            return 0
-
-
 
 
 
 class StudentTableSerializer(serializers.ModelSerializer):
-    user_id = serializers.SerializerMethodField()  # ID пользователя
+    user_id = serializers.IntegerField(read_only=True)  # ID пользователя
     full_name = serializers.SerializerMethodField()
     group = serializers.SerializerMethodField()
     direction = serializers.SerializerMethodField()
@@ -668,31 +769,37 @@ class StudentTableSerializer(serializers.ModelSerializer):
         model = Student 
         fields = ['user_id', 'full_name', 'group', 'direction', 'teacher']
 
-    def get_user_id(self, obj):
-        return obj.user.id  # возвращаем id пользователя
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        План загрузки для таблицы: пользователь — join, группы вместе
+        с направлением и преподавателем — одним prefetch. Методы ниже
+        читают только загруженное, так что число запросов не зависит
+        от числа учеников
+        """
+        return queryset.select_related('user').prefetch_related(
+            Prefetch('groups', queryset=Group.objects.select_related('direction', 'teacher'))
+        )
 
     def get_full_name(self, obj):
         return obj.user.get_full_name() or "-"
 
     def get_group(self, obj):
-        groups = obj.groups.all()
-        if groups.exists():
-            return ", ".join([g.group_name for g in groups])
-        return "-"
+        return ", ".join(g.group_name for g in obj.groups.all()) or "-"
 
     def get_direction(self, obj):
-        directions = set()
-        for group in obj.groups.all():
-            if group.direction:
-                directions.add(group.direction.name)
-        return ", ".join(directions) if directions else "-"
+        # dict.fromkeys — уникальные значения в порядке групп
+        directions = dict.fromkeys(
+            group.direction.name for group in obj.groups.all() if group.direction
+        )
+        return ", ".join(directions) or "-"
 
     def get_teacher(self, obj):
-        teachers = set()
-        for group in obj.groups.all():
-            if group.teacher:
-                teachers.add(f"{group.teacher.last_name} {group.teacher.first_name}")
-        return ", ".join(teachers) if teachers else "-"
+        teachers = dict.fromkeys(
+            f"{group.teacher.last_name} {group.teacher.first_name}"
+            for group in obj.groups.all() if group.teacher
+        )
+        return ", ".join(teachers) or "-"
 
 class SimpleMonthsSerializer(serializers.ModelSerializer):
     class Meta:
@@ -705,44 +812,48 @@ class TeacherTableSerializer(serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField()
     groups = serializers.SerializerMethodField()
     directions = serializers.SerializerMethodField()
-    student_count = serializers.SerializerMethodField()
+    student_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = CustomUser
         fields = ['id', 'full_name', 'groups', 'directions', 'student_count']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        План загрузки для таблицы: профиль — join, группы и направления —
+        по одному prefetch, student_count — различные ученики всех групп
+        преподавателя, посчитанные в том же запросе
+        """
+        return queryset.select_related('teacher_add').prefetch_related(
+            'teacher_add__groups', 'teacher_add__directions'
+        ).annotate(
+            student_count=Count('teacher_add__groups__students', distinct=True)
+        )
+
+    def get_profile(self, obj):
+        try:
+            return obj.teacher_add
+        except Teacher.DoesNotExist:
+            return None
+
     def get_full_name(self, obj):
         return f"{obj.last_name} {obj.first_name}"
 
     def get_groups(self, obj):
-        try:
-            # Получаем объект Teacher через обратное отношение
-            teacher = Teacher.objects.get(user=obj)
-            groups = teacher.groups.all()
-            return ", ".join([g.group_name for g in groups]) if groups.exists() else "-"
-        except Teacher.DoesNotExist:
+        teacher = self.get_profile(obj)
+        if teacher is None:
             return "-"
+        return ", ".join(g.group_name for g in teacher.groups.all()) or "-"
 
     def get_directions(self, obj):
-        try:
-            teacher = Teacher.objects.get(user=obj)
-            directions = teacher.directions.all()
-            return ", ".join([d.name for d in directions]) if directions.exists() else "-"
-        except Teacher.DoesNotExist:
+        teacher = self.get_profile(obj)
+        if teacher is None:
             return "-"
-
-    def get_student_count(self, obj):
-        try:
-            teacher = Teacher.objects.get(user=obj)
-            count = 0
-            for group in teacher.groups.all():
-                count += group.students.count()
-            return count
-        except Teacher.DoesNotExist:
-            return 0
+        return ", ".join(d.name for d in teacher.directions.all()) or "-"
 
 
-class InvoiceSerializer(serializers.ModelSerializer):
+class InvoiceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     student = serializers.SerializerMethodField()
     months = SimpleMonthsSerializer(read_only=True)  # Используем упрощенный месяц
     months_id = serializers.PrimaryKeyRelatedField(
@@ -769,6 +880,11 @@ class InvoiceSerializer(serializers.ModelSerializer):
             'status_display', 'paid_amount', 'balance', 'comment'
         ]
 
+    sparse_select_related = {
+        'student': ['student'],
+        'months': ['months'],
+    }
+
     def get_student(self, obj):
         return {
             'id': obj.student.id,
@@ -777,6 +893,38 @@ class InvoiceSerializer(serializers.ModelSerializer):
         }
 
 
+class LedgerEntrySerializer(serializers.ModelSerializer):
+    kind_display = serializers.CharField(source='get_kind_display', read_only=True)
+
+    class Meta:
+        model = LedgerEntry
+        fields = ['id', 'kind', 'kind_display', 'amount', 'balance', 'invoice', 'payment', 'created_at']
+
+
+class InvoiceGenerateSerializer(serializers.Serializer):
+    """Параметры массового выставления счетов (см. services.generate_invoices)"""
+    month_number = serializers.IntegerField(min_value=1, required=False)
+    date = serializers.DateField(required=False)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    discount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, default=0)
+    due_date = serializers.DateField()
+    group_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    comment = serializers.CharField(required=False, allow_blank=True, default='')
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if ('month_number' in attrs) == ('date' in attrs):
+            raise serializers.ValidationError("Укажите либо month_number, либо date")
+        if attrs['discount'] > attrs['amount']:
+            raise serializers.ValidationError({'discount': "Скидка больше суммы счёта"})
+        return attrs
+
+    def to_service_kwargs(self):
+        data = dict(self.validated_data)
+        data['on_date'] = data.pop('date', None)
+        return data
+
+
 class SimpleMonthsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Months
@@ -1238,7 +1386,7 @@ class ProfileSerializer(serializers.ModelSerializer):
     
 
 
-class StudentProfileSerializer(serializers.ModelSerializer):
+class StudentProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     teacher = serializers.SerializerMethodField()
     direction = serializers.SerializerMethodField()
     password = serializers.CharField(write_only=True, required=False)
@@ -1256,6 +1404,11 @@ class StudentProfileSerializer(serializers.ModelSerializer):
             'username': {'read_only': True}
         }
 
+    sparse_prefetch_related = {
+        'teacher': ['student_groups__teacher'],
+        'direction': ['student_groups__direction'],
+    }
+
     def update(self, instance, validated_data):
         # обработка пароля
         password = validated_data.pop('password', None)
@@ -1269,12 +1422,16 @@ class StudentProfileSerializer(serializers.ModelSerializer):
 
         return super().update(instance, validated_data)
 
+    def get_first_group(self, obj):
+        # Первая группа по id, как first(); из prefetch — без запроса
+        return min(obj.student_groups.all(), key=lambda group: group.id, default=None)
+
     def get_teacher(self, obj):
-        group = obj.student_groups.first()
+        group = self.get_first_group(obj)
         return group.teacher.get_full_name() if group and group.teacher else None
 
     def get_direction(self, obj):
-        group = obj.student_groups.first()
+        group = self.get_first_group(obj)
         return group.direction.name if group and group.direction else None
 
     def get_avatarka_url(self, obj):
@@ -1384,17 +1541,18 @@ class StudentHomeworkSerializer(serializers.ModelSerializer):
     def get_homework_submission(self, obj):
         request = self.context.get('request')
         user = request.user
-        submission, created = HomeworkSubmission.objects.get_or_create(
-            lesson=obj,
-            student=user,
-            defaults={"status": "black", "project_links": []}
-        )
+        # Чтение не создаёт строк: до первой отправки работы
+        # отдаём значения по умолчанию
+        submission = HomeworkSubmission.objects.filter(lesson=obj, student=user).first()
+        if submission is None:
+            submission = HomeworkSubmission(lesson=obj, student=user, status=DEFAULT_HOMEWORK_STATUS)
+            files = []
+        else:
+            files = [request.build_absolute_uri(f.file.url) for f in submission.homework_files.all()]
         return {
             "id": submission.id,
             "project_links": submission.project_links or [],
-            "files": [
-                request.build_absolute_uri(f.file.url) for f in submission.homework_files.all()
-            ],
+            "files": files,
             "status": submission.status,
             "score": submission.score,
             "teacher_comment": submission.teacher_comment or "",
@@ -1447,4 +1605,23 @@ class StudentProgressSerializer(serializers.Serializer):
 class DiscountRegulationSerializer(serializers.ModelSerializer):
     class Meta:
         model = DiscountRegulation
-        fields = "__all__"
\ No newline at end of file
+        fields = "__all__"
+
+
+class JobSerializer(serializers.ModelSerializer):
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'params', 'status', 'status_display', 'result', 'error',
+            'created_at', 'started_at', 'finished_at', 'download_url'
+        ]
+
+    def get_download_url(self, obj):
+        if not obj.result_file:
+            return None
+        request = self.context.get('request')
+        url = reverse('job-download', kwargs={'pk': obj.pk})
+        return request.build_absolute_uri(url) if request else url
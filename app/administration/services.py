@@ -0,0 +1,900 @@
+import calendar
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, DecimalField, Exists, F, OuterRef, Q, Sum
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from app.administration.caching import (
+    bump_group_versions, bump_table_versions, bump_versions, group_key, table_key
+    )
+from app.administration.models import (
+    Group, Teacher, Months, Lesson, Attendance, HomeworkSubmission, Student, TeacherPayment,
+    TemplateMonth, TemplateLesson, Invoice, LedgerEntry, Payment, current_month_expression
+    )
+from app.users.models import CustomUser
+
+
+# Размер пачки для bulk_create. Для SQLite Django дополнительно дробит пачку
+# по лимиту параметров запроса, так что значение — верхняя граница.
+BULK_BATCH_SIZE = 500
+
+# Значения прогресса по умолчанию. В разреженном режиме (settings.SPARSE_PROGRESS)
+# строки с ними не хранятся: отсутствующая строка означает статус по умолчанию,
+# а создаётся она при первой записи
+DEFAULT_ATTENDANCE_STATUS = '0'
+DEFAULT_HOMEWORK_STATUS = 'black'
+
+
+def sparse_progress():
+    return getattr(settings, 'SPARSE_PROGRESS', False)
+
+
+def attendance_for_lessons(lessons, student, attendances):
+    """
+    Посещаемость ученика по каждому уроку в порядке lessons. Для уроков без
+    сохранённой строки подставляется несохранённый Attendance по умолчанию.
+    """
+    by_lesson = {attendance.lesson_id: attendance for attendance in attendances}
+    result = []
+    for lesson in lessons:
+        attendance = by_lesson.get(lesson.id)
+        if attendance is None:
+            attendance = Attendance(student=student, status=DEFAULT_ATTENDANCE_STATUS)
+        attendance.lesson = lesson
+        result.append(attendance)
+    return result
+
+
+def homework_for_lessons(lessons, student, submissions):
+    """То же, что attendance_for_lessons, для домашних заданий"""
+    by_lesson = {submission.lesson_id: submission for submission in submissions}
+    result = []
+    for lesson in lessons:
+        submission = by_lesson.get(lesson.id)
+        if submission is None:
+            submission = HomeworkSubmission(student=student, status=DEFAULT_HOMEWORK_STATUS, score=None)
+        submission.lesson = lesson
+        result.append(submission)
+    return result
+
+
+def build_progress_rows(lessons, students):
+    """Строит (не сохраняя) Attendance и HomeworkSubmission для пар урок × студент"""
+    attendances = []
+    submissions = []
+    for lesson in lessons:
+        for student in students:
+            attendances.append(Attendance(lesson=lesson, student=student, status='0'))
+            submissions.append(HomeworkSubmission(lesson=lesson, student=student, status='black'))
+    return attendances, submissions
+
+
+# Однобуквенные коды статусов для компактного (matrix) дашборда
+ATTENDANCE_CODES = {'0': '0', '1': '1', 'online': 'o'}
+HOMEWORK_CODES = {'green': 'g', 'orange': 'o', 'red': 'r', 'black': 'b'}
+
+
+class GroupDashboard:
+    """
+    Данные дашборда группы. Каждая часть (месяцы, ученики, посещаемость,
+    ДЗ, счета) загружается лениво одним запросом на всю группу и
+    раскладывается по ученикам в памяти, поэтому вкладка выполняет только
+    свои запросы, а их число не зависит от размера группы.
+    """
+
+    def __init__(self, group):
+        self.group = group
+
+    @cached_property
+    def months(self):
+        # prefetch проставляет month.group и lesson.month — сериализаторам
+        # не нужно ходить по внешним ключам
+        return list(self.group.months.order_by('month_number').prefetch_related('lessons'))
+
+    @cached_property
+    def lessons(self):
+        return [lesson for month in self.months for lesson in month.lessons.all()]
+
+    @cached_property
+    def students(self):
+        return list(self.group.students.all())
+
+    @cached_property
+    def _attendances(self):
+        return _group_by_student(Attendance.objects.filter(lesson__month__group=self.group))
+
+    @cached_property
+    def _submissions(self):
+        return _group_by_student(HomeworkSubmission.objects.filter(lesson__month__group=self.group))
+
+    @cached_property
+    def _invoices(self):
+        return _group_by_student(Invoice.objects.filter(months__group=self.group))
+
+    def attendances(self, student):
+        return attendance_for_lessons(self.lessons, student, self._attendances.get(student.id, ()))
+
+    def submissions(self, student):
+        return homework_for_lessons(self.lessons, student, self._submissions.get(student.id, ()))
+
+    def invoices(self, student):
+        return self._invoices.get(student.id, [])
+
+    def matrix(self, parts=('attendance', 'homework', 'payments')):
+        """
+        Компактная форма для таблицы SPA: индексы уроков и учеников отдаются
+        один раз, а посещаемость, статусы ДЗ и оценки — плотными массивами
+        по ученикам в порядке lessons. Коды статусов расшифровывает codes.
+        parts ограничивает набор массивов (и выполняемых запросов).
+        """
+        data = {
+            'columns': {
+                'lessons': ['id', 'month_number', 'order', 'title'],
+                'students': ['id', 'username', 'first_name', 'last_name', 'is_active'],
+            },
+            'codes': {},
+            'lessons': [
+                [lesson.id, lesson.month.month_number, lesson.order, lesson.title]
+                for lesson in self.lessons
+            ],
+            'students': [
+                [student.id, student.username, student.first_name, student.last_name, student.is_active]
+                for student in self.students
+            ],
+        }
+
+        if 'attendance' in parts:
+            data['codes']['attendance'] = {code: status for status, code in ATTENDANCE_CODES.items()}
+            data['attendance'] = []
+            for student in self.students:
+                statuses = {a.lesson_id: a.status for a in self._attendances.get(student.id, ())}
+                data['attendance'].append([
+                    ATTENDANCE_CODES[statuses.get(lesson.id, DEFAULT_ATTENDANCE_STATUS)]
+                    for lesson in self.lessons
+                ])
+
+        if 'homework' in parts:
+            data['codes']['homework'] = {code: status for status, code in HOMEWORK_CODES.items()}
+            data['homework'], data['scores'] = [], []
+            for student in self.students:
+                submissions = {s.lesson_id: s for s in self._submissions.get(student.id, ())}
+                homework_row, score_row = [], []
+                for lesson in self.lessons:
+                    submission = submissions.get(lesson.id)
+                    homework_row.append(HOMEWORK_CODES[submission.status if submission else DEFAULT_HOMEWORK_STATUS])
+                    score_row.append(submission.score if submission else None)
+                data['homework'].append(homework_row)
+                data['scores'].append(score_row)
+
+        if 'payments' in parts:
+            data['columns']['payments'] = ['id', 'final_amount', 'paid_amount', 'balance']
+            data['payments'] = [
+                [
+                    [invoice.id, invoice.final_amount, invoice.paid_amount, invoice.balance]
+                    for invoice in self.invoices(student)
+                ]
+                for student in self.students
+            ]
+
+        return data
+
+    def stats(self):
+        """
+        Сводка по группе агрегатами в БД, без выборки строк прогресса.
+        Посещаемость считается по урокам пройденных месяцев (до текущего
+        включительно): отсутствующая строка — пропуск.
+        """
+        group = self.group
+        students = group.students.all()
+        student_count = students.count()
+        held_lessons = Lesson.objects.filter(
+            month__group=group, month__month_number__lte=group.current_month
+        )
+        held_count = held_lessons.count()
+
+        present = Attendance.objects.filter(
+            lesson__in=held_lessons, student__in=students, status__in=('1', 'online')
+        ).count()
+        average_score = HomeworkSubmission.objects.filter(
+            lesson__month__group=group, student__in=students, score__isnull=False
+        ).aggregate(value=Avg('score'))['value']
+
+        invoices = Invoice.objects.filter(months__group=group)
+        billed = invoices.aggregate(
+            value=Sum(F('amount') - F('discount'), output_field=DecimalField(max_digits=12, decimal_places=2))
+        )['value'] or 0
+        paid = Payment.objects.filter(invoice__in=invoices).aggregate(
+            value=Sum(
+                F('cash_amount') + F('transfer_amount') + F('online_amount'),
+                output_field=DecimalField(max_digits=12, decimal_places=2)
+            )
+        )['value'] or 0
+
+        expected = held_count * student_count
+        return {
+            'student_count': student_count,
+            'held_lessons': held_count,
+            'attendance_rate': round(present * 100 / expected, 1) if expected else None,
+            'average_score': round(average_score, 2) if average_score is not None else None,
+            'billed': billed,
+            'paid': paid,
+            'paid_percentage': round(float(paid) * 100 / float(billed), 1) if billed else None,
+        }
+
+
+def _group_by_student(queryset):
+    rows = defaultdict(list)
+    for row in queryset:
+        rows[row.student_id].append(row)
+    return rows
+
+
+# Поля урока, которые берутся из шаблона направления
+TEMPLATE_LESSON_FIELDS = (
+    'title', 'description', 'lesson_links', 'homework_links',
+    'homework_description', 'homework_requirements'
+)
+
+
+def load_templates(direction_ids):
+    """
+    Шаблоны учебных планов направлений двумя запросами:
+    {(direction_id, month_number): TemplateMonth} и
+    {(direction_id, month_number, order): TemplateLesson}.
+    """
+    months = {
+        (month.direction_id, month.month_number): month
+        for month in TemplateMonth.objects.filter(direction_id__in=direction_ids)
+    }
+    lessons = {
+        (lesson.month.direction_id, lesson.month.month_number, lesson.order): lesson
+        for lesson in TemplateLesson.objects.filter(month__direction_id__in=direction_ids).select_related('month')
+    }
+    return months, lessons
+
+
+def month_content(template, month_number):
+    if template is not None:
+        return {'title': template.title, 'description': template.description}
+    return {'title': f"Месяц {month_number}", 'description': f"Описание месяца {month_number}"}
+
+
+def lesson_content(template, order):
+    if template is not None:
+        return {field: getattr(template, field) for field in TEMPLATE_LESSON_FIELDS}
+    return {'title': f"Урок {order}", 'description': f"Описание урока {order}"}
+
+
+def generate_curriculum(group, students=None):
+    """
+    Создаёт для группы месяцы, уроки, посещаемость и домашние задания
+    (последние два — только если прогресс хранится не в разреженном режиме).
+    Содержимое месяцев и уроков копируется из шаблона направления,
+    где он задан, остальное заполняется заглушками.
+
+    Всё дерево собирается в памяти и записывается пачками bulk_create в одной
+    транзакции, поэтому число запросов не зависит от размера группы.
+    Функция идемпотентна: уже существующие строки пропускаются.
+    """
+    if students is None:
+        students = list(group.students.all())
+
+    template_months, template_lessons = load_templates([group.direction_id])
+
+    with transaction.atomic():
+        Months.objects.bulk_create(
+            [
+                Months(
+                    group=group,
+                    month_number=month_num,
+                    **month_content(template_months.get((group.direction_id, month_num)), month_num)
+                )
+                for month_num in range(1, group.duration_months + 1)
+            ],
+            batch_size=BULK_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        # При ignore_conflicts первичные ключи не возвращаются — перечитываем
+        months = list(Months.objects.filter(group=group))
+
+        Lesson.objects.bulk_create(
+            [
+                Lesson(
+                    month=month,
+                    order=lesson_num,
+                    **lesson_content(
+                        template_lessons.get((group.direction_id, month.month_number, lesson_num)),
+                        lesson_num
+                    )
+                )
+                for month in months
+                for lesson_num in range(1, group.lessons_per_month + 1)
+            ],
+            batch_size=BULK_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+
+        if students and not sparse_progress():
+            lessons = list(Lesson.objects.filter(month__group=group))
+            attendances, submissions = build_progress_rows(lessons, students)
+            Attendance.objects.bulk_create(
+                attendances, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True
+            )
+            HomeworkSubmission.objects.bulk_create(
+                submissions, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True
+            )
+
+        # bulk_create не шлёт сигналов — кэш группы сбрасываем сами
+        bump_group_versions([group.id])
+
+    return months
+
+
+def replace_direction_template(direction, months_data):
+    """
+    Полностью заменяет шаблон направления. months_data — список месяцев
+    с вложенными lessons (см. DirectionTemplateSerializer).
+    """
+    with transaction.atomic():
+        TemplateMonth.objects.filter(direction=direction).delete()
+        TemplateMonth.objects.bulk_create(
+            [
+                TemplateMonth(
+                    direction=direction,
+                    **{key: value for key, value in month.items() if key != 'lessons'}
+                )
+                for month in months_data
+            ],
+            batch_size=BULK_BATCH_SIZE
+        )
+        months = {month.month_number: month for month in TemplateMonth.objects.filter(direction=direction)}
+        TemplateLesson.objects.bulk_create(
+            [
+                TemplateLesson(month=months[month['month_number']], **lesson)
+                for month in months_data
+                for lesson in month.get('lessons', [])
+            ],
+            batch_size=BULK_BATCH_SIZE
+        )
+
+
+def sync_groups_from_template(groups):
+    """
+    Переносит правки шаблонов направлений в существующие месяцы и уроки групп.
+
+    Меняются только поля, заполненные в шаблоне: пустое поле шаблона не
+    стирает ссылки и материалы, которые преподаватель добавил в урок группы.
+    Даты, записи, файлы и дедлайны уроков остаются как были. Изменённые
+    строки записываются одним bulk_update на таблицу. Возвращает число
+    обновлённых месяцев и уроков.
+    """
+    groups = list(groups)
+    direction_of = {group.id: group.direction_id for group in groups}
+    template_months, template_lessons = load_templates(set(direction_of.values()))
+
+    months = []
+    for month in Months.objects.filter(group_id__in=direction_of):
+        template = template_months.get((direction_of[month.group_id], month.month_number))
+        if template is None:
+            continue
+        content = _filled(month_content(template, month.month_number))
+        if any(getattr(month, field) != value for field, value in content.items()):
+            for field, value in content.items():
+                setattr(month, field, value)
+            months.append(month)
+
+    lessons = []
+    for lesson in Lesson.objects.filter(month__group_id__in=direction_of).select_related('month'):
+        key = (direction_of[lesson.month.group_id], lesson.month.month_number, lesson.order)
+        template = template_lessons.get(key)
+        if template is None:
+            continue
+        content = _filled(lesson_content(template, lesson.order))
+        if any(getattr(lesson, field) != value for field, value in content.items()):
+            for field, value in content.items():
+                setattr(lesson, field, value)
+            lessons.append(lesson)
+
+    with transaction.atomic():
+        Months.objects.bulk_update(months, ['title', 'description'], batch_size=BULK_BATCH_SIZE)
+        Lesson.objects.bulk_update(lessons, list(TEMPLATE_LESSON_FIELDS), batch_size=BULK_BATCH_SIZE)
+        bump_group_versions(
+            {month.group_id for month in months} | {lesson.month.group_id for lesson in lessons}
+        )
+        if months:
+            bump_table_versions([Months])
+
+    return {'months': len(months), 'lessons': len(lessons)}
+
+
+def _filled(content):
+    return {field: value for field, value in content.items() if value}
+
+
+def create_missing_progress_rows(memberships):
+    """
+    Добавляет посещаемость и ДЗ по всем урокам групп для новых участников.
+
+    memberships — пары (group_id, user_id). Уроки и существующие пары
+    (урок, студент) выбираются одним запросом на таблицу, вставляются
+    только недостающие строки. В разреженном режиме ничего не создаёт.
+    """
+    memberships = set(memberships)
+    if not memberships or sparse_progress():
+        return 0
+
+    group_ids = {group_id for group_id, _ in memberships}
+    student_ids = {user_id for _, user_id in memberships}
+
+    lessons = list(Lesson.objects.filter(month__group_id__in=group_ids).values_list('id', 'month__group_id'))
+    if not lessons:
+        return 0
+
+    students_by_group = defaultdict(set)
+    for group_id, user_id in memberships:
+        students_by_group[group_id].add(user_id)
+
+    lesson_ids = [lesson_id for lesson_id, _ in lessons]
+    wanted = {
+        (lesson_id, student_id)
+        for lesson_id, group_id in lessons
+        for student_id in students_by_group[group_id]
+    }
+    existing_attendance = set(
+        Attendance.objects.filter(lesson_id__in=lesson_ids, student_id__in=student_ids)
+        .values_list('lesson_id', 'student_id')
+    )
+    existing_homework = set(
+        HomeworkSubmission.objects.filter(lesson_id__in=lesson_ids, student_id__in=student_ids)
+        .values_list('lesson_id', 'student_id')
+    )
+
+    Attendance.objects.bulk_create(
+        [
+            Attendance(lesson_id=lesson_id, student_id=student_id, status='0')
+            for lesson_id, student_id in wanted - existing_attendance
+        ],
+        batch_size=BULK_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+    HomeworkSubmission.objects.bulk_create(
+        [
+            HomeworkSubmission(lesson_id=lesson_id, student_id=student_id, status='black')
+            for lesson_id, student_id in wanted - existing_homework
+        ],
+        batch_size=BULK_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+    return len(wanted - existing_attendance)
+
+
+def _pairs_q(pairs, left, right):
+    """
+    Q-условие «(left, right) входит в pairs».
+
+    Пары группируются по стороне с меньшим числом различных значений, чтобы
+    условие оставалось коротким: OR из нескольких `left=x AND right IN (...)`.
+    """
+    by_left = defaultdict(set)
+    by_right = defaultdict(set)
+    for a, b in pairs:
+        by_left[a].add(b)
+        by_right[b].add(a)
+
+    q = Q(pk__in=[])
+    if len(by_left) <= len(by_right):
+        for a, values in by_left.items():
+            q |= Q(**{left: a, f"{right}__in": values})
+    else:
+        for b, values in by_right.items():
+            q |= Q(**{right: b, f"{left}__in": values})
+    return q
+
+
+def apply_membership_changes(student_links=(), student_unlinks=(), teacher_links=(), teacher_unlinks=()):
+    """
+    Применяет пакет изменений членства в группах в одной транзакции.
+
+    Членство хранится в четырёх местах: Group.students, Student.groups,
+    Teacher.groups и Group.teacher — функция обновляет их все, а заодно
+    направления профилей и прогресс новых учеников. Аргументы — пары
+    (group_id, user_id). Каждая таблица связей меняется одной массовой
+    вставкой или удалением, Group.teacher — одним update на преподавателя,
+    так что число запросов не зависит от количества групп и учеников.
+    """
+    student_links = set(student_links)
+    student_unlinks = set(student_unlinks) - student_links
+    # У группы один преподаватель: при повторе побеждает последняя пара
+    teacher_links = dict(teacher_links)
+    teacher_unlinks = {
+        (group_id, user_id) for group_id, user_id in teacher_unlinks
+        if teacher_links.get(group_id) != user_id
+    }
+    if not (student_links or student_unlinks or teacher_links or teacher_unlinks):
+        return
+
+    group_ids = (
+        {group_id for group_id, _ in student_links | student_unlinks | teacher_unlinks}
+        | set(teacher_links)
+    )
+
+    with transaction.atomic():
+        groups = {
+            group_id: (direction_id, teacher_id)
+            for group_id, direction_id, teacher_id in
+            Group.objects.filter(id__in=group_ids).values_list('id', 'direction_id', 'teacher_id')
+        }
+
+        if student_unlinks or student_links:
+            _apply_student_changes(groups, student_links, student_unlinks)
+        if teacher_unlinks or teacher_links:
+            _apply_teacher_changes(groups, teacher_links, teacher_unlinks)
+        # Таблицы связей менялись массово, без сигналов
+        bump_group_versions(groups)
+        bump_table_versions([Group, Student, Teacher])
+
+
+def _apply_student_changes(groups, links, unlinks):
+    group_students = Group.students.through
+    student_groups = Student.groups.through
+    student_directions = Student.directions.through
+
+    if unlinks:
+        group_students.objects.filter(_pairs_q(unlinks, 'group_id', 'customuser_id')).delete()
+        student_groups.objects.filter(_pairs_q(unlinks, 'group_id', 'student__user_id')).delete()
+        # Направление убираем, только если у студента не осталось
+        # других групп этого направления
+        direction_pairs = {
+            (groups[group_id][0], user_id) for group_id, user_id in unlinks
+            if group_id in groups and groups[group_id][0]
+        }
+        if direction_pairs:
+            student_directions.objects.filter(
+                _pairs_q(direction_pairs, 'direction_id', 'student__user_id')
+            ).exclude(
+                Exists(student_groups.objects.filter(
+                    student_id=OuterRef('student_id'),
+                    group__direction_id=OuterRef('direction_id')
+                ))
+            ).delete()
+
+    if links:
+        links = {(group_id, user_id) for group_id, user_id in links if group_id in groups}
+        profiles = dict(
+            Student.objects.filter(user_id__in={user_id for _, user_id in links})
+            .values_list('user_id', 'id')
+        )
+        group_students.objects.bulk_create(
+            [group_students(group_id=group_id, customuser_id=user_id) for group_id, user_id in links],
+            batch_size=BULK_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        student_groups.objects.bulk_create(
+            [
+                student_groups(student_id=profiles[user_id], group_id=group_id)
+                for group_id, user_id in links if user_id in profiles
+            ],
+            batch_size=BULK_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        student_directions.objects.bulk_create(
+            list({
+                (profiles[user_id], groups[group_id][0]): student_directions(
+                    student_id=profiles[user_id], direction_id=groups[group_id][0]
+                )
+                for group_id, user_id in links
+                if user_id in profiles and groups[group_id][0]
+            }.values()),
+            batch_size=BULK_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        create_missing_progress_rows(links)
+
+
+def _apply_teacher_changes(groups, links, unlinks):
+    teacher_groups = Teacher.groups.through
+    teacher_directions = Teacher.directions.through
+
+    if unlinks:
+        Group.objects.filter(_pairs_q(unlinks, 'id', 'teacher_id')).update(teacher=None)
+        teacher_groups.objects.filter(_pairs_q(unlinks, 'group_id', 'teacher__user_id')).delete()
+
+    if links:
+        links = {group_id: user_id for group_id, user_id in links.items() if group_id in groups}
+        by_teacher = defaultdict(set)
+        for group_id, user_id in links.items():
+            by_teacher[user_id].add(group_id)
+        for user_id, group_ids in by_teacher.items():
+            Group.objects.filter(id__in=group_ids).update(teacher_id=user_id)
+
+        # Группа уходит из профиля прежнего преподавателя
+        replaced = {
+            (group_id, groups[group_id][1]) for group_id, user_id in links.items()
+            if groups[group_id][1] and groups[group_id][1] != user_id
+        }
+        if replaced:
+            teacher_groups.objects.filter(_pairs_q(replaced, 'group_id', 'teacher__user_id')).delete()
+
+        profiles = dict(Teacher.objects.filter(user_id__in=by_teacher).values_list('user_id', 'id'))
+        teacher_groups.objects.bulk_create(
+            [
+                teacher_groups(teacher_id=profiles[user_id], group_id=group_id)
+                for group_id, user_id in links.items() if user_id in profiles
+            ],
+            batch_size=BULK_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        teacher_directions.objects.bulk_create(
+            list({
+                (profiles[user_id], groups[group_id][0]): teacher_directions(
+                    teacher_id=profiles[user_id], direction_id=groups[group_id][0]
+                )
+                for group_id, user_id in links.items()
+                if user_id in profiles and groups[group_id][0]
+            }.values()),
+            batch_size=BULK_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+
+
+def calculate_teacher_payments(month, year):
+    """Рассчитывает выплаты всем активным преподавателям за месяц"""
+    month, year = int(month), int(year)
+    start_date = timezone.make_aware(datetime(year, month, 1))
+    end_date = timezone.make_aware(datetime(year, month, calendar.monthrange(year, month)[1]))
+
+    teachers = CustomUser.objects.filter(role='Teacher', is_active=True)
+    results = []
+
+    for teacher in teachers:
+        try:
+            # Получаем профиль преподавателя
+            teacher_profile = Teacher.objects.get(user=teacher)
+
+            # Получаем группы, где преподаватель является teacher
+            groups = Group.objects.filter(teacher=teacher)
+
+            total_lessons = 0
+            total_payment = 0
+
+            for group in groups:
+                lessons_count = Lesson.objects.filter(
+                    month__group=group,
+                    date__range=[start_date, end_date]
+                ).count()
+
+                if teacher_profile.payment_type == 'fixed':
+                    if teacher_profile.payment_period == 'month':
+                        payment = teacher_profile.payment_amount
+                    else:  # per_lesson
+                        payment = teacher_profile.payment_amount * lessons_count
+                else:  # hourly
+                    payment = teacher_profile.payment_amount * lessons_count * group.lesson_duration
+
+                total_lessons += lessons_count
+                total_payment += payment
+
+            # Создаем или обновляем запись о выплате
+            payment, created = TeacherPayment.objects.update_or_create(
+                teacher=teacher,
+                date=end_date,
+                defaults={
+                    'lessons_count': total_lessons,
+                    'rate': teacher_profile.payment_amount,
+                    'payment': total_payment,
+                    'bonus': 0,
+                    'is_paid': False
+                }
+            )
+
+            results.append({
+                'teacher_id': teacher.id,
+                'teacher_name': teacher.get_full_name(),
+                'lessons_count': total_lessons,
+                'payment': total_payment,
+                'status': 'created' if created else 'updated'
+            })
+
+        except Teacher.DoesNotExist:
+            results.append({
+                'teacher_id': teacher.id,
+                'error': 'Teacher profile not found'
+            })
+            continue
+
+    return {
+        'status': 'success',
+        'period': f"{start_date.date()} - {end_date.date()}",
+        'teachers_processed': len(results),
+        'results': results
+    }
+
+
+def generate_invoices(amount, due_date, month_number=None, on_date=None, discount=0,
+                      group_ids=None, comment='', dry_run=False):
+    """
+    Счета за месяц курса всем активным ученикам активных групп.
+
+    Месяц группы — month_number либо текущий месяц курса на дату on_date.
+    Уже выставленные пары (ученик, месяц) находятся одним запросом и
+    пропускаются, роли и активность участников проверяются в том же
+    запросе, что и состав групп. Новые счета пишутся bulk_create в одной
+    транзакции — full_clean() на строку не вызывается. dry_run только
+    считает, что будет создано
+    """
+    months = Months.objects.filter(group__is_active=True)
+    if group_ids:
+        months = months.filter(group_id__in=group_ids)
+    if month_number is not None:
+        months = months.filter(month_number=month_number)
+    else:
+        months = months.annotate(
+            group_month=current_month_expression('group__', on_date)
+        ).filter(month_number=F('group_month'))
+    # (group, month_number) уникальны — у группы не больше одного месяца
+    month_by_group = dict(months.order_by().values_list('group_id', 'id'))
+
+    memberships = Group.students.through.objects.filter(group_id__in=month_by_group).values_list(
+        'group_id', 'customuser_id', 'customuser__role', 'customuser__is_active'
+    )
+    existing = set(
+        Invoice.objects.filter(months_id__in=month_by_group.values()).order_by().values_list('student_id', 'months_id')
+    )
+
+    invoices, per_group = [], defaultdict(int)
+    skipped_students = already_billed = 0
+    for group_id, user_id, role, is_active in memberships:
+        months_id = month_by_group[group_id]
+        if role != 'Student' or not is_active:
+            skipped_students += 1
+        elif (user_id, months_id) in existing:
+            already_billed += 1
+        else:
+            per_group[group_id] += 1
+            invoices.append(Invoice(
+                student_id=user_id, months_id=months_id, amount=amount, discount=discount,
+                due_date=due_date, comment=comment,
+            ))
+
+    if invoices and not dry_run:
+        with transaction.atomic():
+            Invoice.objects.bulk_create(invoices, batch_size=BULK_BATCH_SIZE)
+            LedgerEntry.objects.append([entry for invoice in invoices for entry in invoice.ledger_changes()])
+            # bulk_create не шлёт сигналов — кэш групп и ETag счетов сбрасываем сами
+            bump_versions([*map(group_key, per_group), table_key(Invoice)])
+
+    return {
+        'dry_run': dry_run,
+        'months': len(month_by_group),
+        'created': len(invoices),
+        'already_billed': already_billed,
+        'skipped_students': skipped_students,
+        'groups': [
+            {'group_id': group_id, 'months_id': months_id, 'created': per_group.get(group_id, 0)}
+            for group_id, months_id in sorted(month_by_group.items())
+        ],
+    }
+
+
+PAYMENT_CHANNELS = ('cash_amount', 'transfer_amount', 'online_amount')
+
+
+def lock_rows(queryset):
+    """
+    Блокирует строки queryset до конца транзакции. SQLite не знает
+    SELECT ... FOR UPDATE: там блокировку записи берёт холостой UPDATE
+    до чтения. Иначе две транзакции прочитают одно и то же, а запись
+    второй упадёт с "database is locked", не дождавшись timeout
+    """
+    pk = queryset.model._meta.pk.attname
+    queryset.update(**{pk: F(pk)})
+    return queryset.select_for_update()
+
+
+def allocate_payment(student, date=None, comment='', **amounts):
+    """
+    Разносит оплату ученика по его открытым счетам в порядке срока оплаты:
+    каждый счёт закрывается до конца, остаток идёт на следующий, переплата
+    остаётся на последнем. На каждый счёт — свой Payment; суммы каналов
+    (наличные, перевод, онлайн) расходуются по очереди.
+
+    Возвращает созданные платежи; пустой список — у ученика нет открытых
+    счетов. Пакетный вариант — allocate_payments
+    """
+    return allocate_payments([
+        {'student_id': student.pk, 'amounts': amounts, 'date': date, 'comment': comment}
+    ])[0]
+
+
+def allocate_payments(items):
+    """
+    Разносит пачку оплат (см. allocate_payment) в одной транзакции: открытые
+    счета всех учеников пачки блокируются и читаются одним запросом, платежи
+    пишутся bulk_create, paid_total и статусы — одним UPDATE, журнал — одной
+    вставкой. Оплаты одного ученика разносятся по порядку, каждая видит
+    предыдущие.
+
+    items — словари student_id, amounts ({канал: сумма}), date, comment и
+    необязательный invoice_id — счёт, который закрывается первым.
+    Возвращает списки платежей в порядке items. Отрицательная сумма канала
+    или нулевая оплата — ValueError: иначе F-обновление уменьшило бы paid_total
+    """
+    for item in items:
+        amounts = [Decimal(item['amounts'].get(channel) or 0) for channel in PAYMENT_CHANNELS]
+        if min(amounts) < 0 or sum(amounts) <= 0:
+            raise ValueError("Сумма оплаты должна быть больше нуля, суммы каналов — не отрицательными")
+
+    with transaction.atomic():
+        open_invoices = Invoice.objects.filter(
+            student_id__in={item['student_id'] for item in items}
+        ).exclude(status='paid')
+        invoices_by_student = defaultdict(list)
+        for invoice in lock_rows(open_invoices).select_related('months').order_by('due_date', 'id'):
+            invoices_by_student[invoice.student_id].append(invoice)
+
+        # Оплачено в этой пачке, по id счёта
+        paid_now = defaultdict(Decimal)
+        results, payments = [], []
+        for item in items:
+            invoices = invoices_by_student[item['student_id']]
+            if item.get('invoice_id'):
+                invoices = sorted(invoices, key=lambda invoice: invoice.id != item['invoice_id'])
+            item_payments = _split_payment(item, invoices, paid_now)
+            results.append(item_payments)
+            payments.extend(item_payments)
+
+        if not payments:
+            return results
+
+        Payment.objects.bulk_create(payments, batch_size=BULK_BATCH_SIZE)
+        Invoice.objects.add_paid_many(paid_now)
+        LedgerEntry.objects.append([
+            LedgerEntry(student_id=payment.invoice.student_id, payment=payment, kind='payment',
+                        amount=-payment.total_amount)
+            for payment in payments
+        ])
+        totals = {
+            pk: (paid_total, status) for pk, paid_total, status in
+            Invoice.objects.filter(pk__in=paid_now).values_list('pk', 'paid_total', 'status')
+        }
+        for payment in payments:
+            payment.invoice.paid_total, payment.invoice.status = totals[payment.invoice_id]
+
+        # bulk_create и update сигналов не шлют
+        bump_versions([
+            *{group_key(payment.invoice.months.group_id) for payment in payments},
+            table_key(Invoice), table_key(Payment),
+        ])
+    return results
+
+
+def _split_payment(item, invoices, paid_now):
+    left = {channel: Decimal(item['amounts'].get(channel) or 0) for channel in PAYMENT_CHANNELS}
+    extra = {'comment': item.get('comment') or ''}
+    if item.get('date') is not None:
+        extra['date'] = item['date']
+
+    payments = []
+    for index, invoice in enumerate(invoices):
+        remaining = sum(left.values())
+        if not remaining:
+            break
+        is_last = index == len(invoices) - 1
+        due = invoice.final_amount - invoice.paid_total - paid_now.get(invoice.id, 0)
+        take = remaining if is_last else min(remaining, due)
+        if take <= 0:
+            continue
+        parts = {}
+        for channel in PAYMENT_CHANNELS:
+            parts[channel] = min(left[channel], take)
+            left[channel] -= parts[channel]
+            take -= parts[channel]
+        payment = Payment(invoice=invoice, **parts, **extra)
+        paid_now[invoice.id] += payment.total_amount
+        payments.append(payment)
+    return payments
@@ -0,0 +1,195 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from app.administration import search
+from app.administration.caching import bump_group_versions, bump_table_versions
+from app.administration.models import (
+    Attendance, Classroom, Direction, Group, HomeworkSubmission, Invoice, Lead, LedgerEntry, Lesson, Months,
+    Payment, Schedule, Student, Teacher
+)
+from app.users.models import CustomUser
+
+
+# Версия группы увеличивается при любой записи, которая меняет её дашборд,
+# оценки или прогресс учеников. Массовые операции (bulk_create, update)
+# сигналов не шлют — сервисы увеличивают версии сами
+
+@receiver([post_save, post_delete], sender=Group)
+def group_changed(sender, instance, **kwargs):
+    bump_group_versions([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Months)
+def month_changed(sender, instance, **kwargs):
+    bump_group_versions([instance.group_id])
+
+
+@receiver([post_save, post_delete], sender=Lesson)
+def lesson_changed(sender, instance, **kwargs):
+    bump_group_versions(_month_groups([instance.month_id]))
+
+
+# Удаление прогресса увеличивает версии в ProgressQuerySet: приёмник
+# post_delete отключил бы быстрое удаление этих таблиц
+@receiver(post_save, sender=Attendance)
+@receiver(post_save, sender=HomeworkSubmission)
+def progress_changed(sender, instance, **kwargs):
+    bump_group_versions(_month_groups([instance.lesson_id], 'lessons__id'))
+
+
+@receiver([post_save, post_delete], sender=Invoice)
+def invoice_changed(sender, instance, **kwargs):
+    bump_group_versions(_month_groups([instance.months_id]))
+
+
+def _student_deleted(origin):
+    # Удаление ученика каскадом удаляет и его журнал — писать в него нечего
+    return isinstance(origin, CustomUser) or getattr(origin, 'model', None) is CustomUser
+
+
+@receiver(post_delete, sender=Payment)
+def payment_deleted(sender, instance, origin=None, **kwargs):
+    # Работает и для удаления через QuerySet; Collector шлёт сигнал
+    # в транзакции удаления
+    Invoice.objects.filter(pk=instance.invoice_id).add_paid(-instance.total_amount)
+    if not _student_deleted(origin):
+        student_id = Invoice.objects.filter(pk=instance.invoice_id).values_list('student_id', flat=True).first()
+        if student_id:
+            LedgerEntry.objects.append([
+                LedgerEntry(student_id=student_id, kind='adjustment', amount=instance.total_amount)
+            ])
+
+
+@receiver(post_delete, sender=Invoice)
+def invoice_deleted(sender, instance, origin=None, **kwargs):
+    # Оплаты счёта удалены каскадом раньше и уже вернули долг
+    if not _student_deleted(origin):
+        LedgerEntry.objects.append([
+            LedgerEntry(student_id=instance.student_id, kind='adjustment', amount=-instance.final_amount)
+        ])
+
+
+@receiver([post_save, post_delete], sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    group_ids = Invoice.objects.filter(id=instance.invoice_id).values_list('months__group_id', flat=True)
+    bump_group_versions(list(group_ids))
+
+
+@receiver(m2m_changed, sender=Group.students.through)
+def group_students_changed(sender, instance, action, pk_set, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # instance — ученик; при clear pk_set пуст, группы уже отвязаны
+        bump_group_versions(pk_set or [])
+    else:
+        bump_group_versions([instance.id])
+
+
+@receiver(post_save, sender=Direction)
+def direction_changed(sender, instance, created, **kwargs):
+    if not created:
+        bump_group_versions(list(instance.groups.values_list('id', flat=True)))
+
+
+@receiver(pre_delete, sender=CustomUser)
+def user_deleting(sender, instance, **kwargs):
+    # Прогресс и членство ученика удаляются каскадом без сигналов
+    bump_group_versions(_user_groups(instance))
+
+
+@receiver(post_save, sender=CustomUser)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    # Имена учеников и преподавателей выводятся в дашбордах групп
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    bump_group_versions(_user_groups(instance))
+
+
+def _user_groups(user):
+    group_ids = set(Group.objects.filter(teacher=user).values_list('id', flat=True))
+    group_ids.update(user.student_groups.values_list('id', flat=True))
+    return group_ids
+
+
+def _month_groups(ids, lookup='id'):
+    """id групп по id месяцев или, с lookup='lessons__id', по id уроков"""
+    ids = [pk for pk in ids if pk]
+    if not ids:
+        return []
+    return list(Months.objects.filter(**{f'{lookup}__in': ids}).values_list('group_id', flat=True))
+
+
+# Счётчики версий таблиц для ETag списков (см. ConditionalListMixin):
+# нужны моделям без отметки времени изменения и связанным данным в ответах
+TABLE_VERSIONED_MODELS = [
+    Invoice, Payment, Months, Schedule, Classroom, Group, Direction, Student, Teacher, CustomUser
+]
+
+
+def table_changed(sender, **kwargs):
+    bump_table_versions([sender])
+
+
+def table_links_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_table_versions(TABLE_LINKS[sender])
+
+
+# Таблица связей -> модели, в ответах которых видны связи
+TABLE_LINKS = {
+    Group.students.through: [Group, CustomUser],
+    Student.groups.through: [Student, Group],
+    Student.directions.through: [Student, Direction],
+    Teacher.groups.through: [Teacher, Group],
+    Teacher.directions.through: [Teacher, Direction],
+}
+
+for model in TABLE_VERSIONED_MODELS:
+    post_save.connect(table_changed, sender=model, dispatch_uid=f'table-version-save-{model._meta.label_lower}')
+    post_delete.connect(table_changed, sender=model, dispatch_uid=f'table-version-delete-{model._meta.label_lower}')
+
+for through in TABLE_LINKS:
+    m2m_changed.connect(table_links_changed, sender=through, dispatch_uid=f'table-version-m2m-{through._meta.label_lower}')
+
+
+# Поисковый индекс (см. search.py). Документ пересобирается из сохранённого
+# объекта, удаление — по rowid
+
+@receiver(post_save, sender=CustomUser)
+def user_search_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    search.index_user(instance)
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_search_deleted(sender, instance, **kwargs):
+    search.remove_documents('student', [instance.id])
+
+
+@receiver(post_save, sender=Group)
+def group_search_changed(sender, instance, **kwargs):
+    search.index_documents([search.group_document(instance)])
+
+
+@receiver(post_delete, sender=Group)
+def group_search_deleted(sender, instance, **kwargs):
+    search.remove_documents('group', [instance.id])
+
+
+@receiver(post_save, sender=Direction)
+def direction_search_changed(sender, instance, created, **kwargs):
+    # Название направления входит в документы его групп
+    if not created and search.index_available():
+        search.index_documents(search.group_document(group) for group in instance.groups.select_related('direction'))
+
+
+@receiver(post_save, sender=Lead)
+def lead_search_changed(sender, instance, **kwargs):
+    search.index_documents([search.lead_document(instance)])
+
+
+@receiver(post_delete, sender=Lead)
+def lead_search_deleted(sender, instance, **kwargs):
+    search.remove_documents('lead', [instance.id])
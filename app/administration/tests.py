@@ -1,3 +1,1347 @@
-from django.test import TestCase
+import io
+from unittest import mock
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from app.administration.caching import get_versions, group_key
+from app.administration.facets import get_facets
+from app.administration.jobs import enqueue_job, claim_job, heartbeat, requeue_stale_jobs, run_job
+from app.administration.models import (
+    Direction, Group, Student, Teacher, Months, Lesson, Attendance, HomeworkSubmission, Job,
+    TemplateMonth, TemplateLesson, Invoice, Payment, Lead, LedgerEntry
+    )
+from app.administration.services import (
+    allocate_payment, generate_curriculum, generate_invoices, apply_membership_changes, sync_groups_from_template
+    )
+from app.administration.views import GroupViewSet
+from app.users.models import CustomUser
+
+
+def make_students(prefix, count):
+    return [
+        CustomUser.objects.create(username=f"{prefix}{i}", role='Student')
+        for i in range(count)
+    ]
+
+
+def make_group(direction, name, duration_months, lessons_per_month, students=(), creation_type='manual'):
+    group = Group.objects.create(
+        group_name=name,
+        direction=direction,
+        age_group="10-12",
+        format='offline',
+        duration_months=duration_months,
+        planned_start='2025-01-01',
+        lessons_per_month=lessons_per_month,
+        lesson_duration=2,
+        lessons_per_week=3,
+        schedule_days="пн,ср,пт",
+        creation_type=creation_type,
+    )
+    group.students.set(students)
+    return group
+
+
+@override_settings(SPARSE_PROGRESS=False)
+class GenerateCurriculumTests(TestCase):
+    def setUp(self):
+        self.direction = Direction.objects.create(name="Python")
+
+    def test_creates_full_tree(self):
+        students = make_students("s", 3)
+        group = make_group(self.direction, "G1", 2, 4, students)
+
+        generate_curriculum(group)
+
+        self.assertEqual(Months.objects.filter(group=group).count(), 2)
+        self.assertEqual(Lesson.objects.filter(month__group=group).count(), 8)
+        self.assertEqual(Attendance.objects.filter(lesson__month__group=group, status='0').count(), 24)
+        self.assertEqual(HomeworkSubmission.objects.filter(lesson__month__group=group, status='black').count(), 24)
+
+    def test_is_idempotent(self):
+        group = make_group(self.direction, "G1", 2, 3, make_students("s", 2))
+
+        generate_curriculum(group)
+        generate_curriculum(group)
+
+        self.assertEqual(Lesson.objects.filter(month__group=group).count(), 6)
+        self.assertEqual(Attendance.objects.filter(lesson__month__group=group).count(), 12)
+
+    def test_query_budget_does_not_depend_on_group_size(self):
+        small = make_group(self.direction, "Small", 1, 2, make_students("a", 1))
+        large = make_group(self.direction, "Large", 3, 4, make_students("b", 5))
+
+        # students + 2 template selects + savepoint + months insert/select
+        # + lessons insert/select + attendances + submissions + 2 version bumps
+        # + release savepoint.
+        # SQLite дробит очень большие вставки по лимиту в 999 параметров,
+        # поэтому размеры подобраны так, чтобы каждая таблица влезала в одну пачку.
+        with self.assertNumQueries(13):
+            generate_curriculum(small)
+        with self.assertNumQueries(13):
+            generate_curriculum(large)
+
+        self.assertEqual(Attendance.objects.filter(lesson__month__group=large).count(), 3 * 4 * 5)
+
+    def test_auto_group_generates_on_save(self):
+        group = make_group(self.direction, "Auto", 3, 2, creation_type='auto')
+
+        self.assertEqual(Lesson.objects.filter(month__group=group).count(), 6)
+
+
+@override_settings(SPARSE_PROGRESS=False)
+class MembershipChangesTests(TestCase):
+    def setUp(self):
+        self.direction = Direction.objects.create(name="Python")
+
+    def test_adds_and_removes_in_batches(self):
+        staying, leaving = make_students("s", 2)
+        group = make_group(self.direction, "G1", 2, 5, [staying, leaving])
+        generate_curriculum(group)
+        for user in (staying, leaving):
+            profile = Student.objects.create(user=user)
+            profile.groups.add(group)
+            profile.directions.add(self.direction)
+
+        newcomers = make_students("n", 4)
+        for user in newcomers:
+            Student.objects.create(user=user)
+        group.students.set([staying] + newcomers)
+
+        # savepoint, группы, 3 удаления, профили, 3 вставки связей, уроки,
+        # 2 выборки существующих пар, 2 вставки прогресса, 4 — версии групп и таблиц, release
+        with self.assertNumQueries(19):
+            apply_membership_changes(
+                student_links=[(group.id, u.id) for u in newcomers],
+                student_unlinks=[(group.id, leaving.id)],
+            )
+
+        self.assertEqual(Attendance.objects.filter(lesson__month__group=group).count(), 10 * 6)
+        self.assertEqual(HomeworkSubmission.objects.filter(lesson__month__group=group).count(), 10 * 6)
+        self.assertFalse(leaving.student_add.groups.exists())
+        self.assertFalse(leaving.student_add.directions.exists())
+        self.assertEqual(Student.objects.filter(groups=group).count(), 5)
+        self.assertEqual(Student.objects.filter(directions=self.direction).count(), 5)
+        self.assertEqual(set(group.students.all()), {staying, *newcomers})
+
+    def test_student_groups_update_both_sides(self):
+        user = make_students("s", 1)[0]
+        profile = Student.objects.create(user=user)
+        groups = [make_group(self.direction, f"G{i}", 1, 2) for i in range(3)]
+        generate_curriculum(groups[0])
+
+        apply_membership_changes(student_links=[(g.id, user.id) for g in groups])
+        apply_membership_changes(student_unlinks=[(groups[2].id, user.id)])
+
+        self.assertEqual(set(user.student_groups.all()), set(groups[:2]))
+        self.assertEqual(set(profile.groups.all()), set(groups[:2]))
+        self.assertEqual(list(profile.directions.all()), [self.direction])
+        self.assertEqual(Attendance.objects.filter(student=user).count(), 2)
+
+    def test_teacher_reassignment_query_count_is_constant(self):
+        old, new = (
+            CustomUser.objects.create(username=name, role='Teacher') for name in ("old", "new")
+        )
+        old_profile = Teacher.objects.create(user=old)
+        new_profile = Teacher.objects.create(user=new)
+
+        def reassign(count):
+            groups = [make_group(self.direction, f"G{count}-{i}", 1, 1) for i in range(count)]
+            apply_membership_changes(teacher_links=[(g.id, old.id) for g in groups])
+            # savepoint, группы, update, удаление у прежнего, профили,
+            # 2 вставки связей, 4 — версии групп и таблиц, release
+            with self.assertNumQueries(12):
+                apply_membership_changes(teacher_links=[(g.id, new.id) for g in groups])
+            return groups
+
+        reassign(2)
+        groups = reassign(30)
+
+        self.assertEqual(Group.objects.filter(id__in=[g.id for g in groups], teacher=new).count(), 30)
+        self.assertFalse(old_profile.groups.filter(id__in=[g.id for g in groups]).exists())
+        self.assertEqual(new_profile.groups.filter(id__in=[g.id for g in groups]).count(), 30)
+        self.assertEqual(list(new_profile.directions.all()), [self.direction])
+
+        apply_membership_changes(teacher_unlinks=[(g.id, new.id) for g in groups])
+        self.assertFalse(Group.objects.filter(id__in=[g.id for g in groups], teacher=new).exists())
+        self.assertFalse(new_profile.groups.filter(id__in=[g.id for g in groups]).exists())
+
+
+@override_settings(SPARSE_PROGRESS=False)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.direction = Direction.objects.create(name="Python")
+
+    def test_worker_claims_and_runs_job(self):
+        group = make_group(self.direction, "G1", 2, 3, make_students("s", 2))
+        job = enqueue_job('group_curriculum', {'group_id': group.id})
+
+        claimed = claim_job("worker-1")
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, 'running')
+        self.assertIsNone(claim_job("worker-2"))
+
+        self.assertEqual(run_job(job.pk), 'done')
+        job.refresh_from_db()
+        self.assertEqual(job.result, {'group_id': group.id, 'months': 2})
+        self.assertEqual(Attendance.objects.filter(lesson__month__group=group).count(), 12)
+
+    def test_failed_job_keeps_traceback(self):
+        job = enqueue_job('group_curriculum', {'group_id': 0})
+        claim_job("worker-1")
+
+        self.assertEqual(run_job(job.pk), 'failed')
+        job.refresh_from_db()
+        self.assertIn('DoesNotExist', job.error)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_stale_running_job_is_requeued(self):
+        job = enqueue_job('group_curriculum', {'group_id': 0})
+        claim_job("worker-1")
+        # Обработчик умер: отметка давно не обновлялась
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(requeue_stale_jobs(), (1, 0))
+        self.assertEqual(claim_job("worker-2").pk, job.pk)
+
+        # Живой обработчик отмечается — задача не трогается
+        heartbeat([job.pk])
+        self.assertEqual(requeue_stale_jobs(), (0, 0))
+
+        # Исчерпав попытки, задача уходит в ошибку, а не по кругу
+        Job.objects.filter(pk=job.pk).update(attempts=3, heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+    def test_unknown_kind_is_rejected(self):
+        with self.assertRaises(ValueError):
+            enqueue_job('nope')
+        self.assertFalse(Job.objects.exists())
+
+
+@override_settings(SPARSE_PROGRESS=False)
+class GroupStudentsActionsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+        self.direction = Direction.objects.create(name="Python")
+        self.group = make_group(self.direction, "G1", 1, 2)
+        generate_curriculum(self.group)
+
+    def test_add_and_remove_report_counts(self):
+        member = make_students("m", 1)[0]
+        self.group.students.add(member)
+        newcomers = make_students("n", 3)
+        teacher = CustomUser.objects.create(username="t", role='Teacher')
+        url = f"/api/v1/administration/groups/{self.group.id}/students/"
+
+        response = self.client.post(url + "add/", {
+            'student_ids': [u.id for u in newcomers] + [member.id, teacher.id]
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'added': 3, 'skipped': 2, 'invalid_ids': [teacher.id]})
+        self.assertEqual(self.group.students.count(), 4)
+        self.assertEqual(Attendance.objects.filter(lesson__month__group=self.group).count(), 3 * 2)
+
+        response = self.client.post(url + "remove/", {
+            'student_ids': [newcomers[0].id, member.id, 999999]
+        }, format='json')
+
+        self.assertEqual(response.data, {'removed': 2, 'skipped': 1, 'invalid_ids': [999999]})
+        self.assertEqual(set(self.group.students.all()), set(newcomers[1:]))
+
+    def test_actions_load_direction_with_group(self):
+        request = Request(APIRequestFactory().post("/"))
+        for action in ('update', 'add_students', 'remove_students', 'list'):
+            view = GroupViewSet(action=action, request=request, kwargs={})
+            self.assertIn('direction', view.get_queryset().query.select_related)
+
+    def test_rejects_list_without_students(self):
+        response = self.client.post(
+            f"/api/v1/administration/groups/{self.group.id}/students/add/",
+            {'student_ids': [999999]}, format='json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(SPARSE_PROGRESS=True)
+class SparseProgressTests(TestCase):
+    def setUp(self):
+        # откат БД между тестами сбрасывает версии групп, а кэш — нет
+        cache.clear()
+        self.direction = Direction.objects.create(name="Python")
+        self.student = make_students("s", 1)[0]
+        self.group = make_group(self.direction, "G1", 1, 3, [self.student])
+        generate_curriculum(self.group)
+        self.lessons = list(Lesson.objects.filter(month__group=self.group).order_by('order'))
+        self.client = APIClient()
+
+    def test_rows_are_not_precreated(self):
+        self.assertEqual(len(self.lessons), 3)
+        self.assertFalse(Attendance.objects.exists())
+        self.assertFalse(HomeworkSubmission.objects.exists())
+
+    def test_progress_fills_defaults(self):
+        Attendance.objects.create(lesson=self.lessons[1], student=self.student, status='1')
+        self.client.force_authenticate(self.student)
+
+        response = self.client.get("/api/v1/administration/progress/")
+
+        self.assertEqual(
+            [row['attendance_status'] for row in response.data], ['0', '1', '0']
+        )
+        self.assertEqual({row['homework_status'] for row in response.data}, {'black'})
+
+    def test_student_attendance_lists_default_rows(self):
+        Attendance.objects.create(lesson=self.lessons[1], student=self.student, status='1')
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+
+        response = self.client.get(f"/api/v1/administration/students/{self.student.id}/attendance/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(row['status'] for row in response.data), ['0', '0', '1'])
+        self.assertEqual(sum(row['id'] is None for row in response.data), 2)
+
+    def test_attendance_row_is_created_on_first_write(self):
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+
+        response = self.client.put(
+            f"/api/v1/administration/groups/{self.group.id}/dashboard/{self.student.id}/",
+            {'attendances': [{'lesson': self.lessons[0].id, 'status': 'online'}]},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(Attendance.objects.values_list('lesson_id', 'status')), [(self.lessons[0].id, 'online')]
+        )
+
+    def test_prune_deletes_only_default_rows(self):
+        Attendance.objects.create(lesson=self.lessons[0], student=self.student, status='0')
+        Attendance.objects.create(lesson=self.lessons[1], student=self.student, status='1')
+        HomeworkSubmission.objects.create(lesson=self.lessons[0], student=self.student)
+        HomeworkSubmission.objects.create(lesson=self.lessons[1], student=self.student, status='black', score=3)
+
+        call_command('prune_default_progress', stdout=io.StringIO())
+
+        self.assertEqual(list(Attendance.objects.values_list('status', flat=True)), ['1'])
+        self.assertEqual(list(HomeworkSubmission.objects.values_list('score', flat=True)), [3])
+
+    def test_bulk_deletes_do_not_load_rows(self):
+        students = make_students("b", 200)
+        Attendance.objects.bulk_create(
+            Attendance(lesson=lesson, student=student, status='0') for lesson in self.lessons for student in students
+        )
+        version = get_versions([group_key(self.group.id)])[group_key(self.group.id)]
+
+        # Пачка — выборка id, DELETE, версии групп; не запросы на каждую строку
+        with CaptureQueriesContext(connection) as queries:
+            call_command('prune_default_progress', stdout=io.StringIO())
+        self.assertLess(len(queries), 20)
+        self.assertFalse(Attendance.objects.exists())
+        self.assertGreater(get_versions([group_key(self.group.id)])[group_key(self.group.id)], version)
+
+        Attendance.objects.bulk_create(Attendance(lesson=self.lessons[0], student=s, status='1') for s in students)
+        with CaptureQueriesContext(connection) as queries:
+            self.lessons[0].delete()
+        self.assertLess(len(queries), 20)
+        self.assertFalse(Attendance.objects.exists())
+
+
+class CurriculumTemplateTests(TestCase):
+    def setUp(self):
+        self.direction = Direction.objects.create(name="Python")
+        month = TemplateMonth.objects.create(direction=self.direction, month_number=1, title="Основы")
+        self.template_lesson = TemplateLesson.objects.create(
+            month=month, order=1, title="Переменные", homework_description="Задачи 1-5"
+        )
+
+    def test_new_group_is_cloned_from_template(self):
+        group = make_group(self.direction, "G1", 2, 2, creation_type='auto')
+
+        months = list(group.months.values_list('month_number', 'title'))
+        lessons = list(
+            Lesson.objects.filter(month__group=group)
+            .order_by('month__month_number', 'order')
+            .values_list('title', 'homework_description')
+        )
+        self.assertEqual(months, [(1, "Основы"), (2, "Месяц 2")])
+        self.assertEqual(lessons[0], ("Переменные", "Задачи 1-5"))
+        self.assertEqual(lessons[1], ("Урок 2", ""))
+
+    def test_sync_pushes_template_edits(self):
+        groups = [make_group(self.direction, f"G{i}", 1, 2, creation_type='auto') for i in range(3)]
+        Lesson.objects.filter(month__group=groups[0], order=1).update(date='2025-01-10T10:00:00Z')
+        self.template_lesson.title = "Переменные и типы"
+        self.template_lesson.save()
+
+        # 2 выборки шаблона, месяцы, уроки, savepoint, bulk_update, 2 — версии, release
+        with self.assertNumQueries(9):
+            result = sync_groups_from_template(groups)
+
+        self.assertEqual(result, {'months': 0, 'lessons': 3})
+        self.assertEqual(
+            Lesson.objects.filter(title="Переменные и типы", month__group__in=groups).count(), 3
+        )
+        self.assertTrue(Lesson.objects.filter(month__group=groups[0], order=1, date__isnull=False).exists())
+
+    def test_sync_keeps_group_content_where_template_is_empty(self):
+        group = make_group(self.direction, "G", 1, 1, creation_type='auto')
+        Lesson.objects.filter(month__group=group).update(
+            lesson_links="https://meet.example.com/g", homework_links="https://example.com/hw"
+        )
+        self.template_lesson.title = "Переменные и типы"
+        self.template_lesson.homework_links = "https://example.com/template-hw"
+        self.template_lesson.save()
+
+        self.assertEqual(sync_groups_from_template([group]), {'months': 0, 'lessons': 1})
+        lesson = Lesson.objects.get(month__group=group)
+        self.assertEqual(lesson.title, "Переменные и типы")
+        self.assertEqual(lesson.homework_links, "https://example.com/template-hw")
+        # В шаблоне ссылки на занятие нет — ссылка группы остаётся
+        self.assertEqual(lesson.lesson_links, "https://meet.example.com/g")
+
+    def test_put_replaces_template(self):
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+
+        response = client.put(f"/api/v1/administration/direction/{self.direction.id}/template/", {
+            'months': [{
+                'month_number': 1, 'title': "Старт",
+                'lessons': [{'order': 1, 'title': "Введение"}, {'order': 2, 'title': "Циклы"}]
+            }]
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([lesson['title'] for lesson in response.data['months'][0]['lessons']], ["Введение", "Циклы"])
+        self.assertEqual(TemplateLesson.objects.filter(month__direction=self.direction).count(), 2)
+
+
+class GroupProgressTests(TestCase):
+    def setUp(self):
+        self.direction = Direction.objects.create(name="Python")
+
+    def make_group_created(self, name, created, duration_months, **kwargs):
+        group = make_group(self.direction, name, duration_months, 2, **kwargs)
+        Group.objects.filter(pk=group.pk).update(creation_date=created)
+        return group
+
+    def test_sql_matches_properties(self):
+        today = date.today()
+        for i, (months_ago, duration) in enumerate([(0, 3), (1, 3), (2, 3), (3, 3), (7, 3), (11, 12), (14, 6)]):
+            year, month = divmod(today.year * 12 + today.month - 1 - months_ago, 12)
+            self.make_group_created(f"G{i}", date(year, month + 1, 1), duration)
+
+        annotated = {g.id: (g.progress_course, g.progress_month) for g in Group.objects.with_progress()}
+        plain = {g.id: (g.current_course, g.current_month) for g in Group.objects.all()}
+
+        self.assertEqual(annotated, plain)
+
+    def test_homework_list_uses_each_groups_current_month(self):
+        today = date.today()
+        year, month = divmod(today.year * 12 + today.month - 2, 12)
+        student = make_students("s", 1)[0]
+        fresh = self.make_group_created("Fresh", today, 3, students=[student])
+        older = self.make_group_created("Older", date(year, month + 1, 1), 3, students=[student])
+        for group in (fresh, older):
+            generate_curriculum(group)
+        Lesson.objects.update(homework_description="ДЗ")
+
+        client = APIClient()
+        client.force_authenticate(student)
+        response = client.get("/api/v1/administration/homework/")
+
+        self.assertEqual(
+            sorted((row['group_name'], row['month_number']) for row in response.data),
+            [("Fresh", 1), ("Fresh", 1), ("Older", 2), ("Older", 2)]
+        )
+        self.assertEqual(Group.objects.in_month(2).get(), older)
+
+
+class GroupDashboardQueriesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.direction = Direction.objects.create(name="Python")
+        self.admin = CustomUser.objects.create(username="admin", role='Administrator')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def make_dashboard_group(self, name, students_count, duration_months):
+        students = make_students(f"{name}-", students_count)
+        group = make_group(self.direction, name, duration_months, 4, students=students)
+        generate_curriculum(group)
+        lesson = Lesson.objects.filter(month__group=group).first()
+        for student in students:
+            Attendance.objects.update_or_create(lesson=lesson, student=student, defaults={'status': '1'})
+            for month in group.months.all():
+                invoice = Invoice.objects.create(
+                    student=student, months=month, amount=1000, due_date='2025-02-01'
+                )
+                Payment.objects.create(invoice=invoice, cash_amount=300, online_amount=100)
+        return group
+
+    def get_dashboard(self, group):
+        return self.client.get(f"/api/v1/administration/groups/{group.id}/dashboard/")
+
+    def test_query_count_does_not_grow_with_group(self):
+        small = self.make_dashboard_group("Small", 2, 1)
+        large = self.make_dashboard_group("Large", 12, 3)
+
+        # версия, группа, месяцы, уроки, ученики, посещаемость, ДЗ, счета
+        with self.assertNumQueries(8):
+            self.get_dashboard(small)
+        with self.assertNumQueries(8):
+            response = self.get_dashboard(large)
+
+        self.assertEqual(len(response.data['students']), 12)
+        student = response.data['students'][0]
+        self.assertEqual(len(student['attendances']), 12)
+        self.assertEqual(student['attendances'][0]['status'], '1')
+        self.assertEqual(len(student['homework_scores']), 12)
+        self.assertEqual(
+            [(p['final_amount'], p['paid_amount'], p['balance']) for p in student['payments']],
+            [('1000.00', '400.00', '600.00')] * 3
+        )
+        self.assertEqual([len(month['lessons']) for month in response.data['months']], [4, 4, 4])
+
+    def test_matrix_format_matches_full_payload(self):
+        group = self.make_dashboard_group("Matrix", 3, 2)
+        HomeworkSubmission.objects.update_or_create(
+            lesson=Lesson.objects.filter(month__group=group).last(),
+            student=group.students.first(),
+            defaults={'status': 'green', 'score': 5}
+        )
+
+        full = self.get_dashboard(group).data
+        with self.assertNumQueries(8):
+            response = self.client.get(f"/api/v1/administration/groups/{group.id}/dashboard/?format=matrix")
+
+        self.assertEqual(response.status_code, 200)
+        matrix = response.data
+        codes = matrix['codes']
+        self.assertEqual([lesson[0] for lesson in matrix['lessons']],
+                         [lesson['id'] for month in full['months'] for lesson in month['lessons']])
+        for i, student in enumerate(full['students']):
+            self.assertEqual(matrix['students'][i][0], student['id'])
+            self.assertEqual([codes['attendance'][c] for c in matrix['attendance'][i]],
+                             [a['status'] for a in student['attendances']])
+            self.assertEqual([codes['homework'][c] for c in matrix['homework'][i]],
+                             [h['status'] for h in student['homework_scores']])
+            self.assertEqual(matrix['scores'][i], [h['score'] for h in student['homework_scores']])
+
+    def test_tabs_run_only_their_queries(self):
+        group = self.make_dashboard_group("Tabs", 4, 2)
+        url = f"/api/v1/administration/groups/{group.id}/dashboard/"
+
+        # + запрос версии группы
+        for tab, queries in [('data', 2), ('plans', 4), ('students', 4), ('attendance', 6), ('homework', 6)]:
+            with self.subTest(tab=tab), self.assertNumQueries(queries):
+                response = self.client.get(url, {'tab': tab})
+            self.assertEqual(list(response.data), ['group', tab, 'tabs', 'current_tab'])
+
+        students = self.client.get(url, {'tab': 'attendance'}).data['attendance']
+        self.assertNotIn('payments', students[0])
+        self.assertEqual(len(students[0]['attendances']), 8)
+        self.assertEqual(self.client.get(url, {'tab': 'unknown'}).status_code, 400)
+
+    def test_stats_tab(self):
+        group = self.make_dashboard_group("Stats", 2, 2)
+        student = group.students.first()
+        HomeworkSubmission.objects.update_or_create(
+            lesson=Lesson.objects.filter(month__group=group).first(), student=student,
+            defaults={'status': 'green', 'score': 4}
+        )
+
+        stats = self.client.get(
+            f"/api/v1/administration/groups/{group.id}/dashboard/", {'tab': 'stats'}
+        ).data['stats']
+
+        # группа создана сегодня: пройден первый месяц — 4 урока × 2 ученика, присутствовали 2
+        self.assertEqual(stats['held_lessons'], 4)
+        self.assertEqual(stats['attendance_rate'], 25.0)
+        self.assertEqual(stats['average_score'], 4)
+        self.assertEqual(stats['paid_percentage'], 40.0)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.direction = Direction.objects.create(name="Python")
+        self.student = make_students("s", 1)[0]
+        self.group = make_group(self.direction, "Cached", 1, 3, students=[self.student])
+        generate_curriculum(self.group)
+        self.lesson = Lesson.objects.filter(month__group=self.group).first()
+        self.client = APIClient()
+
+    def assert_cached(self, url, user, queries=1):
+        self.client.force_authenticate(user)
+        first = self.client.get(url).data
+        # повторное чтение — только запрос версии (и объекта, если он проверяется)
+        with self.assertNumQueries(queries):
+            self.assertEqual(self.client.get(url).data, first)
+        return first
+
+    def test_dashboard_invalidated_by_attendance_and_payment(self):
+        admin = CustomUser.objects.create(username="admin", role='Administrator')
+        url = f"/api/v1/administration/groups/{self.group.id}/dashboard/"
+        data = self.assert_cached(url, admin, queries=2)
+        self.assertEqual(data['students'][0]['attendances'][0]['status'], '0')
+
+        Attendance.objects.create(lesson=self.lesson, student=self.student, status='1')
+        data = self.assert_cached(url, admin, queries=2)
+        self.assertEqual(data['students'][0]['attendances'][0]['status'], '1')
+
+        invoice = Invoice.objects.create(
+            student=self.student, months=self.lesson.month, amount=500, due_date='2025-02-01'
+        )
+        Payment.objects.create(invoice=invoice, transfer_amount=200)
+        data = self.assert_cached(url, admin, queries=2)
+        self.assertEqual(data['students'][0]['payments'][0]['paid_amount'], '200.00')
+
+    def test_deleted_group_dashboard_is_not_served_from_cache(self):
+        admin = CustomUser.objects.create(username="admin", role='Administrator')
+        url = f"/api/v1/administration/groups/{self.group.id}/dashboard/"
+        self.assert_cached(url, admin, queries=2)
+
+        Group.objects.filter(id=self.group.id).delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_grades_and_progress(self):
+        admin = CustomUser.objects.create(username="admin", role='Administrator')
+        grades_url = f"/api/v1/administration/groups/{self.group.id}/grades/"
+        self.assert_cached(grades_url, admin)
+        progress = self.assert_cached("/api/v1/administration/progress/", self.student)
+
+        HomeworkSubmission.objects.create(lesson=self.lesson, student=self.student, status='green', score=5)
+        grades = self.assert_cached(grades_url, admin)
+        self.assertEqual(grades['students'][0]['average_score'], 5)
+        self.assertNotEqual(self.assert_cached("/api/v1/administration/progress/", self.student), progress)
+
+        # уход из группы меняет набор версий ученика
+        self.group.students.remove(self.student)
+        self.assertEqual(self.assert_cached("/api/v1/administration/progress/", self.student), [])
+
+
+class ConditionalListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+
+    def assert_not_modified(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        # до сериализации: запрос версий (и/или агрегата)
+        with self.assertNumQueries(1):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], etag)
+        return etag
+
+    def test_payments_etag_follows_table_versions(self):
+        direction = Direction.objects.create(name="Python")
+        student = make_students("s", 1)[0]
+        group = make_group(direction, "G", 1, 1, students=[student])
+        month = Months.objects.create(group=group, month_number=1, title="М1")
+        invoice = Invoice.objects.create(student=student, months=month, amount=1000, due_date='2025-02-01')
+        url = "/api/v1/administration/payments/"
+
+        etag = self.assert_not_modified(url)
+        Payment.objects.create(invoice=invoice, cash_amount=100)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertNotEqual(self.assert_not_modified(url), etag)
+        # у другого фильтра свой ETag
+        self.assertNotEqual(self.client.get(url + "?start_date=2020-01-01")["ETag"], etag)
+
+    def test_leads_etag_uses_timestamps(self):
+        from app.administration.models import Lead
+
+        lead = Lead.objects.create(name="Иван", phone="+996700000000")
+        url = "/api/v1/administration/leads/"
+        etag = self.assert_not_modified(url)
+
+        lead.status = 'in_progress'
+        lead.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        lead.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class GroupTableTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.direction = Direction.objects.create(name="Python")
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+
+    def test_table_is_one_query_per_page(self):
+        empty = make_group(self.direction, "Empty", 2, 2)
+        Months.objects.filter(group=empty).delete()
+        planned = make_group(self.direction, "Planned", 2, 2)
+        generate_curriculum(planned)
+        started = make_group(self.direction, "Started", 3, 2)
+        generate_curriculum(started)
+        Lesson.objects.filter(month__group=started, month__month_number=2, order=1).update(date='2025-03-01')
+        for i in range(5):
+            make_group(self.direction, f"Extra{i}", 1, 1)
+
+        get_facets('groups')
+        # страница, версии индекса фасетов (сам индекс — из кэша)
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/v1/administration/group-table/", {'page_size': 3})
+
+        self.assertIsNotNone(response.data['next'])
+        self.assertIsNone(response.data['previous'])
+        self.assertEqual(
+            [(row['group'], row['month'], row['lesson']) for row in response.data['groups']],
+            [("Empty", 1, 0), ("Planned", 1, 2), ("Started", 2, 1)]
+        )
+
+
+class FacetIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+
+    def test_facets_are_cached_and_invalidated(self):
+        python = Direction.objects.create(name="Python")
+        teacher = CustomUser.objects.create(username="t", role='Teacher', first_name="Анна", last_name="Ким")
+        students = make_students("s", 2)
+        for student in students:
+            Student.objects.create(user=student)
+        group = make_group(python, "PY-1", 1, 1)
+        apply_membership_changes(
+            student_links=[(group.id, s.id) for s in students], teacher_links=[(group.id, teacher.id)]
+        )
+        url = "/api/v1/administration/facets/"
+
+        first = self.client.get(url, {'for': 'students'}).data
+        self.assertEqual(first['directions'], [{'name': "Python", 'count': 2}])
+        self.assertEqual(first['groups'], [{'name': "PY-1", 'count': 2}])
+        self.assertEqual(first['teachers'], [{'name': "Ким Анна", 'count': 2}])
+        # повторно — только запрос версий
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, {'for': 'students'}).data, first)
+
+        Direction.objects.create(name="Go")
+        directions = self.client.get(url, {'for': 'groups'}).data['directions']
+        self.assertEqual(directions, [{'name': "Go", 'count': 0}, {'name': "Python", 'count': 1}])
+        self.assertEqual(self.client.get(url, {'for': 'nothing'}).status_code, 400)
+
+        response = self.client.get("/api/v1/administration/student-table/")
+        self.assertEqual(response.data['filters']['teachers'], ["Ким Анна"])
+        self.assertEqual(response.data['filters']['directions'], ["Go", "Python"])
+
+
+class StudentTableTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+        self.python = Direction.objects.create(name="Python")
+        self.teacher = CustomUser.objects.create(username="t", role='Teacher', first_name="Анна", last_name="Ким")
+
+    def add_students(self, prefix, count, groups):
+        users = CustomUser.objects.bulk_create(
+            CustomUser(username=f"{prefix}{i}", role='Student', first_name="Имя", last_name=str(i))
+            for i in range(count)
+        )
+        profiles = Student.objects.bulk_create(Student(user=user) for user in users)
+        Student.groups.through.objects.bulk_create(
+            Student.groups.through(student_id=profile.id, group_id=group.id)
+            for profile in profiles for group in groups
+        )
+
+    def get_table(self):
+        return self.client.get("/api/v1/administration/student-table/")
+
+    def test_query_count_is_constant(self):
+        groups = [make_group(self.python, f"PY-{i}", 1, 1) for i in range(3)]
+        Group.objects.filter(id__in=[g.id for g in groups]).update(teacher=self.teacher)
+        self.add_students("a", 10, groups[:2])
+        get_facets('students')
+
+        # версии для ETag, версии фасетов, ученики с пользователями, группы
+        with self.assertNumQueries(4):
+            small = self.get_table()
+        self.assertIsNone(small.data['next'])
+        self.assertEqual(small.data['students'][0]['group'], "PY-0, PY-1")
+        self.assertEqual(small.data['students'][0]['teacher'], "Ким Анна")
+
+        # 5000 учеников — то же число запросов
+        # 5000 учеников: каждая страница, включая последнюю, — те же запросы
+        self.add_students("b", 4990, groups)
+        url, rows = "/api/v1/administration/student-table/?page_size=500", []
+        while url:
+            with self.assertNumQueries(4):
+                page = self.client.get(url).data
+            rows.extend(page['students'])
+            url = page['next']
+        self.assertEqual(len(rows), 5000)
+        self.assertEqual(len({row['user_id'] for row in rows}), 5000)
+        self.assertEqual(rows[-1]['direction'], "Python")
+        self.assertIn('filters', page)
+
+
+class TeacherTableTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+        self.direction = Direction.objects.create(name="Python")
+
+    def add_teacher(self, name, groups_count, students):
+        teacher = CustomUser.objects.create(username=name, role='Teacher', first_name=name, last_name="Ким")
+        Teacher.objects.create(user=teacher)
+        groups = [make_group(self.direction, f"{name}-{i}", 1, 1) for i in range(groups_count)]
+        apply_membership_changes(
+            teacher_links=[(g.id, teacher.id) for g in groups],
+            student_links=[(g.id, s.id) for g in groups for s in students],
+        )
+        return teacher
+
+    def test_query_count_does_not_depend_on_teachers(self):
+        students = make_students("s", 3)
+        self.add_teacher("A", 2, students)
+        get_facets('teachers')
+
+        # преподаватели с count, группы, направления, версии фасетов
+        with self.assertNumQueries(4):
+            small = self.client.get("/api/v1/administration/teacher-table/").data['teachers']
+
+        for i in range(5):
+            self.add_teacher(f"B{i}", 3, students)
+        CustomUser.objects.create(username="noprofile", role='Teacher')
+        get_facets('teachers')
+        with self.assertNumQueries(4):
+            large = self.client.get("/api/v1/administration/teacher-table/").data['teachers']
+
+        self.assertEqual(small[0]['groups'], "A-0, A-1")
+        self.assertEqual(small[0]['directions'], "Python")
+        # ученик в двух группах считается один раз
+        self.assertEqual(small[0]['student_count'], 3)
+        self.assertEqual(len(large), 7)
+        self.assertEqual(large[-1]['groups'], "-")
+
+
+class KeysetPaginationTests(TestCase):
+    def test_payments_are_paged_by_date(self):
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+        student = make_students("s", 1)[0]
+        group = make_group(Direction.objects.create(name="Python"), "G", 1, 1, students=[student])
+        month = Months.objects.create(group=group, month_number=1, title="М1")
+        invoice = Invoice.objects.create(student=student, months=month, amount=10000, due_date='2025-02-01')
+        payments = [
+            Payment.objects.create(invoice=invoice, cash_amount=10, date=f"2025-01-{day:02d}T10:00:00Z")
+            for day in (5, 1, 3, 3, 2)
+        ]
+
+        ids, url = [], "/api/v1/administration/payments/?page_size=2"
+        while url:
+            page = client.get(url).data
+            self.assertLessEqual(len(page['results']), 2)
+            ids.extend(row['id'] for row in page['results'])
+            url = page['next']
+
+        # -date, затем -id; одинаковые даты не теряются на границе страниц
+        expected = sorted(payments, key=lambda p: (p.date, p.id), reverse=True)
+        self.assertEqual(ids, [p.id for p in expected])
+
+    def test_lists_keep_model_order(self):
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+        group = make_group(Direction.objects.create(name="Python"), "G", 3, 1)
+        Direction.objects.create(name="Go")
+        # Месяцы созданы не по порядку номеров
+        for number in (3, 1, 2):
+            Months.objects.create(group=group, month_number=number, title=f"М{number}")
+
+        months = client.get("/api/v1/administration/months/", {'page_size': 2})
+        numbers = [row['month_number'] for row in months.data['results']]
+        numbers += [row['month_number'] for row in client.get(months.data['next']).data['results']]
+        self.assertEqual(numbers, [1, 2, 3])
+
+        # Модель без Meta.ordering — по возрастанию id, как до пагинации
+        directions = client.get("/api/v1/administration/direction/").data['results']
+        self.assertEqual([row['name'] for row in directions], ["Python", "Go"])
+
+    def test_large_tie_groups_are_paged_by_id(self):
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+        student = make_students("s", 1)[0]
+        group = make_group(Direction.objects.create(name="Python"), "G", 1, 1, students=[student])
+        month = Months.objects.create(group=group, month_number=1, title="М1")
+        invoice = Invoice.objects.create(student=student, months=month, amount=10000, due_date='2025-02-01')
+        # Одна дата у 1300 платежей (так пишет импорт выписки) — больше потолка
+        # OFFSET, на котором ломалась CursorPagination
+        Payment.objects.bulk_create(
+            Payment(invoice=invoice, cash_amount=1, date="2025-01-05T00:00:00Z") for _ in range(1300)
+        )
+
+        ids, url = [], "/api/v1/administration/payments/?page_size=500"
+        while url:
+            page = client.get(url).data
+            ids.extend(row['id'] for row in page['results'])
+            url = page['next']
+        self.assertEqual(len(ids), 1300)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+        # Назад со второй страницы — ровно первая
+        second = client.get("/api/v1/administration/payments/?page_size=500")
+        second = client.get(second.data['next']).data
+        first = client.get(second['previous']).data
+        self.assertEqual([row['id'] for row in first['results']], ids[:500])
+        self.assertIsNone(first['previous'])
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+        direction = Direction.objects.create(name="Python")
+        self.students = make_students("s", 3)
+        for i in range(3):
+            group = make_group(direction, f"G{i}", 2, 3, students=self.students)
+            generate_curriculum(group)
+
+    def test_fields_limit_response_and_queries(self):
+        url = "/api/v1/administration/groups/"
+        with CaptureQueriesContext(connection) as full:
+            rows = self.client.get(url).data['results']
+        self.assertEqual(len(rows[0]['months'][0]['lessons']), 3)
+        self.assertEqual(len(rows[0]['students']), 3)
+
+        with CaptureQueriesContext(connection) as sparse:
+            rows = self.client.get(url + "?fields=id,group_name,current_month").data['results']
+        self.assertEqual(set(rows[0]), {'id', 'group_name', 'current_month'})
+        self.assertLess(len(sparse), len(full))
+
+        rows = self.client.get(url + "?omit=months,students").data['results']
+        self.assertNotIn('months', rows[0])
+        self.assertIn('direction', rows[0])
+
+    def test_group_list_queries_do_not_grow(self):
+        url = "/api/v1/administration/groups/"
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        make_group(Direction.objects.first(), "Extra", 3, 4, students=self.students)
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(url)
+        self.assertEqual(len(after), len(before))
+
+    def test_invoice_fields_skip_relations(self):
+        month = Months.objects.filter(group__group_name="G0").first()
+        for student in self.students:
+            invoice = Invoice.objects.create(student=student, months=month, amount=1000, due_date='2025-02-01')
+            Payment.objects.create(invoice=invoice, cash_amount=400)
+
+        rows = self.client.get("/api/v1/administration/invoices/").data['results']
+        self.assertEqual({str(row['paid_amount']) for row in rows}, {'400.00'})
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.client.get("/api/v1/administration/invoices/?fields=id,amount,status").data['results']
+        self.assertEqual(set(rows[0]), {'id', 'amount', 'status'})
+        self.assertFalse(any('JOIN' in q['sql'] for q in queries.captured_queries))
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+
+    def search(self, query, **params):
+        response = self.client.get("/api/v1/administration/search/", {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return {(row['type'], row['id']) for row in response.data}
+
+    def test_signals_keep_index_current(self):
+        student = CustomUser.objects.create(username="semen", first_name="Семён", last_name="Иванов", role='Student')
+        teacher = CustomUser.objects.create(username="t1", first_name="Ольга", last_name="Петрова", role='Teacher')
+        direction = Direction.objects.create(name="Python")
+        group = make_group(direction, "Вечерняя", 1, 1)
+        lead = Lead.objects.create(name="Анна Сидорова", phone="+996 555 12-34-56", course="Python", source="site")
+
+        # Регистр и ё не важны, слова — префиксы
+        self.assertEqual(self.search("ИВА семе"), {('student', student.id)})
+        self.assertEqual(self.search("петр"), {('teacher', teacher.id)})
+        self.assertEqual(self.search("99655512"), {('lead', lead.id)})
+        self.assertEqual(self.search("pyth", type='group,lead'), {('group', group.id), ('lead', lead.id)})
+
+        direction.name = "Django"
+        direction.save()
+        group.group_name = "Утренняя"
+        group.save()
+        self.assertEqual(self.search("вечер"), set())
+        self.assertEqual(self.search("утрен djan"), {('group', group.id)})
+
+        lead.delete()
+        student.role = 'Manager'
+        student.save()
+        self.assertEqual(self.search("99655512") | self.search("иванов"), set())
+
+    def test_table_search_uses_index(self):
+        lead = Lead.objects.create(name="Ёлкина Мария", phone="0700", course="Java", source="site")
+        Lead.objects.create(name="Другая", phone="0701", course="Go", source="site")
+
+        rows = self.client.get("/api/v1/administration/leads/", {'search': 'елкина'}).data['results']
+        self.assertEqual([row['id'] for row in rows], [lead.id])
+
+    def test_rebuild_command_indexes_bulk_rows(self):
+        Lead.objects.bulk_create([
+            Lead(name=f"Заявка {i}", phone=f"0555{i:04d}", course="Python", source="import") for i in range(5)
+        ])
+        self.assertEqual(self.search("заявка"), set())
+
+        out = io.StringIO()
+        call_command("rebuild_search_index", "--batch-size", "2", stdout=out)
+        self.assertIn("leads: 5", out.getvalue())
+        self.assertEqual(len(self.search("заявка")), 5)
+
+    def test_phone_is_found_by_its_tail(self):
+        lead = Lead.objects.create(name="Анна", phone="+996 555 123-456", course="Python", source="site")
+        student = CustomUser.objects.create(username="s1", phone="0700 98 76 54", role='Student')
+
+        self.assertEqual(self.search("123456"), {('lead', lead.id)})
+        self.assertEqual(self.search("5551234"), {('lead', lead.id)})
+        self.assertEqual(self.search("987654"), {('student', student.id)})
+        rows = self.client.get("/api/v1/administration/leads/", {'search': '3456'}).data['results']
+        self.assertEqual([row['id'] for row in rows], [lead.id])
+
+    def test_old_strong_match_is_ranked_first(self):
+        best = Lead.objects.create(name="Python Python", phone="0700", course="Python", source="site")
+        Lead.objects.bulk_create([
+            Lead(name=f"Заявка {i}", phone=f"0555{i:04d}", course="Python Django Flask", source="import")
+            for i in range(300)
+        ])
+        call_command("rebuild_search_index", stdout=io.StringIO())
+
+        response = self.client.get("/api/v1/administration/search/", {'q': 'python', 'limit': 1})
+        self.assertEqual([row['id'] for row in response.data], [best.id])
+
+    def test_other_databases_fall_back_to_icontains(self):
+        with mock.patch('app.administration.search.index_available', return_value=False):
+            lead = Lead.objects.create(name="Анна Сидорова", phone="0700", course="Python", source="site")
+            group = make_group(Direction.objects.create(name="Python"), "Вечерняя", 1, 1)
+            # LIKE в SQLite не складывает регистр кириллицы — слова как в данных
+            self.assertEqual(self.search("Сидор pyth"), {('lead', lead.id)})
+            self.assertEqual(self.search("python", type='group'), {('group', group.id)})
+            rows = self.client.get("/api/v1/administration/leads/", {'search': 'Анна'}).data['results']
+            self.assertEqual([row['id'] for row in rows], [lead.id])
+        # Записи в обход индекса там не было
+        self.assertEqual(self.search("сидор"), set())
+
+
+class InvoicePaidTotalTests(TestCase):
+    def setUp(self):
+        self.student = make_students("s", 1)[0]
+        group = make_group(Direction.objects.create(name="Python"), "G", 1, 1, students=[self.student])
+        self.month = Months.objects.create(group=group, month_number=1, title="М1")
+
+    def make_invoice(self, amount=1000):
+        return Invoice.objects.create(student=self.student, months=self.month, amount=amount, due_date='2025-02-01')
+
+    def assertPaid(self, invoice, paid_total, status):
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.paid_total, invoice.status), (Decimal(paid_total), status))
+
+    def test_payments_maintain_paid_total_and_status(self):
+        first, second = self.make_invoice(), self.make_invoice(500)
+        payment = Payment.objects.create(invoice=first, cash_amount=300, online_amount=100)
+        self.assertPaid(first, 400, 'partial')
+        self.assertEqual(payment.invoice.balance, 600)
+
+        payment.transfer_amount = 600
+        payment.save()
+        self.assertPaid(first, 1000, 'paid')
+
+        # Перенос платежа на другой счёт
+        payment.invoice = second
+        payment.save()
+        self.assertPaid(first, 0, 'pending')
+        self.assertPaid(second, 1000, 'paid')
+
+        Payment.objects.create(invoice=first, cash_amount=200)
+        Payment.objects.filter(invoice=second).delete()
+        self.assertPaid(second, 0, 'pending')
+        self.assertEqual(list(Invoice.objects.debtors().order_by('id')), [first, second])
+
+    def test_recompute_command_repairs_drift(self):
+        invoice = self.make_invoice()
+        Payment.objects.create(invoice=invoice, cash_amount=1000)
+        Invoice.objects.filter(pk=invoice.pk).update(paid_total=0, status='pending')
+
+        out = io.StringIO()
+        call_command("recompute_invoice_totals", stdout=out)
+        self.assertIn("Исправлено счетов: 1", out.getvalue())
+        self.assertPaid(invoice, 1000, 'paid')
+
+        call_command("recompute_invoice_totals", stdout=out)
+        self.assertIn("Исправлено счетов: 0", out.getvalue())
+
+
+class InvoiceGenerationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+        direction = Direction.objects.create(name="Python")
+        self.students = make_students("s", 4)
+        self.group = make_group(direction, "G1", 2, 1, students=self.students)
+        generate_curriculum(self.group)
+        inactive = make_group(direction, "Old", 2, 1, students=self.students[:2])
+        inactive.is_active = False
+        inactive.save()
+        generate_curriculum(inactive)
+
+        # Преподаватель, попавший в список учеников, и отчисленный ученик счёт не получают
+        self.group.students.add(CustomUser.objects.create(username="t", role='Teacher'))
+        CustomUser.objects.filter(pk=self.students[3].pk).update(is_active=False)
+        self.month = self.group.months.get(month_number=2)
+        Invoice.objects.create(student=self.students[0], months=self.month, amount=5000, due_date='2025-03-10')
+
+    def generate(self, **data):
+        payload = {'month_number': 2, 'amount': '5000', 'due_date': '2025-03-10', **data}
+        return self.client.post("/api/v1/administration/invoices/generate/", payload, format='json')
+
+    def test_generate_skips_existing_and_invalid_members(self):
+        response = self.generate(dry_run=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.data['created'], response.data['already_billed'], response.data['skipped_students']),
+            (2, 1, 2)
+        )
+        self.assertEqual(Invoice.objects.count(), 1)
+
+        # Состав, существующие счета, вставка счетов, журнал (3) и версии — не зависит от числа учеников
+        with self.assertNumQueries(13):
+            response = self.generate()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            set(Invoice.objects.filter(months=self.month).values_list('student_id', flat=True)),
+            {student.id for student in self.students[:3]}
+        )
+        self.assertEqual(self.generate().data['created'], 0)
+
+    def test_generate_validates_month_choice(self):
+        self.assertEqual(self.generate(date='2025-03-01').status_code, 400)
+        self.assertEqual(self.generate(month_number=None).status_code, 400)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command(
+            "generate_invoices", "--month", "1", "--amount", "4000", "--due-date", "2025-02-10",
+            "--group", str(self.group.id), stdout=out
+        )
+        self.assertIn("Создано счетов: 3", out.getvalue())
+
+
+class PaymentAllocationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+        self.student = make_students("s", 1)[0]
+        group = make_group(Direction.objects.create(name="Python"), "G", 3, 1, students=[self.student])
+        generate_curriculum(group)
+        self.invoices = [
+            Invoice.objects.create(student=self.student, months=month, amount=1000, due_date=f'2025-0{month.month_number}-10')
+            for month in group.months.all()
+        ]
+
+    def pay(self, **amounts):
+        return self.client.post(
+            "/api/v1/administration/payments/", {'student_id': self.student.id, **amounts}, format='json'
+        )
+
+    def test_payment_is_split_by_due_date(self):
+        first, second, third = self.invoices
+        Payment.objects.create(invoice=first, cash_amount=400)
+
+        response = self.pay(cash_amount='1000', online_amount='500')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [(row['invoice_id'], row['amount'], row['invoice_status']) for row in response.data['allocations']],
+            [(first.id, '600.00', 'paid'), (second.id, '900.00', 'partial')]
+        )
+        # Каналы расходуются по очереди: на второй счёт — остаток наличных и онлайн
+        payment = Payment.objects.get(invoice=second)
+        self.assertEqual((payment.cash_amount, payment.online_amount), (Decimal('400'), Decimal('500')))
+
+        # Переплата остаётся на последнем счёте
+        self.pay(transfer_amount='3000')
+        self.assertEqual(
+            [(invoice.paid_total, invoice.status) for invoice in Invoice.objects.order_by('due_date')],
+            [(Decimal('1000'), 'paid'), (Decimal('1000'), 'paid'), (Decimal('2900'), 'paid')]
+        )
+        self.assertEqual(self.pay(cash_amount='10').status_code, 400)
+
+    def test_rejects_empty_and_negative_payments(self):
+        self.assertEqual(self.pay(cash_amount='0').status_code, 400)
+        self.assertEqual(self.pay(cash_amount='-500').status_code, 400)
+        self.assertEqual(self.pay(cash_amount='700', online_amount='-200').status_code, 400)
+        for amounts in ({'cash_amount': Decimal('-500')}, {'cash_amount': 0}, {}):
+            with self.assertRaises(ValueError):
+                allocate_payment(self.student, **amounts)
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual({invoice.paid_total for invoice in Invoice.objects.all()}, {Decimal('0')})
+
+
+class BankImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+        self.students = make_students("s", 3)
+        CustomUser.objects.filter(pk=self.students[0].pk).update(phone='+996 555 123 456')
+        group = make_group(Direction.objects.create(name="Python"), "G", 2, 1, students=self.students[:2])
+        generate_curriculum(group)
+        first, second = group.months.all()
+        self.invoices = [
+            Invoice.objects.create(student=student, months=month, amount=1000, due_date=f'2025-0{month.month_number}-10')
+            for student in self.students[:2] for month in (first, second)
+        ]
+
+    def upload(self, text, name='statement.csv'):
+        file = io.BytesIO(text.encode('utf-8-sig'))
+        file.name = name
+        return self.client.post("/api/v1/administration/payments/import/", {'file': file}, format='multipart')
+
+    def test_rows_are_matched_and_allocated(self):
+        other = self.invoices[2]
+        response = self.upload(
+            "Дата;Сумма;Телефон;Логин;Счёт;Назначение\n"
+            "01.03.2025;1 500,00;0555123456;;;оплата\n"
+            f"2025-03-02;700;;;{other.id};\n"
+            "2025-03-03;200;;S1;;\n"
+            "2025-03-04;300;;nobody;;\n"
+            "2025-03-05;300;;s2;;\n"
+            "2025-03-06;abc;;s1;;\n"
+        )
+        self.assertEqual(response.status_code, 200)
+        report = response.data
+        self.assertEqual((report['rows'], report['matched'], report['payments']), (6, 3, 4))
+        self.assertEqual(report['amount'], '2400.00')
+        self.assertEqual(
+            [(row['row'], row['reason']) for row in report['unmatched']],
+            [(5, "Ученик не найден"), (6, "У ученика нет открытых счетов"), (7, "Нет суммы поступления")]
+        )
+        # По телефону — по сроку оплаты; по счёту — сначала указанный счёт
+        self.assertEqual(
+            [invoice.paid_total for invoice in Invoice.objects.order_by('id')],
+            [Decimal('1000'), Decimal('500'), Decimal('900'), Decimal('0')]
+        )
+        self.assertEqual(Payment.objects.get(invoice=self.invoices[0]).comment, 'оплата')
+
+    def test_rejects_unreadable_statements(self):
+        self.assertEqual(self.upload("date,comment\n2025-03-01,x\n").status_code, 400)
+        self.assertEqual(self.upload("не zip", name='statement.xlsx').status_code, 400)
+
+        file = io.BytesIO("Сумма;Логин\n100;s0\n".encode('cp1251'))
+        file.name = 'statement.csv'
+        response = self.client.post("/api/v1/administration/payments/import/", {'file': file}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_unreadable_row_after_first_batch_rolls_back_everything(self):
+        rows = "".join(f"2025-03-01,1,s0,платёж {i}\n" for i in range(700))
+        file = io.BytesIO(("date,amount,username,comment\n" + rows).encode() + b"2025-03-02,1,s0,\xff\n")
+        file.name = 'statement.csv'
+
+        response = self.client.post("/api/v1/administration/payments/import/", {'file': file}, format='multipart')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("строка 702", response.data['detail'])
+        # Первая пачка (500 строк) уже была разнесена — и откатилась вместе с остальным
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(LedgerEntry.objects.filter(kind='payment').exists())
+        self.assertEqual({invoice.paid_total for invoice in Invoice.objects.all()}, {Decimal('0')})
+
+    def test_non_finite_amounts_are_reported(self):
+        response = self.upload("amount,username\nnan,s0\ninf,s0\n-Infinity,s0\n1e999999,s0\n")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [row['reason'] for row in response.data['unmatched']], ["Нет суммы поступления"] * 4
+        )
+        self.assertFalse(Payment.objects.exists())
+
+    def test_paid_invoice_id_falls_back_to_username(self):
+        paid = self.invoices[0]
+        Payment.objects.create(invoice=paid, cash_amount=1000)
+
+        report = self.upload(f"amount,invoice,username\n100,{paid.id},s0\n").data
+        self.assertEqual(report['matched'], 1)
+        self.assertEqual(Invoice.objects.get(pk=self.invoices[1].pk).paid_total, Decimal('100'))
+
+
+class StudentLedgerTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="admin", role='Administrator'))
+        self.students = make_students("s", 2)
+        group = make_group(Direction.objects.create(name="Python"), "G", 2, 1, students=self.students)
+        generate_curriculum(group)
+        self.months = list(group.months.all())
+
+    def balance(self, student):
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/v1/administration/students/{student.id}/balance/")
+        return response.data['balance']
+
+    def test_running_balance_follows_invoices_and_payments(self):
+        student, other = self.students
+        self.assertEqual(self.balance(student), '0.00')
+
+        invoice = Invoice.objects.create(student=student, months=self.months[0], amount=1000, discount=100, due_date='2025-02-10')
+        Invoice.objects.create(student=student, months=self.months[1], amount=1000, due_date='2025-03-10')
+        self.assertEqual(self.balance(student), '1900.00')
+
+        payment = Payment.objects.create(invoice=invoice, cash_amount=500)
+        payment.cash_amount = 700
+        payment.save()
+        self.assertEqual(self.balance(student), '1200.00')
+
+        invoice.amount = 1200
+        invoice.save()
+        payment.delete()
+        self.assertEqual(self.balance(student), '2100.00')
+
+        Invoice.objects.create(student=other, months=self.months[0], amount=300, due_date='2025-02-10')
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/api/v1/administration/students/balances/", {'ids': f"{student.id},{other.id},999"}
+            )
+        self.assertEqual(response.data['balances'], {student.id: '2100.00', other.id: '300.00', 999: '0.00'})
+
+        kinds = [row['kind'] for row in self.client.get(f"/api/v1/administration/students/{student.id}/ledger/").data['results']]
+        self.assertEqual(kinds, ['adjustment', 'adjustment', 'adjustment', 'payment', 'charge', 'discount', 'charge'])
+
+    def test_bulk_paths_write_ledger(self):
+        student = self.students[0]
+        generate_invoices(amount=Decimal('1000'), due_date='2025-03-10', month_number=1)
+        allocate_payment(student, cash_amount=Decimal('1500'))
+        self.assertEqual(LedgerEntry.objects.balances([s.id for s in self.students]), {
+            student.id: Decimal('-500'), self.students[1].id: Decimal('1000'),
+        })
+
+    def test_deleting_student_drops_ledger(self):
+        student = self.students[0]
+        invoice = Invoice.objects.create(student=student, months=self.months[0], amount=1000, due_date='2025-02-10')
+        Payment.objects.create(invoice=invoice, cash_amount=100)
+        student.delete()
+        self.assertFalse(LedgerEntry.objects.exists())
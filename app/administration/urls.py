@@ -11,7 +11,8 @@ from app.administration.views import (
     StudentAttendanceView, StudentPaymentsView, LeadViewSet, AdminDashboardView,
     StudentGradesView, PaymentNotificationViewSet, MonthlyIncomePDFView, TeacherWorkloadPDFView,
     CurrentUserProfileView, DirectionViewSet, TeacherProfileView, StudentProfileView, StudentHomeworkViewSet, InvoiceViewSet, 
-    TeacherHomeworkViewSet, StudentProgressView, DiscountRegulationViewSet, StudentAttendanceUpdateView, IncomeReportPDFView, IncomeReportView
+    TeacherHomeworkViewSet, StudentProgressView, DiscountRegulationViewSet, StudentAttendanceUpdateView, IncomeReportPDFView, IncomeReportView,
+    JobViewSet, FacetsView, SearchView, StudentBalanceView, StudentBalancesView, StudentLedgerView
     )
 
 router = DefaultRouter()
@@ -41,6 +42,7 @@ router.register(r'schedule', ScheduleViewSet, basename='schedule')
 router.register(r'leads', LeadViewSet, basename='lead')
 router.register(r'homework', StudentHomeworkViewSet, basename='student-homework')
 router.register(r'discount-regulations', DiscountRegulationViewSet, basename='discountregulation')
+router.register(r'jobs', JobViewSet, basename='job')
 
 
 
@@ -62,7 +64,12 @@ urlpatterns = [
     path('popular-courses/', PopularCoursesAnalytics.as_view(), name='popular-courses'),
     path('students/<int:student_id>/attendance/', StudentAttendanceView.as_view(), name='student-attendance'),
     path('students/<int:student_id>/payments/', StudentPaymentsView.as_view(), name='student-payments'),
+    path('students/<int:student_id>/balance/', StudentBalanceView.as_view(), name='student-balance'),
+    path('students/<int:student_id>/ledger/', StudentLedgerView.as_view(), name='student-ledger'),
+    path('students/balances/', StudentBalancesView.as_view(), name='student-balances'),
     path('admin-dashboard/', AdminDashboardView.as_view(), name='admin-dashboard'),
+    path('facets/', FacetsView.as_view(), name='facets'),
+    path('search/', SearchView.as_view(), name='search'),
     path('progress/', StudentProgressView.as_view(), name='progress-list'),
     path("teacher/homework/", TeacherHomeworkViewSet.as_view({"get": "list", "patch": "partial_update", "put": "update"}), name='teacher-homework'),
     path("teacher/homework/<int:pk>/", TeacherHomeworkViewSet.as_view({"get": "retrieve", "patch": "partial_update", "put": "update"}), name='teacher-homework-checking'),
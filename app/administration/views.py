@@ -3,32 +3,39 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import permissions
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import APIException, PermissionDenied
+from rest_framework.negotiation import DefaultContentNegotiation
 from django.db import transaction
 from django.db.models.functions import Coalesce
 from decimal import Decimal
 from datetime import timedelta
 from django.utils import timezone
 from rest_framework.decorators import action
-from django.http import HttpResponse
+from django.http import HttpResponse, FileResponse, Http404
+from django.urls import reverse
 import datetime
-from django.db.models import Count, Sum, Avg, Q, ExpressionWrapper, F, DecimalField, FloatField
+import hashlib
+from abc import ABCMeta, abstractmethod
+import os
+from collections import defaultdict
+from django.db.models import Count, Sum, Avg, Max, Q, ExpressionWrapper, F, DecimalField, FloatField
 from django.core.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
 
 from app.administration.models import (
     Direction, Group, Teacher, Student, Lesson, Attendance, Payment, Months, Expense, 
     TeacherPayment, Invoice, FinancialReport, Schedule, Classroom, Lead, HomeworkSubmission,
-    PaymentNotification, DiscountRegulation, HomeworkFile
+    PaymentNotification, DiscountRegulation, HomeworkFile, Job, LedgerEntry, current_month_expression
     )
 
 from app.administration.serializers import (
     DirectionSerializer, GroupSerializer, GroupCreateSerializer, TeacherCreateSerializer, TeacherSerializer, StudentCreateSerializer, StudentSerializer, AttendanceSerializer, 
-    PaymentSerializer, GroupDashboardSerializer, MonthsSerializer, GroupTableSerializer, StudentTableSerializer, TeacherTableSerializer, TeacherPaymentSerializer, ExpenseSerializer,  FinancialReportSerializer, InvoiceSerializer,
+    PaymentSerializer, GroupDashboardSerializer, MonthsSerializer, GroupTableSerializer, StudentTableSerializer, TeacherTableSerializer, TeacherPaymentSerializer, ExpenseSerializer,  FinancialReportSerializer, InvoiceSerializer, InvoiceGenerateSerializer, LedgerEntrySerializer,
     ScheduleSerializer, ClassroomSerializer, DailyScheduleSerializer, ScheduleListSerializer, ActiveStudentsSerializer, PopularCoursesSerializer, StudentProgressSerializer,
     TeacherWorkloadSerializer, MonthlyIncomeSerializer, StudentAttendanceSerializer, PaymentSerializer, LeadSerializer, LeadStatusUpdateSerializer, DashboardStatsSerializer,
     LessonSerializer, HomeworkSubmissionSerializer, PaymentNotificationSerializer, ProfileSerializer, DiscountRegulationSerializer,
-    TeacherProfileSerializer, StudentProfileSerializer, ScheduleCreateSerializer, AddRemoveStudentsSerializer, StudentHomeworkSerializer, HomeworkSubmissionUpdateSerializer
+    TeacherProfileSerializer, StudentProfileSerializer, ScheduleCreateSerializer, AddRemoveStudentsSerializer, StudentHomeworkSerializer, HomeworkSubmissionUpdateSerializer,
+    JobSerializer, DirectionTemplateSerializer
     )
 
 from app.users.models import CustomUser
@@ -37,7 +44,90 @@ from app.users.permissions import (
     IsAdminOrTeacherFullAccessOthersReadOnly, IsInAllowedRoles, IsAdminTeacherOrReadOnlyStudent, IsAdminOrStudent, IsManager
     )
 
-from app.utils import render_to_pdf, send_financial_reports_to_manager
+from app.administration.bank_import import import_statement
+from app.administration.jobs import enqueue_job
+from app.administration.facets import FACET_BUILDERS, facet_names, get_facets
+from app.administration.search import KINDS as SEARCH_KINDS, filter_by_search, search_documents
+from app.administration.caching import (
+    bump_group_versions, cached_response_data, get_versions, group_key, student_group_versions, table_key
+    )
+from app.administration.services import (
+    apply_membership_changes, calculate_teacher_payments, attendance_for_lessons, homework_for_lessons,
+    generate_invoices, replace_direction_template, sync_groups_from_template, GroupDashboard
+    )
+from app.utils import render_to_pdf, send_financial_reports_to_manager, _to_bytes
+
+
+def is_async_request(request):
+    """?async=1 — выполнить тяжёлую операцию фоновой задачей (см. run_worker)"""
+    return request.query_params.get('async', '').lower() in ('1', 'true')
+
+
+def job_accepted_response(request, job, **extra):
+    """Ответ 202 со ссылкой, по которой можно следить за задачей"""
+    data = {
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': request.build_absolute_uri(reverse('job-detail', kwargs={'pk': job.pk})),
+        **extra
+    }
+    return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+class NotModified(APIException):
+    status_code = status.HTTP_304_NOT_MODIFIED
+
+    def __init__(self, etag):
+        super().__init__()
+        self.etag = etag
+
+
+class ConditionalListMixin:
+    """
+    ETag и If-None-Match для list: если данные не менялись, ответ 304
+    отдаётся до выборки и сериализации списка.
+
+    Валидатор строится из дешёвых величин:
+    - etag_timestamp_field — для моделей с отметкой изменения:
+      Max(поле), Max(id) и Count по queryset одним запросом;
+    - etag_models — версии таблиц (DataVersion, их увеличивают сигналы):
+      для моделей без отметок времени и для связанных данных в ответе.
+    К ним добавляются параметры запроса и пользователь, так что у разных
+    фильтров и ролей свои ETag.
+    """
+    etag_timestamp_field = None
+    etag_models = ()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.list_etag = None
+        if self.action == 'list':
+            self.list_etag = self.get_list_etag(request)
+            if self.list_etag in request.headers.get('If-None-Match', '').replace(' ', '').split(','):
+                raise NotModified(self.list_etag)
+
+    def get_list_etag(self, request):
+        parts = [request.get_full_path(), str(request.user.pk), getattr(request.user, 'role', '') or '']
+        if self.etag_timestamp_field:
+            stats = self.filter_queryset(self.get_queryset()).order_by().aggregate(
+                changed=Max(self.etag_timestamp_field), last_id=Max('id'), count=Count('id')
+            )
+            parts.append(f"{stats['changed']}|{stats['last_id']}|{stats['count']}")
+        if self.etag_models:
+            versions = get_versions([table_key(model) for model in self.etag_models])
+            parts.append(','.join(f"{key}={version}" for key, version in sorted(versions.items())))
+        return '"%s"' % hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': exc.etag})
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'list_etag', None) and response.status_code == status.HTTP_200_OK:
+            response['ETag'] = self.list_etag
+        return response
 
 
 
@@ -46,99 +136,75 @@ class DirectionViewSet(viewsets.ModelViewSet):
     serializer_class = DirectionSerializer
     permission_classes = [IsAuthenticated]
 
+    @action(detail=True, methods=['get', 'put'], permission_classes=[IsAdminOrTeacherFullAccessOthersReadOnly])
+    def template(self, request, pk=None):
+        """Учебный план направления: PUT заменяет его целиком"""
+        direction = self.get_object()
+        if request.method == 'PUT':
+            serializer = DirectionTemplateSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            replace_direction_template(direction, serializer.validated_data['months'])
+
+        months = direction.template_months.prefetch_related('lessons')
+        return Response(DirectionTemplateSerializer({'months': months}).data)
+
+    @action(detail=True, methods=['post'], url_path='template/sync', permission_classes=[IsAdminOrTeacherFullAccessOthersReadOnly])
+    def sync_template(self, request, pk=None):
+        """Переносит шаблон в группы направления (все или из group_ids)"""
+        direction = self.get_object()
+        groups = direction.groups.all()
+        group_ids = request.data.get('group_ids')
+        if group_ids:
+            groups = groups.filter(id__in=group_ids)
+        return Response(sync_groups_from_template(groups))
+
 class GroupViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdmin]
-    queryset = Group.objects.all().select_related('direction')
-    
+    queryset = Group.objects.all()
+
+    def get_queryset(self):
+        # Текущий курс и месяц считаются в БД, по ним можно фильтровать:
+        # ?current_month=N, ?current_course=N, ?finishing=1
+        queryset = super().get_queryset().select_related('direction').with_progress()
+        if self.action in ('list', 'retrieve'):
+            # Остальные связи грузятся только для полей из ?fields= / без ?omit=
+            queryset = GroupSerializer.setup_sparse_loading(queryset, self.request)
+        params = self.request.query_params
+
+        if params.get('current_month', '').isdigit():
+            queryset = queryset.filter(progress_month=int(params['current_month']))
+        if params.get('current_course', '').isdigit():
+            queryset = queryset.filter(progress_course=int(params['current_course']))
+        if params.get('finishing', '').lower() in ('1', 'true'):
+            queryset = queryset.filter(progress_month=F('duration_months'))
+        return queryset
 
-    
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return GroupCreateSerializer
+        if self.action in ['add_students', 'remove_students']:
+            return AddRemoveStudentsSerializer
         return GroupSerializer
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        teacher_id = request.data.get('teacher')
-        teacher_user = None
-        if teacher_id:
-            try:
-                teacher_user = CustomUser.objects.get(id=teacher_id, role='Teacher')
-            except CustomUser.DoesNotExist:
-                return Response(
-                    {'teacher': 'Пользователь не найден или не является преподавателем'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
+        # В фоновом режиме учебный план строит run_worker, а не Group.save()
+        run_async = is_async_request(request) and serializer.validated_data.get('creation_type') == 'auto'
+        serializer.context['defer_curriculum'] = run_async
         group = serializer.save()
 
-        # Если указан Teacher — добавить группу в его профиль
-        teacher_id = request.data.get('teacher')
-        if teacher_id:
-            try:
-                teacher_user = CustomUser.objects.get(id=teacher_id, role='Teacher')
-                teacher_add = teacher_user.teacher_add
-
-                # Добавляем группу в профиль преподавателя
-                teacher_add.groups.add(group)
-
-                # Добавляем направление группы, если его ещё нет
-                if group.direction and group.direction not in teacher_add.directions.all():
-                    teacher_add.directions.add(group.direction)
-
-            except (CustomUser.DoesNotExist, Teacher.DoesNotExist):
-                pass  # Можно добавить логирование ошибки
-
-        # ✅ Добавление группы и направления в профиль каждого ученика
-        student_ids = request.data.get('students', [])
-        for student_id in student_ids:
-            try:
-                student_user = CustomUser.objects.get(id=student_id, role='Student')
-                student_add = student_user.student_add
-
-                # Добавляем группу в профиль ученика
-                student_add.groups.add(group)
-
-                # Добавляем направление группы, если его ещё нет
-                if group.direction and group.direction not in student_add.directions.all():
-                    student_add.directions.add(group.direction)
-
-            except (CustomUser.DoesNotExist, Student.DoesNotExist):
-                continue
-
-        if group.creation_type == 'auto':
-                for month_num in range(1, group.duration_months + 1):
-                    month = Months.objects.create(
-                        group=group,
-                        month_number=month_num,
-                        title=f"Месяц {month_num}",
-                        description=f"Описание месяца {month_num}"
-                    )
-
-                    # Генерация уроков
-                    for lesson_num in range(1, group.lessons_per_month + 1):
-                        lesson = Lesson.objects.create(
-                            month=month,
-                            order=lesson_num,
-                            title=f"Урок {lesson_num}",
-                            description=f"Описание урока {lesson_num}"
-                        )
-
-                        # Для каждого студента создаём Attendance и HomeworkSubmission
-                        for student in group.students.all():
-                            Attendance.objects.create(
-                                lesson=lesson,
-                                student=student,
-                                status='0'
-                            )
-                            HomeworkSubmission.objects.create(
-                                lesson=lesson,
-                                student=student,
-                                status='black'
-                            )
+        # Профили преподавателя и учеников, их направления и прогресс
+        # по урокам, созданным в Group.save()
+        apply_membership_changes(
+            student_links=[(group.id, user.id) for user in serializer.validated_data.get('students', [])],
+            teacher_links=[(group.id, group.teacher_id)] if group.teacher_id else [],
+        )
 
+        if run_async:
+            job = enqueue_job('group_curriculum', {'group_id': group.id}, request.user)
+            return job_accepted_response(request, job, group=serializer.data)
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -148,69 +214,76 @@ class GroupViewSet(viewsets.ModelViewSet):
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
-        prev_teacher = instance.teacher
+        prev_teacher_id = instance.teacher_id
+        prev_student_ids = set(instance.students.values_list('id', flat=True))
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         group = serializer.save()
 
-        # ---------------- Преподаватель ----------------
-        new_teacher_id = request.data.get('teacher')
-        if new_teacher_id:
-            try:
-                new_teacher_user = CustomUser.objects.get(id=new_teacher_id, role='Teacher')
-                teacher_add = new_teacher_user.teacher_add
-                teacher_add.groups.add(group)
-            except (CustomUser.DoesNotExist, Teacher.DoesNotExist):
-                pass
+        # Связи уже сохранены сериализатором на стороне группы — считаем
+        # разницу множеств и применяем её к профилям одним пакетом
+        teacher_links, teacher_unlinks = [], []
+        if 'teacher' in serializer.validated_data and group.teacher_id != prev_teacher_id:
+            if group.teacher_id:
+                teacher_links.append((group.id, group.teacher_id))
+            if prev_teacher_id:
+                teacher_unlinks.append((group.id, prev_teacher_id))
+
+        student_links, student_unlinks = [], []
+        if 'students' in serializer.validated_data:
+            new_student_ids = {user.id for user in serializer.validated_data['students']}
+            student_links = [(group.id, user_id) for user_id in new_student_ids - prev_student_ids]
+            student_unlinks = [(group.id, user_id) for user_id in prev_student_ids - new_student_ids]
+
+        apply_membership_changes(
+            student_links=student_links,
+            student_unlinks=student_unlinks,
+            teacher_links=teacher_links,
+            teacher_unlinks=teacher_unlinks,
+        )
 
-        if prev_teacher and prev_teacher != group.teacher:
-            try:
-                old_teacher_add = prev_teacher.teacher_add
-                old_teacher_add.groups.remove(group)
-            except Teacher.DoesNotExist:
-                pass
-
-        # ---------------- Студенты ----------------
-        student_ids = request.data.get('students', [])
-        if student_ids is not None:
-            current_students = set(instance.students.all())
-            new_students = set(CustomUser.objects.filter(id__in=student_ids, role='Student'))
-
-            # Удаляем группу у студентов, которых больше нет в списке
-            for user in current_students - new_students:
-                try:
-                    student_add = user.student_add
-                    student_add.groups.remove(group)
-                    if group.direction in student_add.directions.all():
-                        student_add.directions.remove(group.direction)
-                except Student.DoesNotExist:
-                    continue
-
-            # Добавляем группу новым студентам
-            for user in new_students:
-                try:
-                    student_add = user.student_add
-                    student_add.groups.add(group)
-                    if group.direction and group.direction not in student_add.directions.all():
-                        student_add.directions.add(group.direction)
-
-                    # --------- Автоматически создаем Attendance и HomeworkSubmission для новых студентов ----------
-                    for lesson in Lesson.objects.filter(month__group=group):
-                        Attendance.objects.get_or_create(
-                            lesson=lesson,
-                            student=user,
-                            defaults={'status':'0'}
-                        )
-                        HomeworkSubmission.objects.get_or_create(
-                            lesson=lesson,
-                            student=user,
-                            defaults={'status':'black'}
-                        )
+        return Response(serializer.data)
 
-                except Student.DoesNotExist:
-                    continue
+    @action(detail=True, methods=['post'], url_path='sync-template')
+    def sync_template(self, request, pk=None):
+        """Переносит правки шаблона направления в месяцы и уроки группы"""
+        group = self.get_object()
+        return Response(sync_groups_from_template([group]))
 
-        return Response(serializer.data)
+    @action(detail=True, methods=['post'], url_path='students/add')
+    def add_students(self, request, pk=None):
+        """Массовое зачисление: {"student_ids": [...]}"""
+        group = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        student_ids = set(serializer.validated_data['student_ids'])
+        already_in = set(group.students.filter(id__in=student_ids).values_list('id', flat=True))
+        added = student_ids - already_in
+        apply_membership_changes(student_links=[(group.id, user_id) for user_id in added])
+
+        return Response({
+            'added': len(added),
+            'skipped': len(already_in) + len(serializer.validated_data['invalid_ids']),
+            'invalid_ids': serializer.validated_data['invalid_ids'],
+        })
+
+    @action(detail=True, methods=['post'], url_path='students/remove')
+    def remove_students(self, request, pk=None):
+        """Массовое отчисление: {"student_ids": [...]}. Прогресс учеников сохраняется"""
+        group = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        student_ids = set(serializer.validated_data['student_ids'])
+        removed = set(group.students.filter(id__in=student_ids).values_list('id', flat=True))
+        apply_membership_changes(student_unlinks=[(group.id, user_id) for user_id in removed])
+
+        return Response({
+            'removed': len(removed),
+            'skipped': len(student_ids - removed) + len(serializer.validated_data['invalid_ids']),
+            'invalid_ids': serializer.validated_data['invalid_ids'],
+        })
 
 
 
@@ -226,6 +299,7 @@ class TeacherViewSet(viewsets.ModelViewSet):
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
+        prev_group_ids = set(instance.groups.values_list('id', flat=True))
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         teacher = serializer.save()
@@ -238,19 +312,11 @@ class TeacherViewSet(viewsets.ModelViewSet):
         # Обработка групп
         new_groups = serializer.validated_data.get('groups', None)
         if new_groups is not None:
-            current_user = teacher.user
-
-            for group in new_groups:
-                group.teacher = current_user
-                group.save()
-
-            old_groups = set(teacher.groups.all())
-            new_groups_set = set(new_groups)
-            removed_groups = old_groups - new_groups_set
-            for group in removed_groups:
-                if group.teacher == current_user:
-                    group.teacher = None
-                    group.save()
+            new_group_ids = {group.id for group in new_groups}
+            apply_membership_changes(
+                teacher_links=[(group_id, teacher.user_id) for group_id in new_group_ids],
+                teacher_unlinks=[(group_id, teacher.user_id) for group_id in prev_group_ids - new_group_ids],
+            )
 
         return Response(TeacherSerializer(teacher).data)
 
@@ -270,6 +336,7 @@ class StudentViewSet(viewsets.ModelViewSet):
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
+        prev_group_ids = set(instance.groups.values_list('id', flat=True))
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         student = serializer.save()
@@ -277,23 +344,17 @@ class StudentViewSet(viewsets.ModelViewSet):
         # Синхронизация групп
         new_groups = serializer.validated_data.get('groups', None)
         if new_groups is not None:
-            current_user = student.user
-
-            # Добавить пользователя в новые группы
-            for group in new_groups:
-                group.students.add(current_user)
-
-            # Удалить из удалённых групп
-            old_groups = set(student.groups.all())
-            new_groups_set = set(new_groups)
-            removed_groups = old_groups - new_groups_set
-            for group in removed_groups:
-                group.students.remove(current_user)
+            new_group_ids = {group.id for group in new_groups}
+            apply_membership_changes(
+                student_links=[(group_id, student.user_id) for group_id in new_group_ids],
+                student_unlinks=[(group_id, student.user_id) for group_id in prev_group_ids - new_group_ids],
+            )
 
         return Response(StudentSerializer(student).data)    
 
 class LessonViewSet(viewsets.ModelViewSet):
     queryset = Lesson.objects.all()
+    cursor_ordering = ('order', 'id')
     serializer_class = LessonSerializer
     permission_classes = [IsAdminOrTeacherFullAccessOthersReadOnly]
 
@@ -306,27 +367,66 @@ class AttendanceViewSet(viewsets.ModelViewSet):
 
 class MonthsViewSet(viewsets.ModelViewSet):
     queryset = Months.objects.all()
+    cursor_ordering = ('month_number', 'id')
     serializer_class = MonthsSerializer
     permission_classes = [IsAdminOrReadOnlyForOthers]
 
 
+class MatrixFormatNegotiation(DefaultContentNegotiation):
+    """
+    ?format=matrix выбирает форму данных, а не рендерер: DRF по умолчанию
+    искал бы рендерер с таким форматом и отвечал 404
+    """
+    def select_renderer(self, request, renderers, format_suffix=None):
+        if request.query_params.get(self.settings.URL_FORMAT_OVERRIDE) == 'matrix':
+            format_suffix = format_suffix or 'json'
+        return super().select_renderer(request, renderers, format_suffix)
+
+
 class GroupDashboardView(generics.RetrieveAPIView):
     # permission_classes = [IsInAllowedRoles]
-    queryset = Group.objects.all().select_related(
-        'direction', 'teacher'
-    ).prefetch_related(
-        'students',
-        'months',
-        'months__lessons',
-        'months__lessons__attendances',
-    )
+    queryset = Group.objects.all().select_related('direction', 'teacher')
     serializer_class = GroupDashboardSerializer
+    content_negotiation_class = MatrixFormatNegotiation
     lookup_field = 'id'
     
+    TABS = {
+        'data': 'Основные данные',
+        'students': 'Студенты',
+        'plans': 'Планы обучения',
+        'homework': 'Домашние задания',
+        'attendance': 'Посещаемость',
+        'stats': 'Статистика'
+    }
+    STUDENT_FIELDS = ['id', 'username', 'first_name', 'last_name', 'age', 'is_active']
+    # Поля ученика и массивы matrix-режима, которые нужны вкладке
+    TAB_STUDENT_PARTS = {
+        'students': ('payments', 'payments'),
+        'homework': ('homework_scores', 'homework'),
+        'attendance': ('attendances', 'attendance'),
+    }
+
     def retrieve(self, request, *args, **kwargs):
+        tab = request.query_params.get('tab')
+        if tab is not None and tab not in self.TABS:
+            return Response(
+                {"detail": f"Неизвестная вкладка: {tab}. Доступны: {', '.join(self.TABS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Группа и права проверяются до кэша: удалённая группа — 404,
+        # неизменённая отдаётся из кэша ещё за один запрос версии
         instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        
+        versions = get_versions([group_key(instance.id)])
+        return Response(cached_response_data(
+            'group-dashboard', versions, request, lambda: self.build_dashboard(request, instance, tab)
+        ))
+
+    def build_dashboard(self, request, instance, tab):
+        # Части дашборда грузятся лениво: вкладка выполняет только свои запросы
+        dashboard = GroupDashboard(instance)
+        matrix = request.query_params.get('format') == 'matrix'
+
         response_data = {
             'group': {
                 'id': instance.id,
@@ -338,25 +438,61 @@ class GroupDashboardView(generics.RetrieveAPIView):
                 'age_group': instance.age_group,
                 'is_active': instance.is_active,
             },
-            'months': MonthsSerializer(
-                instance.months.all().order_by('month_number'),
-                many=True,
-                context={'request': request}  # 👈 обязательно
-            ).data,
-
-            'students': serializer.data['students'],
-            'tabs': {
-                'data': 'Основные данные',
-                'students': 'Студенты',
-                'plans': 'Планы обучения',
-                'homework': 'Домашние задания',
-                'attendance': 'Посещаемость',
-                'stats': 'Статистика'
-            },
-            'current_tab': request.query_params.get('tab', 'data')
         }
-        
-        return Response(response_data)
+
+        if tab is None:
+            # Без ?tab= — полный ответ, как раньше
+            if matrix:
+                response_data.update(dashboard.matrix())
+            else:
+                response_data.update({
+                    'months': self.get_months_data(dashboard),
+                    'students': self.get_students_data(instance, dashboard),
+                })
+        else:
+            response_data[tab] = self.get_section(tab, instance, dashboard, matrix)
+
+        response_data.update({
+            'tabs': self.TABS,
+            'current_tab': tab or 'data'
+        })
+
+        return response_data
+
+    def get_section(self, tab, instance, dashboard, matrix):
+        if tab == 'data':
+            return {
+                'duration_months': instance.duration_months,
+                'current_course': instance.current_course,
+                'current_month': instance.current_month,
+                'planned_start': instance.planned_start,
+                'lessons_per_month': instance.lessons_per_month,
+                'lessons_per_week': instance.lessons_per_week,
+                'lesson_duration': instance.lesson_duration,
+                'schedule_days': instance.schedule_days,
+            }
+        if tab == 'plans':
+            return self.get_months_data(dashboard)
+        if tab == 'stats':
+            return dashboard.stats()
+
+        field, part = self.TAB_STUDENT_PARTS[tab]
+        if matrix:
+            return dashboard.matrix(parts=(part,))
+        return self.get_students_data(instance, dashboard, self.STUDENT_FIELDS + [field])
+
+    def get_months_data(self, dashboard):
+        return MonthsSerializer(
+            dashboard.months,
+            many=True,
+            context={'request': self.request}  # 👈 обязательно
+        ).data
+
+    def get_students_data(self, instance, dashboard, student_fields=None):
+        serializer = self.get_serializer(instance, context={
+            **self.get_serializer_context(), 'dashboard': dashboard, 'student_fields': student_fields
+        })
+        return serializer.data['students']
 
 
 
@@ -369,9 +505,11 @@ class GroupTableViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = GroupTableSerializer
     filterset_fields = ['direction__name', 'group_name']
     permission_classes = [IsAdminOrTeacher]  # кастомные права
+    cursor_ordering = ('id',)
 
     def get_queryset(self):
-        qs = Group.objects.all().select_related('direction')
+        # Месяц и последний урок — подзапросами: вся страница таблицы одним запросом
+        qs = Group.objects.with_table_progress().select_related('direction')
 
         user = self.request.user
         # если преподаватель — показываем только его группы
@@ -385,10 +523,8 @@ class GroupTableViewSet(viewsets.ReadOnlyModelViewSet):
         
         search_query = request.query_params.get('search')
         if search_query:
-            queryset = queryset.filter(
-                Q(group_name__icontains=search_query) |
-                Q(direction__name__icontains=search_query)
-            )
+            # Название группы и направления — по полнотекстовому индексу
+            queryset = filter_by_search(queryset, 'group', search_query)
         
         direction = request.query_params.get('direction')
         if direction:
@@ -397,13 +533,13 @@ class GroupTableViewSet(viewsets.ReadOnlyModelViewSet):
         group_name = request.query_params.get('group_name')
         if group_name:
             queryset = queryset.filter(group_name__icontains=group_name)
-            
-        serializer = self.get_serializer(queryset, many=True)
-        
-        directions = Direction.objects.values_list('name', flat=True).distinct()
+
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
         
         response_data = {
-            'directions': list(directions),
+            **self.paginator.get_links(),
+            'directions': facet_names(get_facets('groups'))['directions'],
             'groups': serializer.data,
             'selected_direction': direction,
             'search_query': search_query
@@ -413,22 +549,21 @@ class GroupTableViewSet(viewsets.ReadOnlyModelViewSet):
 
     
 
-class StudentTableViewSet(viewsets.ReadOnlyModelViewSet):
+class StudentTableViewSet(ConditionalListMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = StudentTableSerializer
+    etag_models = (Student, CustomUser, Group, Direction)
+    cursor_ordering = ('id',)
 
     def get_queryset(self):
-        return Student.objects.select_related('user').prefetch_related('groups', 'directions')
+        return StudentTableSerializer.setup_eager_loading(Student.objects.all())
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
 
         search_query = request.query_params.get('search')
         if search_query:
-            queryset = queryset.filter(
-                Q(user__first_name__icontains=search_query) |
-                Q(user__last_name__icontains=search_query)
-            )
+            queryset = filter_by_search(queryset, 'student', search_query, field='user_id')
 
         direction = request.query_params.get('direction')
         if direction:
@@ -444,32 +579,15 @@ class StudentTableViewSet(viewsets.ReadOnlyModelViewSet):
 
         queryset = queryset.distinct()
 
+        # Пагинация — с сохранением обёртки filters/selected_filters
         page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-
-        directions = Direction.objects.values_list('name', flat=True).distinct()
-        groups = Group.objects.values_list('group_name', flat=True).distinct()
-
-        teachers = CustomUser.objects.filter(
-            role='Teacher'
-        ).exclude(
-            Q(last_name__isnull=True) | Q(last_name='') |
-            Q(first_name__isnull=True) | Q(first_name='')
-        ).values_list('last_name', 'first_name').distinct()
-
-        teacher_names = [f"{last} {first}" for last, first in teachers]
+        serializer = self.get_serializer(page if page is not None else queryset, many=True)
 
         response_data = {
+            **(self.paginator.get_links() if page is not None else {}),
             'students': serializer.data,
-            'filters': {
-                'directions': list(directions),
-                'groups': list(groups),
-                'teachers': teacher_names,
-            },
+            # Значения фильтров — из кэшированного индекса (см. facets/)
+            'filters': facet_names(get_facets('students')),
             'selected_filters': {
                 'search': search_query,
                 'direction': direction,
@@ -488,10 +606,11 @@ class StudentTableViewSet(viewsets.ReadOnlyModelViewSet):
 class TeacherTableViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAdmin]
     serializer_class = TeacherTableSerializer
+    cursor_ordering = ('id',)
     
     def get_queryset(self):
         # Получаем только пользователей с ролью Teacher
-        return CustomUser.objects.filter(role='Teacher')
+        return TeacherTableSerializer.setup_eager_loading(CustomUser.objects.filter(role='Teacher'))
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
@@ -505,26 +624,17 @@ class TeacherTableViewSet(viewsets.ReadOnlyModelViewSet):
         # Поиск по имени
         search_query = request.query_params.get('search')
         if search_query:
-            queryset = queryset.filter(
-                Q(first_name__icontains=search_query) |
-                Q(last_name__icontains=search_query))
+            queryset = filter_by_search(queryset, 'teacher', search_query)
 
-        # Пагинация
+        # Пагинация — с сохранением обёртки filters/selected_filters
         page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        
-        # Получаем доступные направления для фильтра
-        directions = Direction.objects.values_list('name', flat=True).distinct()
+        serializer = self.get_serializer(page if page is not None else queryset, many=True)
 
         response_data = {
+            **(self.paginator.get_links() if page is not None else {}),
             'teachers': serializer.data,
-            'filters': {
-                'directions': list(directions),
-            },
+            # Значения фильтров — из кэшированного индекса (см. facets/)
+            'filters': facet_names(get_facets('teachers')),
             'selected_filters': {
                 'direction': direction,
                 'search': search_query
@@ -534,12 +644,53 @@ class TeacherTableViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(response_data)
     
 
+class FacetsView(APIView):
+    """
+    Значения фильтров таблиц с количествами: /facets/?for=students|teachers|groups.
+    Индекс хранится в кэше и сбрасывается сигналами на запись направлений,
+    групп и пользователей
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        target = request.query_params.get('for')
+        if target not in FACET_BUILDERS:
+            return Response(
+                {"detail": f"Параметр for должен быть одним из: {', '.join(FACET_BUILDERS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(get_facets(target))
+
+
+class SearchView(APIView):
+    """
+    Поиск по ученикам, преподавателям, группам и заявкам: /search/?q=ив пет.
+    Каждое слово ищется как префикс, регистр и ё/е не важны.
+    ?type=student,lead — только эти типы, ?limit=N — до 100 результатов
+    """
+    permission_classes = [IsAdminOrManager]
+
+    def get(self, request):
+        kinds = [kind for kind in request.query_params.get('type', '').split(',') if kind]
+        unknown = set(kinds) - set(SEARCH_KINDS)
+        if unknown:
+            return Response(
+                {"detail": f"Параметр type должен состоять из: {', '.join(SEARCH_KINDS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = request.query_params.get('limit', '')
+        limit = min(int(limit), 100) if limit.isdigit() else 20
+        return Response(search_documents(request.query_params.get('q', ''), kinds or SEARCH_KINDS, limit))
+
+
 # Добавляем к существующим представлениям
 
-class InvoiceViewSet(viewsets.ModelViewSet):
+class InvoiceViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAdminOrManager, IsAdmin]
-    queryset = Invoice.objects.all().select_related('student', 'months')
+    queryset = Invoice.objects.all()
     serializer_class = InvoiceSerializer
+    cursor_ordering = ('-date_created', '-id')
+    etag_models = (Invoice, Payment, Months, CustomUser)
     filterset_fields = ['student', 'months', 'status', 'due_date']
 
     def create(self, request, *args, **kwargs):
@@ -559,8 +710,30 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @action(detail=False, methods=['post'])
+    def generate(self, request):
+        """
+        Счета за месяц всем активным ученикам активных групп:
+        {"month_number": 3 | "date": "2025-03-01", "amount": ..., "due_date": ...,
+        "discount", "group_ids", "comment", "dry_run"}
+        """
+        serializer = InvoiceGenerateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        if is_async_request(request) and not serializer.validated_data['dry_run']:
+            job = enqueue_job('generate_invoices', serializer.data, request.user)
+            return job_accepted_response(request, job)
+
+        result = generate_invoices(**serializer.to_service_kwargs())
+        code = status.HTTP_200_OK if result['dry_run'] else status.HTTP_201_CREATED
+        return Response(result, status=code)
+
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = InvoiceSerializer.setup_sparse_loading(super().get_queryset(), self.request)
+
+        # ?debtors=1 — счета с остатком: сравнение хранимых сумм, без агрегатов
+        if self.request.query_params.get('debtors', '').lower() in ('1', 'true'):
+            queryset = queryset.debtors()
         
         # Фильтр по периоду
         start_date = self.request.query_params.get('start_date')
@@ -575,10 +748,12 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             
         return queryset.order_by('-date_created')
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAdminOrManager, IsAdmin]
     queryset = Payment.objects.all().select_related('invoice')
     serializer_class = PaymentSerializer
+    cursor_ordering = ('-date', '-id')
+    etag_models = (Payment, Invoice, Months, CustomUser)
     filterset_fields = ['date', 'invoice']
 
     def get_queryset(self):
@@ -597,17 +772,81 @@ class PaymentViewSet(viewsets.ModelViewSet):
             
         return queryset.order_by('-date')    
 
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_statement(self, request):
+        """
+        Импорт банковской выписки (multipart, поле file, CSV или XLSX):
+        строки сопоставляются с учениками по счёту, логину или телефону
+        и разносятся по открытым счетам. Возвращает отчёт сверки
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"detail": "Нужен файл выписки в поле file"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            report = import_statement(upload, upload.name)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+
 class ExpenseViewSet(viewsets.ModelViewSet):
     queryset = Expense.objects.all().select_related('teacher')
+    cursor_ordering = ('-date', '-id')
     serializer_class = ExpenseSerializer
     filterset_fields = ['category', 'date']
     permission_classes = [IsAdminOrManager, IsAdmin]
 
 
 
-class ExpensePDFView(APIView):
+class PDFReportView(APIView, metaclass=ABCMeta):
+    """
+    Базовый класс PDF-отчётов: наследник задаёт template_name, report_name
+    (ключ в PDF_REPORT_VIEWS) и get_context.
+
+    С ?async=1 отчёт строится фоновой задачей (см. run_worker), а готовый
+    файл скачивается через jobs/<id>/download/.
+    """
     permission_classes = [IsAdmin]
+    report_name = None
+    template_name = None
+    filename = "report.pdf"
+    disposition = None  # 'inline' или 'attachment'
+
+    @abstractmethod
+    def get_context(self, params):
+        """Контекст шаблона отчёта по параметрам запроса"""
+
+    def get_filename(self, params):
+        return self.filename
+
+    def build_pdf(self, params):
+        pdf_file = render_to_pdf(self.template_name, self.get_context(params))
+        try:
+            return _to_bytes(pdf_file)
+        finally:
+            pdf_file.close()
+            os.remove(pdf_file.name)
+
     def get(self, request, *args, **kwargs):
+        params = request.query_params.dict()
+        params.pop('async', None)
+
+        if is_async_request(request):
+            job = enqueue_job('pdf_report', {'report': self.report_name, 'params': params}, request.user)
+            return job_accepted_response(request, job)
+
+        response = HttpResponse(self.build_pdf(params), content_type="application/pdf")
+        if self.disposition:
+            response['Content-Disposition'] = f'{self.disposition}; filename="{self.get_filename(params)}"'
+        return response
+
+
+class ExpensePDFView(PDFReportView):
+    report_name = 'expenses'
+    template_name = "reports/expense_pdf_template.html"
+    filename = "expense_report.pdf"
+    disposition = 'inline'
+
+    def get_context(self, params):
         # Получаем все расходы
         expenses = Expense.objects.all().select_related('teacher')
 
@@ -617,44 +856,36 @@ class ExpensePDFView(APIView):
         # Считаем общую сумму
         total_amount = expenses.aggregate(Sum("amount"))["amount__sum"] or 0
 
-        # Контекст для шаблона
-        context = {
+        return {
             "expenses": serializer.data,
             "total_amount": total_amount,
         }
 
-        # Генерация PDF
-        pdf_file = render_to_pdf("reports/expense_pdf_template.html", context)
-
-        # Возвращаем PDF
-        response = HttpResponse(pdf_file, content_type="application/pdf")
-        response['Content-Disposition'] = 'inline; filename="expense_report.pdf"'
-        return response
-
 
 
 
 class TeacherPaymentViewSet(viewsets.ModelViewSet):
     queryset = TeacherPayment.objects.all().select_related('teacher')
+    cursor_ordering = ('-date', '-id')
     serializer_class = TeacherPaymentSerializer
     filterset_fields = ['teacher', 'date', 'is_paid']
     permission_classes = [IsAdminOrManager, IsAdmin]
 
 
-class TeacherPaymentsPDFView(APIView):
-    permission_classes = [IsAdmin]
-    def get(self, request, *args, **kwargs):
+class TeacherPaymentsPDFView(PDFReportView):
+    report_name = 'teacher_payments'
+    template_name = "reports/teacher_payments.html"
+    filename = "teacher_payments.pdf"
+
+    def get_context(self, params):
         payments = TeacherPayment.objects.all()
         total_amount = payments.aggregate(Sum("paid_amount"))["paid_amount__sum"] or 0
 
-        context = {
+        return {
             "payments": payments,
             "total_amount": total_amount,
         }
 
-        pdf_file = render_to_pdf("reports/teacher_payments.html", context)
-        return HttpResponse(pdf_file, content_type="application/pdf")
-
 
 class FinancialReportViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = FinancialReport.objects.all()
@@ -664,27 +895,23 @@ class FinancialReportViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 
-class FinancialReportPDFView(APIView):
-    permission_classes = [IsAdmin]
-    def get(self, request, *args, **kwargs):
+class FinancialReportPDFView(PDFReportView):
+    report_name = 'financial_report'
+    template_name = "reports/financial_report_pdf_template.html"
+    filename = "financial_report.pdf"
+    disposition = 'inline'
+
+    def get_context(self, params):
         # Получаем все отчеты
         reports = FinancialReport.objects.all()
 
         # Сериализуем их
         serializer = FinancialReportSerializer(reports, many=True)
 
-        context = {
+        return {
             "reports": serializer.data,
         }
 
-        # Генерация PDF
-        pdf_file = render_to_pdf("reports/financial_report_pdf_template.html", context)
-
-        # Возврат PDF
-        response = HttpResponse(pdf_file, content_type="application/pdf")
-        response['Content-Disposition'] = 'inline; filename="financial_report.pdf"'
-        return response
-
 
 
 # views.py
@@ -736,81 +963,14 @@ class GenerateFinancialReport(APIView):
 class CalculateTeacherPayments(APIView):
     permission_classes = [IsAdminOrManager, IsAdmin]
     def post(self, request, format=None):
-        from datetime import datetime
-        import calendar
-        from django.utils import timezone
-        
         month = request.data.get('month', timezone.now().month)
         year = request.data.get('year', timezone.now().year)
-        
-        start_date = timezone.make_aware(datetime(year, month, 1))
-        end_date = timezone.make_aware(datetime(year, month, calendar.monthrange(year, month)[1]))
-        
-        teachers = CustomUser.objects.filter(role='Teacher', is_active=True)
-        results = []
-        
-        for teacher in teachers:
-            try:
-                # Получаем профиль преподавателя
-                teacher_profile = Teacher.objects.get(user=teacher)
-                
-                # Получаем группы, где преподаватель является teacher
-                groups = Group.objects.filter(teacher=teacher)
-                
-                total_lessons = 0
-                total_payment = 0
-                
-                for group in groups:
-                    lessons_count = Lesson.objects.filter(
-                        month__group=group,
-                        date__range=[start_date, end_date]
-                    ).count()
-                    
-                    if teacher_profile.payment_type == 'fixed':
-                        if teacher_profile.payment_period == 'month':
-                            payment = teacher_profile.payment_amount
-                        else:  # per_lesson
-                            payment = teacher_profile.payment_amount * lessons_count
-                    else:  # hourly
-                        payment = teacher_profile.payment_amount * lessons_count * group.lesson_duration
-                    
-                    total_lessons += lessons_count
-                    total_payment += payment
-                
-                # Создаем или обновляем запись о выплате
-                payment, created = TeacherPayment.objects.update_or_create(
-                    teacher=teacher,
-                    date=end_date,
-                    defaults={
-                        'lessons_count': total_lessons,
-                        'rate': teacher_profile.payment_amount,
-                        'payment': total_payment,
-                        'bonus': 0,
-                        'is_paid': False
-                    }
-                )
-                
-                results.append({
-                    'teacher_id': teacher.id,
-                    'teacher_name': teacher.get_full_name(),
-                    'lessons_count': total_lessons,
-                    'payment': total_payment,
-                    'status': 'created' if created else 'updated'
-                })
-                
-            except Teacher.DoesNotExist:
-                results.append({
-                    'teacher_id': teacher.id,
-                    'error': 'Teacher profile not found'
-                })
-                continue
-        
-        return Response({
-            'status': 'success',
-            'period': f"{start_date.date()} - {end_date.date()}",
-            'teachers_processed': len(results),
-            'results': results
-        }, status=status.HTTP_200_OK)
+
+        if is_async_request(request):
+            job = enqueue_job('teacher_payments', {'month': month, 'year': year}, request.user)
+            return job_accepted_response(request, job)
+
+        return Response(calculate_teacher_payments(month, year), status=status.HTTP_200_OK)
     
 
 
@@ -820,8 +980,10 @@ class ClassroomViewSet(viewsets.ModelViewSet):
     serializer_class = ClassroomSerializer
     permission_classes = [IsAdmin]
     
-class ScheduleViewSet(viewsets.ModelViewSet):
+class ScheduleViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('classroom_id', 'start_time', 'id')
+    etag_models = (Schedule, Classroom, Group, Direction, CustomUser)
     queryset = Schedule.objects.all().select_related(
         'classroom', 'group', 'group__direction', 'teacher'
     )
@@ -1008,16 +1170,23 @@ class MonthlyIncomeAnalytics(APIView):
         return Response(result)
     
 
-class MonthlyIncomePDFView(APIView):
-    permission_classes = [IsAdmin]
+class MonthlyIncomePDFView(PDFReportView):
+    report_name = 'monthly_income'
+    template_name = "reports/monthly_income.html"
+    disposition = 'attachment'
 
-    def get(self, request):
+    def get_year(self, params):
         # Берем год
-        year = request.query_params.get('year', timezone.now().year)
         try:
-            year = int(year)
+            return int(params.get('year', timezone.now().year))
         except ValueError:
-            year = timezone.now().year
+            return timezone.now().year
+
+    def get_filename(self, params):
+        return f"monthly_income_{self.get_year(params)}.pdf"
+
+    def get_context(self, params):
+        year = self.get_year(params)
 
         months_ru = [
             'Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
@@ -1051,20 +1220,12 @@ class MonthlyIncomePDFView(APIView):
                 "income": income,
             })
 
-        context = {
+        return {
             "year": year,
             "months": result,
             "total_year": total_year,
         }
 
-        # Генерация PDF
-        pdf_file = render_to_pdf("reports/monthly_income.html", context)
-
-        response = HttpResponse(pdf_file.read(), content_type="application/pdf")
-        response["Content-Disposition"] = f'attachment; filename="monthly_income_{year}.pdf"'
-        pdf_file.close()
-        return response
-
 
 
 class TeacherWorkloadAnalytics(APIView):
@@ -1134,11 +1295,16 @@ class TeacherWorkloadAnalytics(APIView):
             )
 
 
-class TeacherWorkloadPDFView(APIView):
-    permission_classes = [IsAdmin]
+class TeacherWorkloadPDFView(PDFReportView):
+    report_name = 'teacher_workload'
+    template_name = "reports/teacher_workload.html"
+    disposition = 'attachment'
 
-    def get(self, request):
-        period = request.query_params.get('period', 'week')
+    def get_filename(self, params):
+        return f"teacher_workload_{params.get('period', 'week')}.pdf"
+
+    def get_context(self, params):
+        period = params.get('period', 'week')
         
         if period == 'week':
             start_date = timezone.now().date() - timedelta(days=7)
@@ -1191,21 +1357,13 @@ class TeacherWorkloadPDFView(APIView):
         # Сортировка по количеству занятий
         result.sort(key=lambda x: x['lessons_count'], reverse=True)
 
-        context = {
+        return {
             'period': period,
             'start_date': start_date,
             'end_date': end_date,
             'teachers': result,
         }
 
-        # Генерация PDF через BytesIO
-        pdf_file = render_to_pdf("reports/teacher_workload.html", context)
-
-        response = HttpResponse(pdf_file.read(), content_type="application/pdf")
-        response['Content-Disposition'] = f'attachment; filename="teacher_workload_{period}.pdf"'
-        pdf_file.close()
-        return response
-
 
 
 
@@ -1250,53 +1408,50 @@ class PopularCoursesAnalytics(APIView):
 
 
 
-class PopularCoursesPDFView(APIView):
-    permission_classes = [IsAdmin]
+class PopularCoursesPDFView(PDFReportView):
+    report_name = 'popular_courses'
+    template_name = "reports/popular_courses.html"
+    filename = "popular_courses.pdf"
+    disposition = 'attachment'
 
-    def get(self, request):
+    def get(self, request, *args, **kwargs):
         try:
-            directions = Direction.objects.annotate(
-                num_students=Count('groups__students', distinct=True),
-                num_groups=Count('groups', distinct=True)
-            ).filter(num_students__gt=0).order_by('-num_students')
-
-            result = []
-            for rank, direction in enumerate(directions, start=1):
-                income = Payment.objects.filter(
-                    invoice__months__group__direction=direction
-                ).aggregate(
-                    total=Coalesce(
-                        Sum(
-                            ExpressionWrapper(
-                                F('cash_amount') + F('transfer_amount') + F('online_amount'),
-                                output_field=DecimalField()  # здесь явно указываем DecimalField
-                            )
-                        ),
-                        0,  # по умолчанию Coalesce возвращает IntegerField для 0, поэтому оборачиваем в Decimal
-                        output_field=DecimalField()
-                    )
-                )['total'] or 0
+            return super().get(request, *args, **kwargs)
+        except Exception as e:
+            return HttpResponse(f"Ошибка при формировании отчёта: {e}", status=500)
 
-                result.append({
-                    'rank': rank,
-                    'course': direction.name,
-                    'students_count': direction.num_students,
-                    'groups_count': direction.num_groups,
-                    'income': float(income)
-                })
+    def get_context(self, params):
+        directions = Direction.objects.annotate(
+            num_students=Count('groups__students', distinct=True),
+            num_groups=Count('groups', distinct=True)
+        ).filter(num_students__gt=0).order_by('-num_students')
 
-            context = {'courses': result}
-            pdf_file = render_to_pdf("reports/popular_courses.html", context)
-            if not pdf_file:
-                return HttpResponse("Ошибка при генерации PDF", status=500)
+        result = []
+        for rank, direction in enumerate(directions, start=1):
+            income = Payment.objects.filter(
+                invoice__months__group__direction=direction
+            ).aggregate(
+                total=Coalesce(
+                    Sum(
+                        ExpressionWrapper(
+                            F('cash_amount') + F('transfer_amount') + F('online_amount'),
+                            output_field=DecimalField()  # здесь явно указываем DecimalField
+                        )
+                    ),
+                    0,  # по умолчанию Coalesce возвращает IntegerField для 0, поэтому оборачиваем в Decimal
+                    output_field=DecimalField()
+                )
+            )['total'] or 0
 
-            response = HttpResponse(pdf_file.read(), content_type="application/pdf")
-            response['Content-Disposition'] = 'attachment; filename="popular_courses.pdf"'
-            pdf_file.close()
-            return response
+            result.append({
+                'rank': rank,
+                'course': direction.name,
+                'students_count': direction.num_students,
+                'groups_count': direction.num_groups,
+                'income': float(income)
+            })
 
-        except Exception as e:
-            return HttpResponse(f"Ошибка при формировании отчёта: {e}", status=500)
+        return {'courses': result}
 
 
 
@@ -1306,54 +1461,73 @@ class StudentAttendanceView(APIView):
     permission_classes = [IsAdminOrReadOnlyForManagersAndTeachers, IsAdmin]
     def get(self, request, student_id):
         try:
-            # Получаем все посещения студента с предзагрузкой связанных данных
-            attendances = Attendance.objects.filter(
-                student_id=student_id
-            ).select_related(
-                'lesson__month__group__direction',
-                'lesson__month__group__teacher'
-            ).order_by('-lesson__date')
-            
-            if not attendances.exists():
+            student = CustomUser.objects.filter(pk=student_id).first()
+            if student is None:
                 return Response([])
-            
+
+            # Уроки групп ученика и уроки с сохранённой посещаемостью. Строки
+            # со статусом по умолчанию могут не храниться (разреженный режим) —
+            # их подставляет attendance_for_lessons, как в дашборде группы
+            lessons = list(
+                Lesson.objects.filter(
+                    Q(month__group__students=student) | Q(attendances__student=student)
+                ).distinct().select_related(
+                    'month__group__direction',
+                    'month__group__teacher'
+                ).order_by('-date', 'id')
+            )
+            attendances = attendance_for_lessons(
+                lessons, student, Attendance.objects.filter(student=student, lesson__in=lessons)
+            )
+
+            # Расписание по (группа, дата) — одним запросом, первое занятие дня
+            lesson_days = {
+                (lesson.month.group_id, timezone.localtime(lesson.date).date())
+                for lesson in lessons if lesson.date
+            }
+            schedules = {}
+            if lesson_days:
+                for schedule in Schedule.objects.filter(
+                    group_id__in={group_id for group_id, _ in lesson_days},
+                    date__in={day for _, day in lesson_days}
+                ).select_related('teacher'):
+                    schedules.setdefault((schedule.group_id, schedule.date), schedule)
+
             result = []
             for att in attendances:
-                if not att.lesson:
-                    continue
-                
+                group = att.lesson.month.group
+
                 # Основные данные
                 attendance_data = {
                     'id': att.id,
                     'status': att.status,
                     'status_display': att.get_status_display(),
-                    'group': att.lesson.month.group.group_name,
-                    'subject': att.lesson.month.group.direction.name
+                    'group': group.group_name,
+                    'subject': group.direction.name
                 }
-                
+
                 # 1. Пытаемся получить дату из расписания
-                schedule = Schedule.objects.filter(
-                    group=att.lesson.month.group,
-                    date=att.lesson.date
-                ).first()
-                
+                schedule = None
+                if att.lesson.date:
+                    schedule = schedules.get((group.id, timezone.localtime(att.lesson.date).date()))
+
                 if schedule:
                     attendance_data['date'] = schedule.date.strftime('%d.%m.%Y')
                     attendance_data['teacher'] = schedule.get_teacher_name()
                 else:
                     # 2. Если нет расписания, берем дату из урока
                     attendance_data['date'] = att.lesson.date.strftime('%d.%m.%Y') if att.lesson.date else None
-                    
+
                     # 3. Преподавателя берем из группы
-                    if att.lesson.month.group.teacher:
-                        attendance_data['teacher'] = att.lesson.month.group.teacher.get_full_name()
+                    if group.teacher:
+                        attendance_data['teacher'] = group.teacher.get_full_name()
                     else:
                         attendance_data['teacher'] = None
-                
+
                 result.append(attendance_data)
-            
+
             return Response(result)
-            
+
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -1401,12 +1575,54 @@ class StudentPaymentsView(APIView):
         
         return Response(data)
 
-    
+
+class StudentBalanceView(APIView):
+    """Текущий долг ученика — баланс последней записи журнала, один запрос"""
+    permission_classes = [IsAdminOrManager, IsAdmin]
+
+    def get(self, request, student_id):
+        entry = LedgerEntry.objects.filter(student_id=student_id).order_by('-id').values(
+            'balance', 'created_at'
+        ).first() or {'balance': Decimal('0'), 'created_at': None}
+        return Response({
+            'student_id': student_id,
+            'balance': f"{entry['balance']:.2f}",
+            'updated_at': entry['created_at'],
+        })
+
+
+class StudentBalancesView(APIView):
+    """Долги нескольких учеников для таблицы: /students/balances/?ids=1,2,3 — один запрос"""
+    permission_classes = [IsAdminOrManager, IsAdmin]
+    max_ids = 500
+
+    def get(self, request):
+        ids = {int(pk) for pk in request.query_params.get('ids', '').split(',') if pk.strip().isdigit()}
+        if not ids or len(ids) > self.max_ids:
+            return Response(
+                {"detail": f"Параметр ids — от 1 до {self.max_ids} id через запятую"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        balances = LedgerEntry.objects.balances(ids)
+        return Response({'balances': {pk: f"{balance:.2f}" for pk, balance in sorted(balances.items())}})
+
+
+class StudentLedgerView(generics.ListAPIView):
+    """Журнал расчётов ученика, новые записи первыми"""
+    permission_classes = [IsAdminOrManager, IsAdmin]
+    serializer_class = LedgerEntrySerializer
+    cursor_ordering = ('-id',)
+
+    def get_queryset(self):
+        return LedgerEntry.objects.filter(student_id=self.kwargs['student_id'])
+
 
 
-class LeadViewSet(viewsets.ModelViewSet):
+class LeadViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     queryset = Lead.objects.all()
+    cursor_ordering = ('-created_at', '-id')
     serializer_class = LeadSerializer
+    etag_timestamp_field = 'updated_at'
     permission_classes = [IsAdminOrManager, IsAdmin]
     filterset_fields = ['status', 'source']
     
@@ -1424,14 +1640,10 @@ class LeadViewSet(viewsets.ModelViewSet):
         elif date_to:
             queryset = queryset.filter(created_at__date__lte=date_to)
             
-        # Поиск по имени, телефону или курсу
+        # Поиск по имени, телефону, email или курсу
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) |
-                Q(phone__icontains=search) |
-                Q(course__icontains=search)
-            )
+            queryset = filter_by_search(queryset, 'lead', search)
             
         return queryset.order_by('-created_at')
     
@@ -1550,14 +1762,19 @@ class AdminDashboardView(APIView):
                 lesson__date__date=today
             )
 
-            total_lessons = Lesson.objects.filter(
-                date__date=today
-            ).count()
+            lessons_today = Lesson.objects.filter(date__date=today)
+            total_lessons = lessons_today.count()
+
+            # Строки «отсутствовал» могут не храниться (разреженный режим),
+            # поэтому отсутствующих считаем от числа пар урок × ученик группы
+            expected = lessons_today.aggregate(n=Count('month__group__students'))['n'] or 0
+            present = attendances_today.filter(status='1').count()
+            online = attendances_today.filter(status='online').count()
 
             attendance_stats = {
-                'present': attendances_today.filter(status='1').count(),
-                'online': attendances_today.filter(status='online').count(),
-                'absent': attendances_today.filter(status='0').count(),
+                'present': present,
+                'online': online,
+                'absent': max(expected - present - online, 0),
             }
 
             total_attendances = sum(attendance_stats.values())
@@ -1607,64 +1824,72 @@ class AdminDashboardView(APIView):
 class StudentGradesView(APIView):
     permission_classes = [IsAdminOrReadOnlyForManagersAndTeachers, IsAdmin]
     def get(self, request, group_id):
+        # Неизменённая группа отдаётся из кэша за один запрос версии
+        versions = get_versions([group_key(group_id)])
         try:
-            group = Group.objects.get(id=group_id)
-            
-            # Получаем все отправленные работы с предзагрузкой связей
-            submissions = HomeworkSubmission.objects.filter(
-                lesson__month__group=group
-            ).select_related(
-                'lesson__month__group',
-                'lesson__month',
-                'student'
-            ).prefetch_related(
-                'lesson__month'
-            ).order_by('lesson__order')
-            
-            # Группируем по студентам
-            students_data = []
-            for student in group.students.all():
-                student_submissions = submissions.filter(student=student)
-                serializer = HomeworkSubmissionSerializer(student_submissions, many=True)
-                
-                # Рассчитываем средний балл
-                scores = [s.score for s in student_submissions if s.score is not None]
-                avg_score = round(sum(scores)/len(scores), 2) if scores else 0
-                
-                students_data.append({
-                    'id': student.id,
-                    'first_name': student.first_name,
-                    'last_name': student.last_name,
-                    'submissions': serializer.data,
-                    'average_score': avg_score
-                })
-            
-            # Получаем структуру курсов
-            months = group.months.all().prefetch_related('lessons')
-
-            response_data = {
-                'group': {
-                    'id': group.id,
-                    'name': group.group_name,
-                    'direction': group.direction.name if group.direction else None
-                },
-                'months': [{
-                    'id': month.id,
-                    'month_number': month.month_number,
-                    'title': month.title,
-                    'lessons': [{
-                        'id': lesson.id,
-                        'title': lesson.title,
-                        'order': lesson.order
-                    } for lesson in month.lessons.all().order_by('order')]
-                } for month in months.order_by('month_number')],
-                'students': students_data
-            }
-            
-            return Response(response_data)
-            
+            return Response(cached_response_data(
+                'group-grades', versions, request, lambda: self.build_grades(group_id)
+            ))
         except Group.DoesNotExist:
             return Response({'error': 'Group not found'}, status=404)
+
+    def build_grades(self, group_id):
+        group = Group.objects.get(id=group_id)
+        
+        lessons = list(
+            Lesson.objects.filter(month__group=group)
+            .select_related('month__group__teacher')
+            .order_by('order')
+        )
+
+        # Получаем все сохранённые работы одним запросом и группируем по студентам
+        submissions_by_student = defaultdict(list)
+        for submission in HomeworkSubmission.objects.filter(lesson__month__group=group):
+            submissions_by_student[submission.student_id].append(submission)
+
+        students_data = []
+        for student in group.students.all():
+            # Работы без строки в БД — «не сделано» (разреженный режим)
+            student_submissions = homework_for_lessons(
+                lessons, student, submissions_by_student[student.id]
+            )
+            serializer = HomeworkSubmissionSerializer(student_submissions, many=True)
+            
+            # Рассчитываем средний балл
+            scores = [s.score for s in student_submissions if s.score is not None]
+            avg_score = round(sum(scores)/len(scores), 2) if scores else 0
+            
+            students_data.append({
+                'id': student.id,
+                'first_name': student.first_name,
+                'last_name': student.last_name,
+                'submissions': serializer.data,
+                'average_score': avg_score
+            })
+        
+        # Получаем структуру курсов
+        months = group.months.all().prefetch_related('lessons')
+
+        response_data = {
+            'group': {
+                'id': group.id,
+                'name': group.group_name,
+                'direction': group.direction.name if group.direction else None
+            },
+            'months': [{
+                'id': month.id,
+                'month_number': month.month_number,
+                'title': month.title,
+                'lessons': [{
+                    'id': lesson.id,
+                    'title': lesson.title,
+                    'order': lesson.order
+                } for lesson in month.lessons.all().order_by('order')]
+            } for month in months.order_by('month_number')],
+            'students': students_data
+        }
+        
+        return response_data
    
 
 
@@ -1678,6 +1903,10 @@ class PaymentNotificationViewSet(viewsets.ModelViewSet):
 class SendReportsView(APIView):
     permission_classes = [IsAdmin]
     def post(self, request, *args, **kwargs):
+        if is_async_request(request):
+            job = enqueue_job('send_reports', user=request.user)
+            return job_accepted_response(request, job)
+
         try:
             send_financial_reports_to_manager()
             return Response({"message": "Отчёты успешно отправлены!"}, status=status.HTTP_200_OK)
@@ -1701,6 +1930,9 @@ class StudentProfileView(generics.RetrieveUpdateAPIView):
     lookup_url_kwarg = 'student_id'
     permission_classes = [IsAdminOrReadOnlyForManagersAndTeachers]
 
+    def get_queryset(self):
+        return StudentProfileSerializer.setup_sparse_loading(super().get_queryset(), self.request)
+
 
 class HomeworkSubmissionCreateView(generics.CreateAPIView):
     serializer_class = HomeworkSubmissionSerializer
@@ -1738,9 +1970,15 @@ class StudentHomeworkViewSet(viewsets.ViewSet):
     # GET список или один урок
     def list(self, request):
         user = request.user
-        student_groups = user.student_groups.all()
-        current_months = Months.objects.filter(group__in=student_groups, month_number__in=[g.current_month for g in student_groups])
-        lessons = Lesson.objects.filter(month__in=current_months).exclude(homework_description='').order_by('-date')
+        # Уроки текущего месяца каждой группы ученика — одним запросом
+        lessons = (
+            Lesson.objects.filter(month__group__students=user)
+            .alias(group_month=current_month_expression('month__group__'))
+            .filter(month__month_number=F('group_month'))
+            .exclude(homework_description='')
+            .select_related('month__group__teacher')
+            .order_by('-date')
+        )
         serializer = StudentHomeworkSerializer(lessons, many=True, context={'request': request})
         return Response(serializer.data)
 
@@ -1778,6 +2016,7 @@ class StudentHomeworkViewSet(viewsets.ViewSet):
 
 class TeacherHomeworkViewSet(viewsets.ModelViewSet):
     serializer_class = HomeworkSubmissionSerializer
+    cursor_ordering = ('-submitted_at', '-id')
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
@@ -1792,11 +2031,8 @@ class TeacherHomeworkViewSet(viewsets.ModelViewSet):
         lessons = Lesson.objects.filter(month__group__in=groups)
 
         # Находим все работы студентов по этим урокам
-        return (
-            HomeworkSubmission.objects.filter(lesson__in=lessons)
-            .select_related("student", "lesson")
-            .order_by("-submitted_at")
-        )
+        queryset = HomeworkSubmission.objects.filter(lesson__in=lessons).order_by("-submitted_at")
+        return HomeworkSubmissionSerializer.setup_sparse_loading(queryset, self.request)
 
     def perform_update(self, serializer):
         user = self.request.user
@@ -1820,6 +2056,19 @@ class TeacherHomeworkViewSet(viewsets.ModelViewSet):
 class StudentProgressView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = StudentProgressSerializer
+    # Строки прогресса собираются в памяти, а не queryset — без пагинации
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        if request.user.role != 'Student':
+            return super().list(request, *args, **kwargs)
+
+        # Прогресс не менялся, пока не изменились версии групп ученика
+        build = super().list
+        return Response(cached_response_data(
+            'student-progress', student_group_versions(request.user), request,
+            lambda: build(request, *args, **kwargs).data, per_user=True
+        ))
 
     def get_queryset(self):
         user = self.request.user
@@ -1827,22 +2076,21 @@ class StudentProgressView(generics.ListAPIView):
             return Lesson.objects.none()
 
         # Получаем все уроки, где студент состоит в группе
-        lessons = Lesson.objects.filter(month__group__in=user.student_groups.all()).order_by('date')
-
-        # Подготавливаем данные для сериализатора
-        progress_list = []
-        for lesson in lessons:
-            # Получаем посещаемость
-            attendance = Attendance.objects.filter(lesson=lesson, student=user).first()
-            # Получаем домашнее задание
-            homework = HomeworkSubmission.objects.filter(lesson=lesson, student=user).first()
-            
-            progress_list.append({
-                'lesson': lesson,
-                'attendance': attendance or Attendance(status='0'),
-                'homework': homework or HomeworkSubmission(status='black', score=None)
-            })
-        return progress_list
+        lessons = list(Lesson.objects.filter(month__group__in=user.student_groups.all()).order_by('date'))
+
+        # Посещаемость и ДЗ — по запросу на таблицу, недостающие строки
+        # заполняются значениями по умолчанию
+        attendances = attendance_for_lessons(
+            lessons, user, Attendance.objects.filter(lesson__in=lessons, student=user)
+        )
+        homeworks = homework_for_lessons(
+            lessons, user, HomeworkSubmission.objects.filter(lesson__in=lessons, student=user)
+        )
+
+        return [
+            {'lesson': lesson, 'attendance': attendance, 'homework': homework}
+            for lesson, attendance, homework in zip(lessons, attendances, homeworks)
+        ]
 
 
 class DiscountRegulationViewSet(viewsets.ModelViewSet):
@@ -1870,21 +2118,39 @@ class StudentAttendanceUpdateView(generics.UpdateAPIView):
         attendances = self.get_object()
         data = request.data.get("attendances", [])
 
-        update_map = {item["id"]: item["status"] for item in data}
+        # Строки может ещё не быть (разреженный режим) — тогда вместо id
+        # передаётся lesson, и строка создаётся при первой записи
+        update_map = {item["id"]: item["status"] for item in data if item.get("id")}
+        lesson_map = {item["lesson"]: item["status"] for item in data if not item.get("id") and item.get("lesson")}
 
-        for att in attendances:
+        for att in attendances.filter(Q(id__in=update_map) | Q(lesson_id__in=lesson_map)):
             if att.id in update_map:
                 att.status = update_map[att.id]
-                att.save()
+            else:
+                att.status = lesson_map[att.lesson_id]
+            lesson_map.pop(att.lesson_id, None)
+            att.save()
+
+        new_lessons = Lesson.objects.filter(id__in=lesson_map, month__group_id=self.kwargs['group_id'])
+        Attendance.objects.bulk_create(
+            [
+                Attendance(lesson=lesson, student_id=self.kwargs['student_id'], status=lesson_map[lesson.id])
+                for lesson in new_lessons
+            ],
+            ignore_conflicts=True
+        )
+        bump_group_versions([self.kwargs['group_id']])
 
         return Response({"detail": "Посещаемости обновлены"}, status=status.HTTP_200_OK)
 
-class IncomeReportPDFView(APIView):
-    permission_classes = [IsAdmin]
+class IncomeReportPDFView(PDFReportView):
+    report_name = 'income_report'
+    template_name = "reports/income_report.html"
+    filename = "income_report.pdf"
 
-    def get(self, request, *args, **kwargs):
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date')
+    def get_context(self, params):
+        start_date = params.get('start_date')
+        end_date = params.get('end_date')
 
         payments = Payment.objects.select_related("invoice", "invoice__months__group")
 
@@ -1925,16 +2191,12 @@ class IncomeReportPDFView(APIView):
             })
 
         # Контекст для PDF
-        context = {
+        return {
             "period": {"start_date": start_date, "end_date": end_date},
             "items": items,
             "total_income": total_income
         }
 
-        pdf_bytes = render_to_pdf("reports/income_report.html", context)
-
-        return HttpResponse(pdf_bytes, content_type="application/pdf")
-
 class IncomeReportView(APIView):
     permission_classes = [IsAdmin]
 
@@ -1986,3 +2248,29 @@ class IncomeReportView(APIView):
             "items": items,
             "total_income": total_income
         })
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Статус фоновых задач и скачивание их результатов"""
+    queryset = Job.objects.all()
+    cursor_ordering = ('-created_at', '-id')
+    serializer_class = JobSerializer
+    permission_classes = [IsAdmin]
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != 'done' or not job.result_file:
+            raise Http404("Файл результата ещё не готов")
+        filename = job.result.get('filename') if isinstance(job.result, dict) else None
+        return FileResponse(job.result_file.open('rb'), as_attachment=True, filename=filename)
+
+
+# Отчёты, которые можно построить фоновой задачей 'pdf_report'
+PDF_REPORT_VIEWS = {
+    view.report_name: view
+    for view in (
+        ExpensePDFView, TeacherPaymentsPDFView, FinancialReportPDFView, MonthlyIncomePDFView,
+        TeacherWorkloadPDFView, PopularCoursesPDFView, IncomeReportPDFView
+    )
+}
@@ -164,6 +164,9 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ),
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    # Курсорная пагинация всех списков; ключ сортировки — cursor_ordering представления
+    'DEFAULT_PAGINATION_CLASS': 'app.administration.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv("API_PAGE_SIZE", 100)),
 }
 
 # jwt
@@ -267,3 +270,20 @@ EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "True").lower() in ("true", "1")
 
 CORS_ALLOW_ALL_ORIGINS = True
+
+# Разреженное хранение прогресса: строки посещаемости и ДЗ со статусом
+# по умолчанию не создаются заранее, а достраиваются при чтении
+SPARSE_PROGRESS = os.getenv("SPARSE_PROGRESS", "True").lower() in ("true", "1")
+
+# Кэш ответов дашборда, оценок и прогресса. По умолчанию — память процесса;
+# CACHE_DIR включает файловый кэш, общий для всех процессов. Ключи содержат
+# версии данных групп из БД, так что устаревший ответ не отдаётся ни там, ни там
+CACHE_DIR = os.getenv("CACHE_DIR")
+CACHES = {
+    'default': (
+        {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': CACHE_DIR}
+        if CACHE_DIR else
+        {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    )
+}
+RESPONSE_CACHE_TIMEOUT = int(os.getenv("RESPONSE_CACHE_TIMEOUT", 3600))